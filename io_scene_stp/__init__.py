@@ -43,8 +43,10 @@ Issues:
 
 if "bpy" in locals():
     import importlib
-    if "stl_utils" in locals():
-        importlib.reload(stl_utils)
+    if "stp_utils" in locals():
+        importlib.reload(stp_utils)
+    if "stp_writer" in locals():
+        importlib.reload(stp_writer)
     if "blender_utils" in locals():
         importlib.reload(blender_utils)
 
@@ -57,6 +59,7 @@ from bpy.props import (
         CollectionProperty,
         EnumProperty,
         FloatProperty,
+        IntProperty,
         )
 from bpy_extras.io_utils import (
         ImportHelper,
@@ -112,8 +115,56 @@ class ImportSTP(Operator, ImportHelper, IOSTLOrientationHelper):
             default=False,
             )
 
+    use_parallel_faces = BoolProperty(
+            name="Parallel Faces",
+            description="Tessellate the faces of large solids in worker processes",
+            default=False,
+            )
+
+    use_parallel_solids = BoolProperty(
+            name="Parallel Solids",
+            description="Tessellate the solids of the file in worker processes",
+            default=False,
+            )
+
+    workers = IntProperty(
+            name="Workers",
+            description="Processes reading several files, and tessellating in parallel (all the cpus if 0)",
+            min=0, max=256,
+            default=0,
+            )
+
+    use_validate = BoolProperty(
+            name="Validate Meshes",
+            description="Check and fix the imported meshes, slow on big meshes",
+            default=False,
+            )
+
+    use_proxy = BoolProperty(
+            name="Proxies",
+            description="Import each solid as its bounding box, without tessellating it. "
+                        "Use Upgrade STP Proxies to get the full geometry of the selected objects",
+            default=False,
+            )
+
+    proxy_bounds = EnumProperty(
+            name="Proxy Bounds",
+            items=(('AABB', "Axis Aligned", "Boxes aligned to the axes"),
+                   ('OBB', "Oriented", "Boxes along the principal axes of each solid"),
+                   ),
+            default='AABB',
+            )
+
+    use_background = BoolProperty(
+            name="Background",
+            description="Read the files in a background process without blocking blender, "
+                        "the objects appear as they are tessellated (Esc to cancel)",
+            default=False,
+            )
+
     def execute(self, context):
         from . import stp_utils
+        from . import blender_utils
         from mathutils import Matrix
 
         paths = [os.path.join(self.directory, name.name)
@@ -139,15 +190,92 @@ class ImportSTP(Operator, ImportHelper, IOSTLOrientationHelper):
         if bpy.ops.object.select_all.poll():
             bpy.ops.object.select_all(action='DESELECT')
 
-        for path in paths:
-            stp_utils.read_stp(path)
-            # blender_utils.create_and_link_mesh(objName, tris, tri_nors, pts, global_matrix)
+        stp_utils.parallel_faces = self.use_parallel_faces
+        stp_utils.parallel_solids = self.use_parallel_solids
+        blender_utils.validate_mesh = self.use_validate
+        stp_utils.parallel_workers = self.workers
+        stp_utils.proxy_import = self.use_proxy
+        stp_utils.proxy_bounds = self.proxy_bounds
+
+        if self.use_background and stp_utils.is_parallel_available():
+            return self.start_background(context, paths)
+
+        blender_utils.import_stp_files(paths)
+        # blender_utils.create_and_link_mesh(objName, tris, tri_nors, pts, global_matrix)
 
         return {'FINISHED'}
 
+    def start_background(self, context, paths):
+        self._paths = list(paths)
+        self._count = len(paths)
+        self._job = None
+        wm = context.window_manager
+        self._timer = wm.event_timer_add(0.1, context.window)
+        wm.modal_handler_add(self)
+        wm.progress_begin(0, 100)
+        return {'RUNNING_MODAL'}
+
+    def modal(self, context, event):
+        from . import blender_utils
+
+        if event.type == 'ESC':
+            if self._job is not None:
+                self._job.cancel()
+            self.finish_background(context)
+            self.report({'WARNING'}, "STP import cancelled, the objects already read are kept")
+            return {'CANCELLED'}
+
+        if event.type != 'TIMER':
+            return {'PASS_THROUGH'}
+
+        if self._job is None or not self._job.poll():
+            if self._job is not None and self._job.error:
+                self.report({'ERROR'}, "Error reading %s: %s" % (self._job.filepath, self._job.error))
+            if not self._paths:
+                self.finish_background(context)
+                return {'FINISHED'}
+            self._job = blender_utils.BackgroundRead(self._paths.pop(0))
+
+        # the objects linked on poll are drawn on the next redraw
+        for area in context.screen.areas:
+            if area.type == 'VIEW_3D':
+                area.tag_redraw()
+
+        done = self._count - len(self._paths) - 1
+        context.window_manager.progress_update(100*(done + self._job.fraction)/self._count)
+        if context.area:
+            context.area.header_text_set("Importing STP %d/%d, %s (Esc to cancel)" % (
+                    done + 1, self._count, self._job.get_status()))
+        return {'RUNNING_MODAL'}
+
+    def finish_background(self, context):
+        wm = context.window_manager
+        wm.event_timer_remove(self._timer)
+        wm.progress_end()
+        if context.area:
+            context.area.header_text_set()
+
+
+class UpgradeSTPProxies(Operator):
+    """Replace the bounding boxes of the selected STP proxies by its full geometry"""
+    bl_idname = "import_stp.upgrade_proxies"
+    bl_label = "Upgrade STP Proxies"
+    bl_options = {'UNDO'}
+
+    @classmethod
+    def poll(cls, context):
+        return any(ob.type == 'MESH' and "stp_shape" in ob.data for ob in context.selected_objects)
+
+    def execute(self, context):
+        from . import blender_utils
 
-class ExportSTL(Operator, ExportHelper, IOSTLOrientationHelper):
-    """Save STL object data from current scene"""
+        upgraded = blender_utils.upgrade_proxies(context.selected_objects)
+        self.report({'INFO'}, "Upgraded %d STP proxies" % upgraded)
+        return {'FINISHED'}
+
+
+class ExportSTP(Operator, ExportHelper, IOSTLOrientationHelper):
+    """Save the meshes of the scene as a faceted brep STP file"""
     bl_idname = "export_scene.stp"
     bl_label = "Export STP"
 
@@ -170,11 +298,6 @@ class ExportSTL(Operator, ExportHelper, IOSTLOrientationHelper):
             description="Apply current scene's unit (as defined by unit scale) to exported data",
             default=False,
             )
-    ascii = BoolProperty(
-            name="Ascii",
-            description="Save the file in ASCII file format",
-            default=False,
-            )
     use_mesh_modifiers = BoolProperty(
             name="Apply Modifiers",
             description="Apply the modifiers before saving",
@@ -183,28 +306,22 @@ class ExportSTL(Operator, ExportHelper, IOSTLOrientationHelper):
     batch_mode = EnumProperty(
             name="Batch Mode",
             items=(('OFF', "Off", "All data in one file"),
-                   ('OBJECT', "Object", "Each object as a file"),
+                   ('OBJECT', "Object", "Each object as a file, written in parallel"),
                    ))
+    workers = IntProperty(
+            name="Workers",
+            description="Processes writing the files of the object batch mode (all the cpus if 0)",
+            min=0, max=256,
+            default=0,
+            )
 
     @property
     def check_extension(self):
         return self.batch_mode == 'OFF'
 
     def execute(self, context):
-        from . import stl_utils
         from . import blender_utils
-        import itertools
         from mathutils import Matrix
-        keywords = self.as_keywords(ignore=("axis_forward",
-                                            "axis_up",
-                                            "use_selection",
-                                            "global_scale",
-                                            "check_existing",
-                                            "filter_glob",
-                                            "use_scene_unit",
-                                            "use_mesh_modifiers",
-                                            "batch_mode"
-                                            ))
 
         scene = context.scene
         if self.use_selection:
@@ -222,18 +339,10 @@ class ExportSTL(Operator, ExportHelper, IOSTLOrientationHelper):
                                         ).to_4x4() * Matrix.Scale(global_scale, 4)
 
         if self.batch_mode == 'OFF':
-            faces = itertools.chain.from_iterable(
-                    blender_utils.faces_from_mesh(ob, global_matrix, self.use_mesh_modifiers)
-                    for ob in data_seq)
-
-            stl_utils.write_stl(faces=faces, **keywords)
+            blender_utils.export_stp_file(self.filepath, data_seq, global_matrix, self.use_mesh_modifiers)
         elif self.batch_mode == 'OBJECT':
             prefix = os.path.splitext(self.filepath)[0]
-            keywords_temp = keywords.copy()
-            for ob in data_seq:
-                faces = blender_utils.faces_from_mesh(ob, global_matrix, self.use_mesh_modifiers)
-                keywords_temp["filepath"] = prefix + bpy.path.clean_name(ob.name) + ".stl"
-                stl_utils.write_stl(faces=faces, **keywords_temp)
+            blender_utils.export_stp_files(prefix, data_seq, global_matrix, self.use_mesh_modifiers, self.workers)
 
         return {'FINISHED'}
 
@@ -242,23 +351,28 @@ def menu_import(self, context):
     self.layout.operator(ImportSTP.bl_idname, text="Stp (.stp)")
 
 
+def menu_upgrade_proxies(self, context):
+    self.layout.operator(UpgradeSTPProxies.bl_idname)
+
+
 def menu_export(self, context):
-    default_path = os.path.splitext(bpy.data.filepath)[0] + ".stl"
-    self.layout.operator(ExportSTL.bl_idname, text="Stl (.stl)")
+    self.layout.operator(ExportSTP.bl_idname, text="Stp (.stp)")
 
 
 def register():
     bpy.utils.register_module(__name__)
 
     bpy.types.INFO_MT_file_import.append(menu_import)
-    ## bpy.types.INFO_MT_file_export.append(menu_export)
+    bpy.types.VIEW3D_MT_object.append(menu_upgrade_proxies)
+    bpy.types.INFO_MT_file_export.append(menu_export)
 
 
 def unregister():
     bpy.utils.unregister_module(__name__)
 
     bpy.types.INFO_MT_file_import.remove(menu_import)
-    ## bpy.types.INFO_MT_file_export.remove(menu_export)
+    bpy.types.VIEW3D_MT_object.remove(menu_upgrade_proxies)
+    bpy.types.INFO_MT_file_export.remove(menu_export)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,408 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# <pep8 compliant>
+
+"""
+Blender objects of the STP files read by stp_utils
+"""
+
+import multiprocessing
+import queue
+import time
+
+import bpy
+import numpy as np
+
+try:
+    from . import stp_utils
+    from . import stp_writer
+except ImportError:
+    import stp_utils
+    import stp_writer
+
+'''
+validate the blender meshes after creating them, slow on big meshes
+'''
+validate_mesh = 0
+
+'''
+blender materials of the colours, shared by all the imported files
+material_cache[colour] = material name
+'''
+material_cache = {}
+
+'''
+blender objects created for the current file, linked to the scene at once by link_created_objects
+'''
+created_objects = []
+
+
+### MATERIALS ###
+
+'''
+blender material of a colour, created once and reused while it exists
+'''
+def get_blender_material(colour):
+    if colour is None:
+        return None
+    material = bpy.data.materials.get(material_cache.get(colour, ""))
+    if material is None:
+        material = bpy.data.materials.new("STP %02X%02X%02X" % colour)
+        material.diffuse_color = [c/255.0 for c in colour]
+        material_cache[colour] = material.name
+    return material
+
+
+### OBJECTS ###
+
+'''
+blender mesh of an object of stp_utils.collected_objects, filled with foreach_set from the flat arrays
+the edges of the faces are added by update, the mesh is only validated if validate_mesh is set
+'''
+def create_blender_mesh(data):
+    name, shape, verts, edges, flat, lengths, materials = data
+
+    me = bpy.data.meshes.new(name)
+    me.vertices.add(len(verts))
+    me.vertices.foreach_set("co", verts.astype(np.float32).ravel())
+    me.edges.add(len(edges))
+    me.edges.foreach_set("vertices", edges.astype(np.int32).ravel())
+    me.loops.add(len(flat))
+    me.loops.foreach_set("vertex_index", flat.astype(np.int32))
+    me.polygons.add(len(lengths))
+    me.polygons.foreach_set("loop_start", (np.cumsum(lengths) - lengths).astype(np.int32))
+    me.polygons.foreach_set("loop_total", lengths.astype(np.int32))
+
+    if materials is not None:
+        face_materials, colours = materials
+        for colour in colours:
+            me.materials.append(get_blender_material(colour))
+        me.polygons.foreach_set("material_index", face_materials)
+
+    if validate_mesh:
+        me.validate()
+    me.update(calc_edges=True)
+    return me
+
+'''
+blender object of an object of stp_utils.collected_objects, read from filepath
+proxy meshes are marked with its source, see upgrade_proxies
+'''
+def create_blender_object(data, filepath):
+    me = create_blender_mesh(data)
+    if stp_utils.proxy_import and not data[1] in stp_utils.full_shapes:
+        set_proxy_source(me, filepath, data[1])
+    ob = bpy.data.objects.new(data[0], me)
+    created_objects.append(ob)
+    return ob
+
+'''
+places an object on its occurrences of the product tree
+the first occurrence moves the object, the others are linked duplicates sharing its mesh
+'''
+def place_occurrences(ob, occurrences):
+    from mathutils import Matrix
+    for i, (name, transform) in enumerate(occurrences):
+        if i > 0:
+            ob = bpy.data.objects.new(name or ob.name, ob.data)
+            created_objects.append(ob)
+        ob.matrix_world = Matrix(transform.tolist())
+
+'''
+links the objects created for a file to the scene, at once and parented to an empty named name
+the objects are selected and the empty is made active at the end
+'''
+def link_created_objects(name):
+    if not created_objects:
+        return None
+
+    scn = bpy.context.scene
+    parent = bpy.data.objects.new(name, None)
+    scn.objects.link(parent)
+    for ob in created_objects:
+        ob.parent = parent
+        scn.objects.link(ob)
+        ob.select = True
+
+    parent.select = True
+    scn.objects.active = parent
+    scn.update()
+    del created_objects[:]
+    return parent
+
+
+### IMPORT ###
+
+'''
+creates the blender objects of a file read by stp_utils.read_stp, returns its parent empty
+'''
+def import_stp_result(result):
+    if result is None:
+        return None
+    filepath, name, objects, occurrences = result
+    del created_objects[:]
+    obs = [create_blender_object(data, filepath) for data in objects]
+    for i, object_occurrences in occurrences.items():
+        place_occurrences(obs[i], object_occurrences)
+    return link_created_objects(name)
+
+'''
+imports a file, each object is created as soon as its solids are tessellated, see stp_utils.iter_stp
+the file is read at once by read_stp when its solids are tessellated in parallel
+'''
+def import_stp_file(filepath):
+    if stp_utils.parallel_solids and not stp_utils.proxy_import and stp_utils.is_parallel_available():
+        return import_stp_result(stp_utils.read_stp(filepath))
+
+    del created_objects[:]
+    for index, data, occurrences in stp_utils.iter_stp(filepath):
+        place_occurrences(create_blender_object(data, filepath), occurrences)
+    return link_created_objects(stp_utils.get_file_object_name(filepath))
+
+'''
+imports several files, parsed and tessellated on parallel_workers processes (all the cpus if 0)
+the blender objects of each file are created on this process, as soon as the file is read
+'''
+def import_stp_files(filepaths):
+    if len(filepaths) < 2 or stp_utils.parallel_workers == 1 or not stp_utils.is_parallel_available():
+        for filepath in filepaths:
+            import_stp_file(filepath)
+        return
+
+    context = multiprocessing.get_context("fork")
+    pool = context.Pool(stp_utils.parallel_workers or None, stp_utils.init_tessellation_worker,
+                        (stp_utils.get_tessellation_settings(),))
+    try:
+        for i, result in enumerate(pool.imap_unordered(stp_utils.read_stp_job, filepaths)):
+            if result is not None:
+                print ("Read file %d/%d %s" % (i + 1, len(filepaths), result[0]))
+            import_stp_result(result)
+    finally:
+        pool.close()
+        pool.join()
+
+
+### EXPORT ###
+
+'''
+(name, verts, flat faces, face lengths) of the mesh of an object, transformed by global_matrix and its world matrix
+None for the objects without geometry
+'''
+def get_mesh_buffers(ob, global_matrix, use_mesh_modifiers):
+    if ob.type not in ('MESH', 'CURVE', 'SURFACE', 'FONT', 'META'):
+        return None
+    me = ob.to_mesh(bpy.context.scene, use_mesh_modifiers, 'PREVIEW')
+    if me is None:
+        return None
+    matrix = global_matrix * ob.matrix_world
+    me.transform(matrix)
+
+    verts = np.empty(len(me.vertices)*3)
+    me.vertices.foreach_get("co", verts)
+    starts = np.empty(len(me.polygons), dtype=np.int32)
+    me.polygons.foreach_get("loop_start", starts)
+    lengths = np.empty(len(me.polygons), dtype=np.int32)
+    me.polygons.foreach_get("loop_total", lengths)
+    loops = np.empty(len(me.loops), dtype=np.int32)
+    me.loops.foreach_get("vertex_index", loops)
+    bpy.data.meshes.remove(me)
+
+    # loops of each face in order, reversed if the matrix mirrors the mesh
+    i = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    if matrix.is_negative:
+        i = lengths.repeat(lengths) - 1 - i
+    flat = loops[np.repeat(starts, lengths) + i]
+    return ob.name, verts.reshape(-1, 3), flat, lengths
+
+'''
+writes the meshes of the objects on a single file
+the meshes are taken from blender while the file is written, one at a time
+'''
+def export_stp_file(filepath, obs, global_matrix, use_mesh_modifiers):
+    meshes = (get_mesh_buffers(ob, global_matrix, use_mesh_modifiers) for ob in obs)
+    stp_writer.write_stp(filepath, (mesh for mesh in meshes if mesh is not None))
+
+'''
+writes each object on its own file, named prefix + object name, on workers processes (all the cpus if 0)
+'''
+def export_stp_files(prefix, obs, global_matrix, use_mesh_modifiers, workers=0):
+    files = []
+    for ob in obs:
+        mesh = get_mesh_buffers(ob, global_matrix, use_mesh_modifiers)
+        if mesh is not None:
+            files.append((prefix + bpy.path.clean_name(ob.name) + ".stp", [mesh]))
+    stp_writer.write_stp_files(files, workers)
+
+
+### PROXIES ###
+
+'''
+marks a proxy mesh with the file and the shape representation it comes from, see upgrade_proxies
+the mesh is shared by the linked duplicates of the object
+'''
+def set_proxy_source(me, filepath, shape):
+    me["stp_file"] = filepath
+    me["stp_shape"] = shape
+
+'''
+replaces the proxy meshes of the objects by the full tessellation of its shapes
+each file is read once, only the solids of the upgraded shapes are tessellated
+returns the number of upgraded meshes
+'''
+def upgrade_proxies(obs):
+    sources = {}
+    for ob in obs:
+        me = ob.data
+        if ob.type == 'MESH' and "stp_shape" in me:
+            sources.setdefault(me["stp_file"], {})[me["stp_shape"]] = me
+
+    upgraded = 0
+    saved = stp_utils.proxy_import, stp_utils.full_shapes, stp_utils.parallel_solids
+    try:
+        for filepath, meshes in sources.items():
+            stp_utils.proxy_import, stp_utils.full_shapes, stp_utils.parallel_solids = 1, set(meshes), 0
+            if stp_utils.read_stp(filepath) is None:
+                continue
+            for shape, proxy in meshes.items():
+                if stp_utils.imported_shapes.get(shape) is None:
+                    print ("Shape " + shape + " not found on " + filepath)
+                    continue
+                me = create_blender_mesh(stp_utils.collected_objects[stp_utils.imported_shapes[shape]])
+                proxy.user_remap(me)
+                bpy.data.meshes.remove(proxy)
+                upgraded = upgraded + 1
+    finally:
+        stp_utils.proxy_import, stp_utils.full_shapes, stp_utils.parallel_solids = saved
+    return upgraded
+
+
+### BACKGROUND READING ###
+
+'''
+file read on a forked process, without blocking blender
+poll must be called periodically, the objects are created and linked under an empty named as the file
+as soon as they arrive, and placed on the occurrences of the assembly at the end
+'''
+class BackgroundRead:
+    def __init__(self, filepath):
+        context = multiprocessing.get_context("fork")
+        self.filepath = filepath
+        self.name = stp_utils.get_file_object_name(filepath)
+        self.messages = context.Queue()
+        self.process = context.Process(target=stp_utils.read_stp_background_job, args=(filepath, self.messages))
+        self.process.daemon = True
+        self.process.start()
+
+        self.phase = "lex"
+        self.done = 0
+        self.total = 0
+        self.objects = {}
+        self.parent = None
+        self.linked = False
+        self.error = None
+        self.finished = False
+
+    '''
+    fraction of the file read, the lexing is taken as the first 20%
+    '''
+    @property
+    def fraction(self):
+        if self.finished:
+            return 1.0
+        if self.phase == "lex":
+            return 0.2*self.done/self.total if self.total else 0.0
+        return 0.2 + (0.8*self.done/self.total if self.total else 0.0)
+
+    def get_status(self):
+        if self.phase == "lex":
+            return "%s: lex %d%%" % (self.name, 100*self.fraction/0.2)
+        return "%s: %s %d/%d solids" % (self.name, self.phase, self.done, self.total)
+
+    '''
+    handles the messages arrived, for up to timeout seconds
+    returns False once the file is read
+    '''
+    def poll(self, timeout=0.05):
+        start = time.time()
+        while not self.finished and time.time() - start < timeout:
+            try:
+                message = self.messages.get_nowait()
+            except queue.Empty:
+                if self.process.is_alive():
+                    break
+                try:
+                    # the last messages can still be on the pipe
+                    message = self.messages.get(timeout=1.0)
+                except queue.Empty:
+                    self.error = "Reading process exited with code %s" % self.process.exitcode
+                    self.finish()
+                    break
+            self.handle_message(message)
+        if self.linked:
+            bpy.context.scene.update()
+            self.linked = False
+        return not self.finished
+
+    def handle_message(self, message):
+        if message[0] == "progress":
+            self.phase, self.done, self.total = message[1:]
+        elif message[0] == "object":
+            self.phase = "mesh build"
+            del created_objects[:]
+            self.objects[message[1]] = create_blender_object(message[2], self.filepath)
+            self.link_created_objects()
+        elif message[0] == "done":
+            del created_objects[:]
+            for i, object_occurrences in message[1].items():
+                place_occurrences(self.objects[i], object_occurrences)
+            self.link_created_objects()
+            self.finish()
+        elif message[0] == "error":
+            self.error = message[1]
+            self.finish()
+
+    def link_created_objects(self):
+        scn = bpy.context.scene
+        if self.parent is None:
+            self.parent = bpy.data.objects.new(self.name, None)
+            scn.objects.link(self.parent)
+        for ob in created_objects:
+            ob.parent = self.parent
+            scn.objects.link(ob)
+            ob.select = True
+        del created_objects[:]
+        self.linked = True
+
+    def finish(self):
+        self.finished = True
+        if self.error:
+            print ("Error reading " + self.filepath + ": " + self.error)
+        if self.parent is not None:
+            self.parent.select = True
+            bpy.context.scene.objects.active = self.parent
+        self.process.join(1.0)
+
+    '''
+    stops the reading process, the objects already created are kept
+    '''
+    def cancel(self):
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process.join()
+        self.finished = True
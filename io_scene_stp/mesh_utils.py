@@ -0,0 +1,490 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# <pep8 compliant>
+
+"""
+Mesh operations on plain NumPy arrays, without blender dependencies
+"""
+
+import itertools
+
+import numpy as np
+
+
+### WELDING ###
+
+'''
+offsets to the 13 neighbour cells after a cell, each pair of neighbour cells is visited once
+'''
+neighbour_offsets = np.array([d for d in itertools.product((-1, 0, 1), repeat=3) if d > (0, 0, 0)], dtype=np.int64)
+
+'''
+index on cells of the neighbour of each cell on offset, -1 if it has no verts
+the cells are numbered by a scalar key while it fits on 64 bits, or together with its neighbours
+'''
+def get_neighbour_cells(cells, offset):
+    low = cells.min(axis=0) - 1
+    size = cells.max(axis=0) - low + 2
+    if np.prod(size.astype(float)) < 2.0**62:
+        scale = np.array([size[1]*size[2], size[2], 1], dtype=np.int64)
+        keys = (cells - low) @ scale
+        # the cells are sorted by their key, as they come from a lexsort of the verts
+        neighbour = keys + offset @ scale
+        found = np.minimum(np.searchsorted(keys, neighbour), len(keys) - 1)
+        return np.where(keys[found] == neighbour, found, -1)
+
+    ids = np.unique(np.concatenate((cells, cells + offset)), axis=0, return_inverse=True)[1].reshape(-1)
+    cell_of_id = np.full(ids.max() + 1, -1)
+    cell_of_id[ids[:len(cells)]] = np.arange(len(cells))
+    return cell_of_id[ids[len(cells):]]
+
+'''
+pairs of verts closer than tolerance, as two arrays of indices
+the verts are hashed on cells of size tolerance, and each vert is compared with the verts
+of its own cell and of the 26 neighbour cells, the only ones its tolerance sphere can reach
+'''
+def get_close_pairs(verts, tolerance):
+    keys = np.floor(verts/tolerance).astype(np.int64)
+    order = np.lexsort(keys.T[::-1])
+    keys = keys[order]
+    starts = np.flatnonzero(np.concatenate(([True], np.any(keys[1:] != keys[:-1], axis=1))))
+    counts = np.diff(np.append(starts, len(keys)))
+    cells = keys[starts]
+
+    a_cells = [np.arange(len(cells))]
+    b_cells = [np.arange(len(cells))]
+    for offset in neighbour_offsets:
+        neighbour = get_neighbour_cells(cells, offset)
+        found = np.flatnonzero(neighbour >= 0)
+        a_cells.append(found)
+        b_cells.append(neighbour[found])
+    a_cells = np.concatenate(a_cells)
+    b_cells = np.concatenate(b_cells)
+
+    # every vert of a cell with every vert of the other cell
+    n = counts[a_cells]*counts[b_cells]
+    r = np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)
+    a = order[np.repeat(starts[a_cells], n) + r // np.repeat(counts[b_cells], n)]
+    b = order[np.repeat(starts[b_cells], n) + r % np.repeat(counts[b_cells], n)]
+    close = (a < b) | (np.repeat(a_cells != b_cells, n) & (a != b))
+    a = a[close]
+    b = b[close]
+    close = ((verts[a] - verts[b])**2).sum(axis=1) <= tolerance*tolerance
+    return a[close], b[close]
+
+
+'''
+lowest vert of the cluster of each vert, the clusters are joined by the pairs
+'''
+def get_pair_clusters(count, a, b):
+    cluster = np.arange(count)
+    while True:
+        low = np.minimum(cluster[a], cluster[b])
+        previous = cluster.copy()
+        np.minimum.at(cluster, a, low)
+        np.minimum.at(cluster, b, low)
+        # every vert points to the lowest one of its cluster found so far
+        while True:
+            root = cluster[cluster]
+            if np.array_equal(root, cluster):
+                break
+            cluster = root
+        if np.array_equal(cluster, previous):
+            return cluster
+
+
+'''
+merges the verts closer than tolerance, with a spatial hash (see get_close_pairs)
+verts joined by a chain of close pairs are merged on a single vert
+each merged vert keeps the position of the first vert of its cluster
+returns (merged verts, index of the merged vert of each vert)
+'''
+def weld_vertices(verts, tolerance):
+    verts = np.asarray(verts, dtype=float).reshape(-1, 3)
+    if not len(verts) or not tolerance:
+        return verts, np.arange(len(verts))
+
+    cluster = get_pair_clusters(len(verts), *get_close_pairs(verts, tolerance))
+
+    # clusters in order of their first vert
+    first = np.unique(cluster)
+    return verts[first], np.searchsorted(first, cluster)
+
+
+'''
+flat array of indices and lengths of a list of faces
+'''
+def flatten_faces(faces):
+    lengths = np.fromiter((len(f) for f in faces), dtype=int, count=len(faces))
+    flat = np.fromiter(itertools.chain.from_iterable(faces), dtype=int, count=lengths.sum())
+    return flat, lengths
+
+
+'''
+list of faces, from the flat indices and the lengths
+'''
+def split_faces(flat, lengths):
+    flat = flat.tolist()
+    ends = np.cumsum(lengths).tolist()
+    return [flat[e - l:e] for e, l in zip(ends, lengths.tolist())]
+
+
+'''
+remaps the verts of the faces (flat indices and lengths)
+repeated consecutive verts are removed, and faces left with less than 3 verts are dropped
+returns (flat, lengths) of the remapped faces, and the indices of the faces kept
+'''
+def remap_faces(flat, lengths, remap):
+    kept = np.flatnonzero(lengths > 0)
+    flat = remap[flat]
+    lengths = lengths[kept]
+    if not len(lengths):
+        return flat[:0], lengths, kept
+
+    # previous vert on the face, the last one for the first vert
+    starts = np.cumsum(lengths) - lengths
+    prev = np.roll(flat, 1)
+    prev[starts] = flat[starts + lengths - 1]
+    keep = flat != prev
+
+    face = np.repeat(np.arange(len(lengths)), lengths)
+    flat = flat[keep]
+    lengths = np.bincount(face[keep], minlength=len(lengths))
+
+    valid = lengths >= 3
+    return flat[np.repeat(valid, lengths)], lengths[valid], kept[valid]
+
+
+'''
+remaps the verts of the edges, the collapsed ones are dropped
+'''
+def remap_edges(edges, remap):
+    edges = remap[np.asarray(edges, dtype=int).reshape(-1, 2)]
+    return edges[edges[:, 0] != edges[:, 1]]
+
+
+'''
+welds the verts of a mesh, closer than tolerance
+returns (verts, edges, faces), faces as a list of lists
+'''
+def weld_mesh(verts, edges, faces, tolerance):
+    verts, remap = weld_vertices(verts, tolerance)
+    flat, lengths, kept = remap_faces(*flatten_faces(faces), remap)
+    return verts, remap_edges(edges, remap), split_faces(flat, lengths)
+
+
+### MESH BUFFER ###
+
+'''
+array of rows of width values, grown by doubling its capacity
+only the first count rows are used
+'''
+class GrowableArray:
+    def __init__(self, width, dtype, capacity=256):
+        self.width = width
+        self.count = 0
+        self.data = np.empty((capacity, width), dtype=dtype)
+
+    def __len__(self):
+        return self.count
+
+    '''
+    room for size more rows, the capacity is at least doubled to amortize the copies
+    '''
+    def reserve(self, size):
+        needed = self.count + size
+        if needed <= len(self.data):
+            return
+        data = np.empty((max(needed, 2*len(self.data)), self.width), dtype=self.data.dtype)
+        data[:self.count] = self.data[:self.count]
+        self.data = data
+
+    '''
+    appends a row, returns its index
+    '''
+    def append(self, row):
+        self.reserve(1)
+        self.data[self.count] = row
+        self.count += 1
+        return self.count - 1
+
+    '''
+    appends the rows of values (anything convertible to an array of rows)
+    returns the index of the first one
+    '''
+    def extend(self, values):
+        values = np.asarray(values, dtype=self.data.dtype).reshape(-1, self.width)
+        first = self.count
+        self.reserve(len(values))
+        self.data[first:first + len(values)] = values
+        self.count += len(values)
+        return first
+
+    '''
+    view of the used rows
+    '''
+    @property
+    def array(self):
+        return self.data[:self.count]
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes
+
+    def clear(self):
+        self.count = 0
+
+
+'''
+verts, edges and faces of the mesh of an object
+verts are float64 and indices int32, on growable arrays
+triangles and quads are kept on its own arrays, the other faces as flat indices and lengths
+each face has a colour, the value of colour when it was added (-1 for no colour)
+'''
+class MeshBuffer:
+    def __init__(self):
+        self.verts = GrowableArray(3, np.float64)
+        self.edges = GrowableArray(2, np.int32)
+        self.tris = GrowableArray(3, np.int32)
+        self.quads = GrowableArray(4, np.int32)
+        self.ngon_verts = GrowableArray(1, np.int32)
+        self.ngon_lengths = GrowableArray(1, np.int32)
+        self.tri_colours = GrowableArray(1, np.int32)
+        self.quad_colours = GrowableArray(1, np.int32)
+        self.ngon_colours = GrowableArray(1, np.int32)
+        self.colour = -1
+
+    @property
+    def vert_count(self):
+        return len(self.verts)
+
+    @property
+    def face_count(self):
+        return len(self.tris) + len(self.quads) + len(self.ngon_lengths)
+
+    '''
+    appends a vert, returns its index
+    '''
+    def add_vert(self, vert):
+        return self.verts.append(vert)
+
+    '''
+    appends an array of verts, returns the index of the first one
+    '''
+    def add_verts(self, verts):
+        return self.verts.extend(verts)
+
+    def add_edges(self, edges):
+        self.edges.extend(edges)
+
+    '''
+    appends a face of any number of verts
+    '''
+    def add_face(self, face):
+        face = list(face)
+        if len(face) == 3:
+            self.tris.append(face)
+            self.tri_colours.append(self.colour)
+        elif len(face) == 4:
+            self.quads.append(face)
+            self.quad_colours.append(self.colour)
+        elif len(face) > 4:
+            self.ngon_verts.extend(face)
+            self.ngon_lengths.append(len(face))
+            self.ngon_colours.append(self.colour)
+
+    '''
+    appends a list of faces
+    arrays of triangles or quads are stored at once, without iterating the faces
+    '''
+    def add_faces(self, faces):
+        if isinstance(faces, np.ndarray) and faces.ndim == 2:
+            if faces.shape[1] == 3:
+                self.tris.extend(faces)
+                self.tri_colours.extend(np.full(len(faces), self.colour))
+                return
+            if faces.shape[1] == 4:
+                self.quads.extend(faces)
+                self.quad_colours.extend(np.full(len(faces), self.colour))
+                return
+        for face in faces:
+            self.add_face(face)
+
+    '''
+    flat indices and lengths of the faces, the triangles first, then the quads and the ngons
+    '''
+    def get_flat_faces(self):
+        flat = np.concatenate((self.tris.array.ravel(), self.quads.array.ravel(),
+                               self.ngon_verts.array.ravel()))
+        lengths = np.concatenate((np.full(len(self.tris), 3, dtype=np.int32),
+                                  np.full(len(self.quads), 4, dtype=np.int32),
+                                  self.ngon_lengths.array.ravel()))
+        return flat, lengths
+
+    '''
+    colour of each face, in the order of get_flat_faces
+    '''
+    def get_face_colours(self):
+        return np.concatenate((self.tri_colours.array.ravel(), self.quad_colours.array.ravel(),
+                               self.ngon_colours.array.ravel()))
+
+    '''
+    faces as a list of lists, in the order of get_flat_faces
+    '''
+    def get_faces(self):
+        return split_faces(*self.get_flat_faces())
+
+    '''
+    appends faces given as flat indices and lengths, sorted by its number of verts
+    colours of the faces, or colour for all of them if not given
+    '''
+    def add_flat_faces(self, flat, lengths, colours=None):
+        if colours is None:
+            colours = np.full(len(lengths), self.colour)
+        starts = np.cumsum(lengths) - lengths
+        for n, target, target_colours in ((3, self.tris, self.tri_colours), (4, self.quads, self.quad_colours)):
+            s = starts[lengths == n]
+            target.extend(flat[s[:, None] + np.arange(n)])
+            target_colours.extend(colours[lengths == n])
+        ngons = lengths > 4
+        self.ngon_verts.extend(flat[np.repeat(ngons, lengths)])
+        self.ngon_lengths.extend(lengths[ngons])
+        self.ngon_colours.extend(colours[ngons])
+
+    '''
+    replaces the faces by the ones given as flat indices and lengths
+    '''
+    def set_flat_faces(self, flat, lengths, colours=None):
+        for a in (self.tris, self.quads, self.ngon_verts, self.ngon_lengths,
+                  self.tri_colours, self.quad_colours, self.ngon_colours):
+            a.clear()
+        self.add_flat_faces(flat, lengths, colours)
+
+    '''
+    merges the verts closer than tolerance, updating the edges and faces
+    '''
+    def weld(self, tolerance):
+        verts, remap = weld_vertices(self.verts.array, tolerance)
+        flat, lengths, kept = remap_faces(*self.get_flat_faces(), remap)
+        colours = self.get_face_colours()[kept]
+        edges = remap_edges(self.edges.array, remap)
+        self.verts.clear()
+        self.verts.extend(verts)
+        self.edges.clear()
+        self.edges.extend(edges)
+        self.set_flat_faces(flat, lengths, colours)
+
+    '''
+    allocated bytes of all the arrays
+    '''
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in (self.verts, self.edges, self.tris, self.quads,
+                                      self.ngon_verts, self.ngon_lengths, self.tri_colours,
+                                      self.quad_colours, self.ngon_colours))
+
+    def memory_report(self):
+        return "%d verts, %d edges, %d faces (%d tris, %d quads, %d ngons), %.1f KiB" % (
+            self.vert_count, len(self.edges), self.face_count, len(self.tris),
+            len(self.quads), len(self.ngon_lengths), self.nbytes/1024.0)
+
+
+### FILE WRITERS ###
+
+'''
+triangles of the faces (flat indices and lengths), as fans from the first vert of each face
+'''
+def triangulate_faces(flat, lengths):
+    lengths = np.asarray(lengths)
+    counts = np.maximum(lengths - 2, 0)
+    starts = np.repeat(np.cumsum(lengths) - lengths, counts)
+    # index of each triangle on its face
+    i = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return np.column_stack((flat[starts], flat[starts + i + 1], flat[starts + i + 2]))
+
+'''
+faces grouped by its number of verts, yields (number of verts, faces as rows)
+'''
+def get_faces_by_length(flat, lengths):
+    starts = np.cumsum(lengths) - lengths
+    for n in np.unique(lengths):
+        s = starts[lengths == n]
+        yield n, flat[s[:, None] + np.arange(n)]
+
+'''
+verts, flat faces and face lengths of several meshes, on a single mesh
+meshes is a list of (name, verts, flat faces, face lengths)
+'''
+def merge_meshes(meshes):
+    offsets = np.cumsum([0] + [len(verts) for name, verts, flat, lengths in meshes])
+    verts = np.concatenate([verts for name, verts, flat, lengths in meshes] + [np.zeros((0, 3))])
+    flat = np.concatenate([flat + o for (name, verts, flat, lengths), o in zip(meshes, offsets)] +
+                          [np.zeros(0, dtype=int)])
+    lengths = np.concatenate([lengths for name, verts, flat, lengths in meshes] + [np.zeros(0, dtype=int)])
+    return verts, flat.astype(np.int64), lengths.astype(np.int64)
+
+'''
+writes the meshes on a wavefront obj file, an object for each mesh
+'''
+def write_obj(filepath, meshes):
+    first = 1
+    with open(filepath, "wb") as f:
+        for name, verts, flat, lengths in meshes:
+            f.write(("o %s\n" % name.replace(" ", "_")).encode("utf-8"))
+            np.savetxt(f, verts, fmt="v %.6f %.6f %.6f")
+            for n, faces in get_faces_by_length(flat, lengths):
+                np.savetxt(f, faces + first, fmt="f" + " %d"*n)
+            first = first + len(verts)
+
+'''
+writes the meshes on a binary stl file, the faces are triangulated
+'''
+def write_stl(filepath, meshes):
+    verts, flat, lengths = merge_meshes(meshes)
+    tris = verts[triangulate_faces(flat, lengths)]
+    normals = np.cross(tris[:, 1] - tris[:, 0], tris[:, 2] - tris[:, 0])
+    norm = np.sqrt((normals**2).sum(axis=1))
+    normals[norm > 0] /= norm[norm > 0, None]
+
+    records = np.zeros(len(tris), dtype=[("normal", "<f4", 3), ("verts", "<f4", (3, 3)), ("attr", "<u2")])
+    records["normal"] = normals
+    records["verts"] = tris
+    with open(filepath, "wb") as f:
+        f.write(b"Binary STL".ljust(80, b" "))
+        f.write(np.uint32(len(records)).tobytes())
+        f.write(records.tobytes())
+
+'''
+writes the meshes on a binary ply file, as a single mesh
+'''
+def write_ply(filepath, meshes):
+    verts, flat, lengths = merge_meshes(meshes)
+    header = ("ply\nformat binary_little_endian 1.0\n"
+              "element vertex %d\nproperty float x\nproperty float y\nproperty float z\n"
+              "element face %d\nproperty list %s int vertex_indices\nend_header\n")
+    count = ("uchar", "u1") if len(lengths) == 0 or lengths.max() < 256 else ("uint", "<u4")
+    header = header % (len(verts), len(lengths), count[0])
+    with open(filepath, "wb") as f:
+        f.write(header.encode("ascii"))
+        f.write(verts.astype("<f4").tobytes())
+        for n, faces in get_faces_by_length(flat, lengths):
+            records = np.zeros(len(faces), dtype=[("n", count[1]), ("verts", "<i4", n)])
+            records["n"] = n
+            records["verts"] = faces
+            f.write(records.tobytes())
@@ -0,0 +1,1023 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# <pep8 compliant>
+
+"""
+Benchmarks of the STP importer hot paths
+
+Run inside blender:
+    blender --background --python stp_benchmark.py -- [benchmark names]
+
+With no names, all the benchmarks are run.
+"""
+
+import contextlib
+import glob
+import io
+import math
+import multiprocessing
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import timeit
+import tracemalloc
+
+import numpy as np
+
+if __package__:
+    from . import stp_utils
+    from . import stp_writer
+    from . import mesh_utils
+else:
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import stp_utils
+    import stp_writer
+    import mesh_utils
+
+test_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_files")
+
+'''
+list of (name, function) with the available benchmarks
+'''
+benchmarks = []
+
+
+def benchmark(func):
+    benchmarks.append((func.__name__, func))
+    return func
+
+
+'''
+prints the time per call of func, in ms
+'''
+def bench(name, func, number=100):
+    t = timeit.timeit(func, number=number)
+    print("%-50s %10.3f ms" % (name, t*1000.0/number))
+    return t/number
+
+
+def import_blender_utils():
+    try:
+        from . import blender_utils
+    except ImportError:
+        import blender_utils
+    return blender_utils
+
+
+def reset_mesh():
+    stp_utils.mesh = mesh_utils.MeshBuffer()
+    stp_utils.vertex_ids.clear()
+
+
+### TESSELLATION ###
+
+'''
+reference, the circular primitives before the shared tables: math.sin/math.cos and a matmul
+for every sample, on vertex, edge and face lists (copied from the importer, prec was fixed to 32)
+'''
+def baseline_circle_verts(pm, r, prec=32):
+    verts = []
+    for i in range(0, prec):
+        a = ((math.pi*2)/prec)*i
+        v4 = [math.cos(a)*r, math.sin(a)*r, 0.0, 1.0]
+        v4 = np.matmul(v4, pm)
+        verts.append(stp_utils.convert_v4_to_v3(v4))
+    return verts
+
+
+def baseline_torus_faces(instance, vertexs, edges, faces, prec=32):
+    iv = len(vertexs)
+    r1 = stp_utils.get_instance_value(instance, "r1")
+    r2 = stp_utils.get_instance_value(instance, "r2")
+    pm = stp_utils.get_matrix_from_axis2_placement_3d(stp_utils.get_instance_value(instance, "axis2_placement3d"))
+    last = prec - 1
+    for i in range(0, prec):
+        a1 = ((math.pi*2)/prec)*i
+        tm = [[1.0, 0.0, 0.0, 0.0], [0.0, 1.0, 0.0, 0.0], [0.0, 0.0, 1.0, 0.0], [r1, 0.0, 0.0, 1.0]]
+        rm = stp_utils.rotation_matrix(a1)
+        rm = np.matmul(rm, pm)
+        tm = np.matmul(tm, rm)
+        for j in range(0, prec):
+            a2 = ((math.pi*2)/prec)*j
+            v4 = [math.cos(a2)*r2, 0.0, math.sin(a2)*r2, 1.0]
+            v4 = np.matmul(v4, tm)
+
+            vertexs.append(stp_utils.convert_v4_to_v3(v4))
+
+            if j == last:
+                edges.append([iv+i*prec+j, iv+i*prec+1])
+                if i == last:
+                    faces.append([iv+i*prec+j, iv+j, iv, iv+i*prec])
+                else:
+                    faces.append([iv+i*prec+j, iv+(i+1)*prec+j, iv+(i+1)*prec, iv+i*prec])
+            else:
+                edges.append([iv+i*prec+j, iv+i*prec+j+1])
+                if i == last:
+                    edges.append([iv+i*prec+j, iv+j])
+                    faces.append([iv+i*prec+j, iv+j, iv+j+1, iv+i*prec+j+1])
+                else:
+                    edges.append([iv+i*prec+j, iv+(i+1)*prec+j])
+                    faces.append([iv+i*prec+j, iv+(i+1)*prec+j, iv+(i+1)*prec+j+1, iv+i*prec+j+1])
+
+
+def baseline_spherical_surface(pm, r, vertexs, faces, prec=32):
+    h = [0, 0, 0]
+    pm3 = stp_utils.convert_m4_to_m3(pm)
+    iv = len(vertexs)
+    rows = prec//2
+    for i in range(0, rows+1):
+        a = ((math.pi*2)/prec)*i
+        x, y = math.sin(a)*r, math.cos(a)*r
+        h[0], h[1], h[2] = 0, 0, y
+        h = np.dot(h, pm3)
+        tm = stp_utils.translate_matrix(pm, h)
+        verts = baseline_circle_verts(tm, x, prec)
+        for j in range(0, prec):
+            vertexs.append(verts[j])
+            if i == rows:
+                None
+            else:
+                if j == prec-1:
+                    faces.append([iv+i*prec+j, iv+i*prec, iv+(i+1)*prec, iv+(i+1)*prec+j])
+                else:
+                    faces.append([iv+i*prec+j, iv+i*prec+j+1, iv+(i+1)*prec+j+1, iv+(i+1)*prec+j])
+
+
+def baseline_circular_ring(center, plane, r1, r2, vertexs, faces, prec=32):
+    x = [0, 0, 1]
+    if (np.dot(x, plane) in [1, -1]):
+        x = [0, 1, 0]
+    tm = []
+
+    tm.append(stp_utils.convert_v3_to_v4(x))
+    tm.append(stp_utils.convert_v3_to_v4(np.cross(x, plane)))
+    tm.append(stp_utils.convert_v3_to_v4(plane))
+    tm.append(stp_utils.convert_v3_to_v4(center, 1))
+
+    iv = len(vertexs)
+    v1 = baseline_circle_verts(tm, r1, prec)
+    v2 = baseline_circle_verts(tm, r2, prec)
+
+    for i in range(0, prec):
+        vertexs.append(v1[i])
+        vertexs.append(v2[i])
+
+        if (i == prec-1):
+            faces.append([iv+i*2, iv, iv+1, iv+i*2+1])
+        else:
+            faces.append([iv+i*2, iv+i*2+2, iv+i*2+3, iv+i*2+1])
+
+
+@benchmark
+def circle_tables():
+    pm = np.identity(4)
+
+    def hot_functions():
+        reset_mesh()
+        stp_utils.generate_torus_faces(torus, None)
+        stp_utils.get_circle_verts(pm, 10.0)
+        stp_utils.generate_spherical_surface(pm, 10.0)
+        stp_utils.generate_circular_ring([0, 0, 0], [0, 0, 1], 5.0, 10.0)
+
+    def baseline_functions(prec):
+        vertexs, edges, faces = [], [], []
+        baseline_torus_faces(torus, vertexs, edges, faces, prec)
+        baseline_circle_verts(pm, 10.0, prec)
+        baseline_spherical_surface(pm, 10.0, vertexs, faces, prec)
+        baseline_circular_ring([0, 0, 0], [0, 0, 1], 5.0, 10.0, vertexs, faces, prec)
+
+    torus = {"name": "TOROIDAL_SURFACE", "data": {
+        "r1": 10.0, "r2": 2.0,
+        "axis2_placement3d": {"name": "AXIS2_PLACEMENT_3D", "data": {
+            "point": {"data": {"coordinates": [0.0, 0.0, 0.0]}},
+            "dir1": {"data": {"values": [0.0, 0.0, 1.0]}},
+            "dir2": {"data": {"values": [1.0, 0.0, 0.0]}},
+        }},
+    }}
+
+    for prec in (32, 128):
+        stp_utils.circle_precision = prec
+        number = 100 if prec == 32 else 10
+        bench("circle verts, baseline trig (prec %d)" % prec,
+              lambda: baseline_circle_verts(pm, 10.0, prec))
+        bench("circle verts, shared table (prec %d)" % prec,
+              lambda: stp_utils.get_circle_verts(pm, 10.0))
+        bench("circle primitives, baseline trig (prec %d)" % prec,
+              lambda: baseline_functions(prec), number=number)
+        bench("circle primitives, shared table (prec %d)" % prec, hot_functions, number=number)
+    stp_utils.circle_precision = 32
+    reset_mesh()
+
+
+@benchmark
+def placement_matrices():
+    def placement():
+        return {"name": "AXIS2_PLACEMENT_3D", "data": {
+            "point": {"data": {"coordinates": [1.0, 2.0, 3.0]}},
+            "dir1": {"data": {"values": [0.0, 0.0, -1.0]}},
+            "dir2": {"data": {"values": [0.973, -0.226, 0.0]}},
+        }}
+
+    # reference, the frame rebuilt on every call
+    def uncached(instance):
+        dir1 = np.array(stp_utils.get_instance_value(instance, ["dir1", "values"]))
+        dir2 = np.array(stp_utils.get_instance_value(instance, ["dir2", "values"]))
+        co = np.array(stp_utils.get_instance_value(instance, ["point", "coordinates"]))
+        dir3 = np.cross(dir1, dir2)
+        return [np.append(dir3, 0), np.append(dir2, 0), np.append(dir1, 0), np.append(co, 1.0)]
+
+    circle = {"name": "CIRCLE", "data": {"placement": placement(), "radi": 5.0}}
+    bench("placement frame, rebuilt", lambda: uncached(circle["data"]["placement"]), number=10000)
+    bench("placement frame, cached", lambda: stp_utils.get_matrix_from_axis2_placement_3d(
+        circle["data"]["placement"]), number=10000)
+    bench("circle segment", lambda: stp_utils.append_to_segment([], circle, None), number=1000)
+
+
+### B-SPLINES ###
+
+'''
+reference, scalar de Boor evaluation of a single param
+'''
+def de_boor(degree, points, t, u, weights=None):
+    n = len(points)
+    k = min(max(np.searchsorted(t, u, "right") - 1, degree), n - 1)
+    if weights is None:
+        weights = np.ones(n)
+    weights = np.asarray(weights)[:, None]
+    pw = np.hstack((np.asarray(points)*weights, weights))
+    d = [pw[j + k - degree].copy() for j in range(degree + 1)]
+    for r in range(1, degree + 1):
+        for j in range(degree, r - 1, -1):
+            den = t[j + 1 + k - r] - t[j + k - degree]
+            alpha = (u - t[j + k - degree]) / den if den else 0.0
+            d[j] = (1.0 - alpha)*d[j - 1] + alpha*d[j]
+    return d[degree][:-1] / d[degree][-1]
+
+
+def random_bspline_curves(count, n_points=20, degree=3, seed=0):
+    rnd = np.random.RandomState(seed)
+    inner = n_points - degree - 1
+    knots = np.concatenate(([0.0]*(degree + 1), np.sort(rnd.rand(inner)), [1.0]*(degree + 1)))
+    curves = []
+    for i in range(count):
+        curves.append({
+            "degree": degree,
+            "points": rnd.rand(n_points, 3)*100.0,
+            "knot_vector": knots,
+            "weights": 0.5 + rnd.rand(n_points),
+        })
+    return curves
+
+
+@benchmark
+def bspline_curves():
+    count = 2000
+    curves = random_bspline_curves(count)
+
+    def vectorized():
+        for c in curves:
+            u = stp_utils.get_bspline_params(c["degree"], c["knot_vector"])
+            stp_utils.eval_bspline_curve(c["degree"], c["points"], c["knot_vector"], u, c["weights"])
+
+    def scalar():
+        for c in curves[:count//20]:
+            u = stp_utils.get_bspline_params(c["degree"], c["knot_vector"])
+            for x in u:
+                de_boor(c["degree"], c["points"], c["knot_vector"], x, c["weights"])
+
+    c = curves[0]
+    u = stp_utils.get_bspline_params(c["degree"], c["knot_vector"])
+    ref = np.array([de_boor(c["degree"], c["points"], c["knot_vector"], x, c["weights"]) for x in u])
+    res = stp_utils.eval_bspline_curve(c["degree"], c["points"], c["knot_vector"], u, c["weights"])
+    print("max deviation from de Boor: %g" % np.abs(ref - res).max())
+
+    bench("%d nurbs curves, basis matrix" % count, vectorized, number=3)
+    t = bench("%d nurbs curves, scalar de Boor" % (count//20), scalar, number=3)
+    print("%-50s %10.3f ms" % ("%d nurbs curves, scalar de Boor (estimated)" % count, t*20000.0))
+
+
+### PLANAR FACES ###
+
+'''
+2d loops of a square plate with k x k circular holes
+'''
+def plate_with_holes(k, prec=32):
+    loops = [np.array([[0.0, 0.0], [k*10.0, 0.0], [k*10.0, k*10.0], [0.0, k*10.0]])]
+    a = np.pi*2*np.arange(prec)/prec
+    for i in range(k):
+        for j in range(k):
+            loops.append(np.column_stack((5.0 + i*10.0 + 3.0*np.cos(a), 5.0 + j*10.0 + 3.0*np.sin(a))))
+    return loops
+
+
+@benchmark
+def planar_holes():
+    try:
+        from mathutils import geometry
+    except ImportError:
+        geometry = None
+
+    for k in (5, 10, 20):
+        loops = plate_with_holes(k)
+        n = sum(len(l) for l in loops)
+
+        tris = stp_utils.triangulate_polygon_2d(loops)
+        pts = np.concatenate(loops)[tris]
+        d1 = pts[:, 1] - pts[:, 0]
+        d2 = pts[:, 2] - pts[:, 0]
+        area = 0.5*(d1[:, 0]*d2[:, 1] - d1[:, 1]*d2[:, 0]).sum()
+        expected = k*k*(100.0 - stp_utils.get_loop_area_2d(loops[1]))
+        print("%d holes, %d verts: %d triangles, area error %g" % (k*k, n, len(tris), abs(area - expected)))
+
+        bench("plate %d holes, monotone sweep" % (k*k), lambda: stp_utils.triangulate_polygon_2d(loops), number=3)
+        if geometry:
+            polylines = [[(p[0], p[1], 0.0) for p in l] for l in loops]
+            bench("plate %d holes, mathutils tessellate_polygon" % (k*k),
+                  lambda: geometry.tessellate_polygon(polylines), number=3)
+
+
+### SEGMENTS ###
+
+'''
+reference, chaining by scanning the remaining segments with exact end point equality
+'''
+def order_segments_scan(segments):
+    segments = list(segments)
+    new_segments = [segments.pop(0)]
+    ok = True
+    while segments and ok:
+        ok = False
+        for i, seg in enumerate(segments):
+            if seg["verts"][0] == new_segments[-1]["verts"][-1]:
+                ok = True
+            elif seg["verts"][-1] == new_segments[-1]["verts"][-1]:
+                seg["verts"] = list(reversed(seg["verts"]))
+                seg["keys"] = list(reversed(seg["keys"]))
+                ok = True
+            if ok:
+                new_segments.append(segments.pop(i))
+                break
+    return new_segments
+
+
+'''
+line segments of a closed polygon with n sides, shuffled and randomly reversed
+noise moves the end points of each segment independently
+'''
+def random_loop(n, noise=0.0, seed=0):
+    rnd = np.random.RandomState(seed)
+    a = np.pi*2*np.arange(n)/n
+    pts = np.column_stack((np.cos(a), np.sin(a), np.zeros(n)))*100.0
+    segments = []
+    for i in rnd.permutation(n):
+        verts = [pts[i] + rnd.uniform(-noise, noise, 3), pts[(i + 1) % n] + rnd.uniform(-noise, noise, 3)]
+        verts = [v.tolist() for v in verts]
+        if rnd.rand() < 0.5:
+            verts.reverse()
+        segments.append({"name": "LINE", "verts": verts, "keys": [None, None], "sign": 1})
+    return segments
+
+
+@benchmark
+def loop_ordering():
+    # the segments are built on each call, order_segments modifies them
+    for n in (100, 1000, 5000):
+        bench("loop of %d segments, build only" % n, lambda: random_loop(n), number=3)
+        bench("loop of %d segments, point index" % n,
+              lambda: stp_utils.order_segments(random_loop(n)), number=3)
+        bench("loop of %d segments, scan" % n,
+              lambda: order_segments_scan(random_loop(n)), number=3)
+
+    # end points off by less than the tolerance
+    print("noisy loop of 1000 segments, ordered: point index %d, scan %d" % (
+        len(stp_utils.order_segments(random_loop(1000, noise=0.0002))),
+        len(order_segments_scan(random_loop(1000, noise=0.0002)))))
+
+
+'''
+reference, pairwise comparison of circles
+'''
+def remove_duplicate_circles_pairwise(segments):
+    i = 0
+    while i < len(segments):
+        j = i + 1
+        while j < len(segments):
+            a, b = segments[i], segments[j]
+            if (a["radi"] == b["radi"] and len(a["verts"]) == len(b["verts"]) and
+                    stp_utils.eq_v3(a["center"], b["center"]) and np.dot(a["plane"], b["plane"]) in [1, -1]):
+                del segments[j]
+            else:
+                j = j + 1
+        i = i + 1
+
+
+'''
+circle segments of a perforated plate with n holes, each one repeated
+'''
+def perforated_plate_circles(n, seed=0):
+    rnd = np.random.RandomState(seed)
+    pm = np.identity(4)
+    segments = []
+    for i in range(n):
+        center = [float(i % 100)*10.0, float(i // 100)*10.0, 0.0]
+        pm[3, :3] = center
+        seg = {"name": "CIRCLE", "radi": 3.0, "center": center, "plane": [0.0, 0.0, 1.0],
+               "verts": stp_utils.get_circle_verts(pm, 3.0), "sign": 1}
+        segments.append(seg)
+        segments.append(dict(seg, plane=[0.0, 0.0, -1.0]))
+    return [segments[i] for i in rnd.permutation(len(segments))]
+
+
+@benchmark
+def duplicate_segments():
+    for n in (100, 1000, 3000):
+        segments = perforated_plate_circles(n)
+        unique = list(segments)
+        stp_utils.remove_duplicate_segments(unique)
+        print("%d circles, %d unique" % (len(segments), len(unique)))
+        bench("%d circles, segment keys" % len(segments),
+              lambda: stp_utils.remove_duplicate_segments(list(segments)), number=3)
+        bench("%d circles, pairwise" % len(segments),
+              lambda: remove_duplicate_circles_pairwise(list(segments)), number=1)
+
+
+### WELDING ###
+
+'''
+quad grid of n x n faces, split in patches of k x k faces
+each patch has its own copy of the boundary verts, moved up to noise
+'''
+def patched_grid(n, k=10, noise=0.0, seed=0):
+    rnd = np.random.RandomState(seed)
+    verts = []
+    faces = []
+    for pi in range(0, n, k):
+        for pj in range(0, n, k):
+            iv = len(verts)
+            i, j = np.meshgrid(np.arange(pi, pi + k + 1), np.arange(pj, pj + k + 1), indexing="ij")
+            co = np.column_stack((i.ravel(), j.ravel(), np.zeros(i.size)))
+            verts.extend((co + rnd.uniform(-noise, noise, co.shape)).tolist())
+            faces.extend(stp_utils.get_grid_quads(iv, k + 1, k + 1, closed_m=False).tolist())
+    return verts, faces
+
+
+@benchmark
+def welding():
+    try:
+        import bpy
+        import bmesh
+    except ImportError:
+        bmesh = None
+
+    def bmesh_weld(verts, faces, dist):
+        me = bpy.data.meshes.new("weld")
+        me.from_pydata(verts, [], faces)
+        me.validate()
+        me.update()
+        bm = bmesh.new()
+        bm.from_mesh(me)
+        bmesh.ops.remove_doubles(bm, verts=bm.verts, dist=dist)
+        bm.to_mesh(me)
+        bm.free()
+        me.validate()
+        me.update()
+        count = len(me.vertices)
+        bpy.data.meshes.remove(me)
+        return count
+
+    def numpy_weld(verts, faces, dist):
+        me = bpy.data.meshes.new("weld")
+        v, e, f = mesh_utils.weld_mesh(verts, [], faces, dist)
+        me.from_pydata(v.tolist(), [], f)
+        me.validate()
+        me.update()
+        count = len(me.vertices)
+        bpy.data.meshes.remove(me)
+        return count
+
+    for n in (100, 300):
+        verts, faces = patched_grid(n, noise=0.001)
+        v, e, f = mesh_utils.weld_mesh(verts, [], faces, 0.01)
+        print("grid %dx%d: %d verts, welded %d (expected %d)" % (n, n, len(verts), len(v), (n + 1)**2))
+        bench("grid %dx%d, spatial hash weld" % (n, n),
+              lambda: mesh_utils.weld_mesh(verts, [], faces, 0.01), number=3)
+        if bmesh:
+            bench("grid %dx%d, mesh + spatial hash weld" % (n, n),
+                  lambda: numpy_weld(verts, faces, 0.01), number=3)
+            bench("grid %dx%d, mesh + bmesh remove_doubles" % (n, n),
+                  lambda: bmesh_weld(verts, faces, 0.01), number=3)
+
+
+@benchmark
+def mesh_buffer():
+    # batches of a tessellated surface, a quad grid of 32 x 32
+    verts = np.random.RandomState(0).uniform(-1, 1, (32*32, 3))
+    quads = stp_utils.get_grid_quads(0, 32, 32)
+
+    # reference, python lists of lists
+    def lists(batches):
+        vertexs = []
+        faces = []
+        for i in range(0, batches):
+            iv = len(vertexs)
+            vertexs.extend(verts.tolist())
+            faces.extend((quads + iv).tolist())
+        return vertexs, faces
+
+    def buffer(batches):
+        mesh = mesh_utils.MeshBuffer()
+        for i in range(0, batches):
+            iv = mesh.add_verts(verts)
+            mesh.add_faces(quads + iv)
+        return mesh
+
+    def lists_nbytes(vertexs, faces):
+        size = sys.getsizeof(vertexs) + sys.getsizeof(faces)
+        size += sum(sys.getsizeof(v) + sum(sys.getsizeof(x) for x in v) for v in vertexs)
+        size += sum(sys.getsizeof(f) + sum(sys.getsizeof(x) for x in f) for f in faces)
+        return size
+
+    for batches in (10, 100):
+        bench("%d batches, python lists" % batches, lambda: lists(batches), number=5)
+        bench("%d batches, mesh buffer" % batches, lambda: buffer(batches), number=5)
+        mesh = buffer(batches)
+        print("lists %.1f KiB, buffer %s" % (lists_nbytes(*lists(batches))/1024.0, mesh.memory_report()))
+
+
+'''
+parses a test file, returns its solids without tessellating them
+'''
+def load_solids(path):
+    solids = []
+    funcs = stp_utils.structure_func["MANIFOLD_SOLID_BREP"]
+    funcs["first_load"] = solids.append
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            stp_utils.read_stp(path)
+    finally:
+        funcs["first_load"] = stp_utils.set_faces
+    return solids
+
+
+def tessellate_solids(solids, workers):
+    stp_utils.parallel_faces = workers > 0
+    stp_utils.parallel_workers = workers
+    with contextlib.redirect_stdout(io.StringIO()):
+        for solid in solids:
+            reset_mesh()
+            stp_utils.edge_curve_cache.clear()
+            stp_utils.vertex_ids.clear()
+            if stp_utils.proxy_import:
+                stp_utils.add_proxy_solid(solid)
+            else:
+                stp_utils.set_faces(solid)
+        stp_utils.close_process_pool()
+
+
+@benchmark
+def parallel_faces():
+    solids = load_solids(glob.glob(os.path.join(test_folder, "inafag_nutr15_*.stp"))[0])
+    faces = [f for s in solids for f in stp_utils.get_instance_value(s, ["closed_shell", "data"])]
+
+    # 20 copies of all the faces of the file on a single solid
+    # renumbered, so the copies don't share the edges
+    copies = []
+    for k in range(0, 20):
+        memo = {}
+        copies.extend([stp_utils.detach_instance(f, memo) for f in faces])
+        for instance in memo.values():
+            if "number" in instance:
+                instance["number"] += "_%d" % k
+    enlarged = {"name": "MANIFOLD_SOLID_BREP", "number": "#enlarged", "params": ["''", "#enlarged_shell"],
+                "data": {"closed_shell": {"name": "CLOSED_SHELL", "number": "#enlarged_shell", "data": {"data": copies}}}}
+
+    stp_utils.parallel_min_faces = 0
+    counts = sorted(set([1, 2, 4, multiprocessing.cpu_count()]))
+    for name, items, number in (("nutr15, %d solids" % len(solids), solids, 3),
+                                ("enlarged solid, %d faces" % len(copies), [enlarged], 1)):
+        bench("%s, serial" % name, lambda: tessellate_solids(items, 0), number=number)
+        for workers in counts:
+            bench("%s, %d workers" % (name, workers),
+                  lambda: tessellate_solids(items, workers), number=number)
+    stp_utils.parallel_faces = 0
+    stp_utils.parallel_workers = 0
+    stp_utils.parallel_min_faces = 32
+    reset_mesh()
+
+
+'''
+reads a test file, without creating the blender objects
+'''
+def read_without_blender(path):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return stp_utils.read_stp(path)
+
+
+def read_instances(path):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return stp_utils.read_stp_instances(path)
+
+
+@benchmark
+def parallel_solids():
+    counts = sorted(set([1, 2, 4, multiprocessing.cpu_count()]))
+    for name in ("SIEM-CONJ-L00025.stp", "inafag_qj304-xl-mpa_6ttis35p5mor8h10eg79ee0x1.stp"):
+        path = os.path.join(test_folder, name)
+        stp_utils.parallel_solids = 0
+        bench("%s, serial" % name, lambda: read_without_blender(path), number=3)
+        stp_utils.parallel_solids = 1
+        for workers in counts:
+            stp_utils.parallel_workers = workers
+            bench("%s, %d workers" % (name, workers), lambda: read_without_blender(path), number=3)
+    stp_utils.parallel_solids = 0
+    stp_utils.parallel_workers = 0
+    reset_mesh()
+
+
+@benchmark
+def proxy_import():
+    for pattern in ("SIEM-CONJ-L00025.stp", "inafag_nutr15_*.stp", "inafag_qj304-*.stp"):
+        path = glob.glob(os.path.join(test_folder, pattern))[0]
+        name = os.path.basename(path)[:20]
+        stp_utils.proxy_import = 0
+        solids = load_solids(path)
+
+        # the solids of the file, tessellated or as bounding boxes
+        full = bench("%s, %d solids, tessellated" % (name, len(solids)),
+                     lambda: tessellate_solids(solids, 0), number=5)
+        stp_utils.proxy_import = 1
+        for bounds in ("AABB", "OBB"):
+            stp_utils.proxy_bounds = bounds
+            t = bench("%s, %d solids, %s proxies" % (name, len(solids), bounds),
+                      lambda: tessellate_solids(solids, 0), number=5)
+            print("%-50s %10.1fx" % ("  speedup", full/t))
+
+        # the whole file, parsing included, the proxies skip loading the solids
+        stp_utils.proxy_import = 0
+        full = bench("%s, read" % name, lambda: read_without_blender(path), number=3)
+        stp_utils.proxy_import = 1
+        t = bench("%s, read with proxies" % name, lambda: read_without_blender(path), number=3)
+        print("%-50s %10.1fx (target 10x)" % ("  speedup", full/t))
+        lex = bench("%s, instances only" % name, lambda: read_instances(path), number=3)
+        print("%-50s %10.1fx" % ("  speedup limit, without parsing", full/(t - lex)))
+    stp_utils.proxy_import = 0
+    stp_utils.proxy_bounds = "AABB"
+    reset_mesh()
+
+
+@benchmark
+def mesh_creation():
+    try:
+        import bpy
+        import bmesh
+    except ImportError:
+        print("needs blender")
+        return
+
+    # reference, python lists, validated and updated
+    def pydata():
+        me = bpy.data.meshes.new("pydata")
+        me.from_pydata(stp_utils.mesh.verts.array.tolist(), stp_utils.mesh.edges.array.tolist(),
+                       stp_utils.mesh.get_faces())
+        me.validate()
+        me.update()
+        bpy.data.meshes.remove(me)
+
+    blender_utils = import_blender_utils()
+
+    # collected object of the mesh buffer
+    def mesh_data(name, materials=None):
+        return (name, None, stp_utils.mesh.verts.array, stp_utils.mesh.edges.array) + \
+            stp_utils.mesh.get_flat_faces() + (materials,)
+
+    def foreach_set():
+        bpy.data.meshes.remove(blender_utils.create_blender_mesh(mesh_data("foreach_set")))
+
+    def foreach_set_materials():
+        me = blender_utils.create_blender_mesh(mesh_data("materials", stp_utils.get_object_materials()))
+        bpy.data.meshes.remove(me)
+
+    # welded meshes of the largest test files, and a big grid
+    buffers = []
+    for path in sorted(glob.glob(os.path.join(test_folder, "*.stp")), key=os.path.getsize)[-3:]:
+        for name, shape, verts, edges, flat, lengths, materials in read_without_blender(path)[2]:
+            b = mesh_utils.MeshBuffer()
+            b.add_verts(verts)
+            b.add_edges(edges)
+            b.add_flat_faces(flat, lengths)
+            buffers.append(b)
+
+    for name in ("test files", "grid"):
+        stp_utils.mesh = mesh_utils.MeshBuffer()
+        if name == "grid":
+            verts, faces = patched_grid(400)
+            stp_utils.mesh.add_verts(verts)
+            stp_utils.mesh.add_faces(np.array(faces))
+            stp_utils.mesh.weld(0.01)
+        else:
+            for b in buffers:
+                iv = stp_utils.mesh.add_verts(b.verts.array)
+                stp_utils.mesh.add_edges(b.edges.array + iv)
+                flat, lengths = b.get_flat_faces()
+                stp_utils.mesh.add_flat_faces(flat + iv, lengths)
+        name = "%s, %d verts" % (name, stp_utils.mesh.vert_count)
+        bench("%s, from_pydata + validate" % name, pydata, number=3)
+        bench("%s, foreach_set" % name, foreach_set, number=3)
+        blender_utils.validate_mesh = 1
+        bench("%s, foreach_set + validate" % name, foreach_set, number=3)
+        blender_utils.validate_mesh = 0
+
+        # 8 colours, on faces of 16 neighbour faces
+        stp_utils.colour_palette[:] = [(32*i, 255 - 32*i, 128) for i in range(0, 8)]
+        colours = (np.arange(stp_utils.mesh.face_count) // 16) % 8
+        stp_utils.mesh.set_flat_faces(*stp_utils.mesh.get_flat_faces(), colours)
+        bench("%s, foreach_set + materials" % name, foreach_set_materials, number=3)
+    reset_mesh()
+
+
+@benchmark
+def colours():
+    # the styled items of the test files, resolved after parsing the file
+    for path in sorted(glob.glob(os.path.join(test_folder, "*.stp")), key=os.path.getsize)[-3:]:
+        load_solids(path)
+        name = os.path.basename(path)[:20]
+        bench("%s, %d styled items" % (name, sum(1 for i in stp_utils.instances if i["name"] == "STYLED_ITEM")),
+              stp_utils.read_colours, number=20)
+        print("%-50s %10d" % ("  colours", len(stp_utils.colour_palette)))
+
+    # materials of the faces of a mesh of 1M faces of 8 colours
+    stp_utils.mesh = mesh_utils.MeshBuffer()
+    stp_utils.colour_palette[:] = [(32*i, 255 - 32*i, 128) for i in range(0, 8)]
+    for i in range(0, 8):
+        stp_utils.mesh.colour = i
+        stp_utils.mesh.add_faces(np.zeros((125000, 4), dtype=int))
+    bench("1M faces, get_object_materials", stp_utils.get_object_materials, number=10)
+    reset_mesh()
+
+
+'''
+SIEM-CONJ-L00025 with n more occurrences of the SIEM-PM-L00135 part on the main assembly
+'''
+def siem_with_occurrences(n):
+    with open(os.path.join(test_folder, "SIEM-CONJ-L00025.stp")) as f:
+        lines = f.read().split("\n")
+    end = max(i for i, l in enumerate(lines) if l.strip() == "ENDSEC;")
+    extra = []
+    for i in range(0, n):
+        e = 10000 + 10*i
+        name = "'SIEM-PM-L00135:%d'" % (i + 2)
+        extra.extend([
+            "#%d=CARTESIAN_POINT('',(%d.,0.,0.));" % (e, 50*(i + 1)),
+            "#%d=DIRECTION('',(0.,0.,1.));" % (e + 1),
+            "#%d=DIRECTION('',(1.,0.,0.));" % (e + 2),
+            "#%d=AXIS2_PLACEMENT_3D('',#%d,#%d,#%d);" % (e + 3, e, e + 1, e + 2),
+            "#%d=NEXT_ASSEMBLY_USAGE_OCCURRENCE(%s,%s,%s,#12,#126,%s);" % (e + 4, name, name, name, name),
+            "#%d=PRODUCT_DEFINITION_SHAPE(%s,%s,#%d);" % (e + 5, name, name, e + 4),
+            "#%d=ITEM_DEFINED_TRANSFORMATION(%s,%s,#151,#%d);" % (e + 6, name, name, e + 3),
+            "#%d=(REPRESENTATION_RELATIONSHIP(%s,%s,#155,#41)"
+            "REPRESENTATION_RELATIONSHIP_WITH_TRANSFORMATION(#%d)SHAPE_REPRESENTATION_RELATIONSHIP());"
+            % (e + 7, name, name, e + 6),
+            "#%d=CONTEXT_DEPENDENT_SHAPE_REPRESENTATION(#%d,#%d);" % (e + 8, e + 7, e + 5),
+        ])
+    fd, path = tempfile.mkstemp(suffix=".stp")
+    with os.fdopen(fd, "w") as f:
+        f.write("\n".join(lines[:end] + extra + lines[end:]))
+    return path
+
+
+@benchmark
+def assembly_instancing():
+    for n in (0, 10, 100):
+        path = siem_with_occurrences(n)
+        try:
+            bench("SIEM-CONJ-L00025, %d more occurrences" % n, lambda: read_without_blender(path), number=3)
+            occurrences = stp_utils.get_assembly_occurrences()
+            print("%d shapes, %d occurrences" % (len(occurrences), sum(len(o) for o in occurrences.values())))
+        finally:
+            os.remove(path)
+    reset_mesh()
+
+
+@benchmark
+def scene_linking():
+    try:
+        import bpy
+        import bmesh
+    except ImportError:
+        print("needs blender")
+        return
+
+    blender_utils = import_blender_utils()
+    bodies = 500
+    scn = bpy.context.scene
+    me = bpy.data.meshes.new("body")
+    me.from_pydata([(0, 0, 0), (1, 0, 0), (0, 1, 0)], [], [(0, 1, 2)])
+
+    # reference, each object linked, made active and selected when created
+    def one_by_one():
+        for i in range(0, bodies):
+            ob = bpy.data.objects.new("body", me)
+            scn.objects.link(ob)
+            scn.objects.active = ob
+            ob.select = True
+        scn.update()
+
+    def batched():
+        for i in range(0, bodies):
+            blender_utils.created_objects.append(bpy.data.objects.new("body", me))
+        blender_utils.link_created_objects("assembly")
+
+    def remove_objects():
+        for ob in list(bpy.data.objects):
+            if ob.name.startswith(("body", "assembly")):
+                scn.objects.unlink(ob)
+                bpy.data.objects.remove(ob)
+
+    for name, func in (("one by one", one_by_one), ("batched", batched)):
+        t = 0.0
+        for i in range(0, 3):
+            t += timeit.timeit(func, number=1)
+            remove_objects()
+        print("%-50s %10.3f ms" % ("%d bodies, %s" % (bodies, name), t*1000.0/3))
+    bpy.data.meshes.remove(me)
+
+
+@benchmark
+def parallel_files():
+    # all the test files, 4 times, read without creating the blender objects
+    paths = sorted(glob.glob(os.path.join(test_folder, "*.stp")))*4
+
+    def serial():
+        with contextlib.redirect_stdout(io.StringIO()):
+            for path in paths:
+                stp_utils.read_stp_job(path)
+
+    def parallel(workers):
+        context = multiprocessing.get_context("fork")
+        with contextlib.redirect_stdout(io.StringIO()):
+            pool = context.Pool(workers, stp_utils.init_tessellation_worker,
+                                (stp_utils.get_tessellation_settings(),))
+            list(pool.imap_unordered(stp_utils.read_stp_job, paths))
+            pool.close()
+            pool.join()
+
+    bench("%d files, serial" % len(paths), serial, number=1)
+    for workers in sorted(set([1, 2, 4, multiprocessing.cpu_count()])):
+        bench("%d files, %d workers" % (len(paths), workers), lambda: parallel(workers), number=1)
+    reset_mesh()
+
+
+### STREAMING ###
+
+# the data of a file n times, renumbered, as n unrelated products
+def replicated_file(path, n):
+    with open(path) as f:
+        text = f.read()
+    start = text.index("DATA;") + len("DATA;")
+    end = text.rindex("ENDSEC;")
+    data = text[start:end]
+    offset = max(int(number) for number in re.findall(r"#(\d+)", data)) + 1
+    fd, replicated = tempfile.mkstemp(suffix=".stp")
+    with os.fdopen(fd, "w") as f:
+        f.write(text[:start])
+        for i in range(0, n):
+            f.write(re.sub(r"#(\d+)", lambda m: "#%d" % (int(m.group(1)) + i*offset), data))
+        f.write(text[end:])
+    return replicated
+
+
+@benchmark
+def streaming():
+    path = replicated_file(os.path.join(test_folder, "inafag_qj304-xl-mpa_6ttis35p5mor8h10eg79ee0x1.stp"), 20)
+
+    def read():
+        return len(stp_utils.read_stp(path)[2])
+
+    def stream():
+        # the objects are dropped once used, as a writer or the blender builder would
+        return sum(1 for index, data, occurrences in stp_utils.iter_stp(path))
+
+    for name, func in (("read_stp", read), ("iter_stp", stream)):
+        tracemalloc.start()
+        with contextlib.redirect_stdout(io.StringIO()):
+            t = timeit.default_timer()
+            count = func()
+            t = timeit.default_timer() - t
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print("%-50s %10.3f ms, peak %.1f MB" % ("%d objects, %s" % (count, name), t*1000, peak/1e6))
+    stp_utils.instances = []
+    del stp_utils.collected_objects[:]
+    os.remove(path)
+
+
+### EXPORT ###
+
+# reference, a record at a time, points deduplicated by a dict of its coordinates
+def write_stp_record_by_record(filepath, meshes):
+    with open(filepath, "w") as f:
+        f.writelines(stp_writer.generate_header("reference"))
+        f.writelines(stp_writer.generate_context())
+        n = 9
+        for name, verts, flat, lengths in meshes:
+            points = {}
+            faces = []
+            start = 0
+            for length in lengths:
+                loop = []
+                for v in flat[start:start + length]:
+                    co = tuple(round(c, stp_writer.precision) for c in verts[v])
+                    if co not in points:
+                        points[co] = n
+                        f.write("#%d=CARTESIAN_POINT('',(%f,%f,%f));\n" % ((n,) + co))
+                        n += 1
+                    loop.append("#%d" % points[co])
+                f.write("#%d=POLY_LOOP('',(%s));\n" % (n, ",".join(loop)))
+                f.write("#%d=FACE_OUTER_BOUND('',#%d,.T.);\n" % (n + 1, n))
+                f.write("#%d=FACE('',(#%d));\n" % (n + 2, n + 1))
+                faces.append("#%d" % (n + 2))
+                n += 3
+                start += length
+            f.write("#%d=CLOSED_SHELL('',(%s));\n" % (n, ",".join(faces)))
+            n += 1
+        f.write("ENDSEC;\nEND-ISO-10303-21;\n")
+
+
+@benchmark
+def stp_export():
+    folder = tempfile.mkdtemp()
+    path = os.path.join(folder, "export.stp")
+    # patches of 10x10 quads, the verts of the patch borders are repeated
+    for n in (100, 200, 400):
+        verts, faces = patched_grid(n)
+        faces = np.array(faces)
+        mesh = ("grid", np.array(verts), faces.ravel(), np.full(len(faces), 4))
+        if n < 400:
+            bench("%d faces, record by record" % len(faces),
+                  lambda: write_stp_record_by_record(path, [mesh]), number=1)
+        t = bench("%d faces, buffered generator" % len(faces), lambda: stp_writer.write_stp(path, [mesh]), number=1)
+        print("%-50s %10.3f us/face, %.1f MB" % ("", t*1e6/len(faces), os.path.getsize(path)/1e6))
+
+    # batch mode, a file for each mesh
+    verts, faces = patched_grid(200)
+    faces = np.array(faces)
+    meshes = [("grid%d" % i, np.array(verts), faces.ravel(), np.full(len(faces), 4)) for i in range(0, 8)]
+    files = [(os.path.join(folder, "%s.stp" % mesh[0]), [mesh]) for mesh in meshes]
+    for workers in (1, 0):
+        with contextlib.redirect_stdout(io.StringIO()):
+            t = timeit.timeit(lambda: stp_writer.write_stp_files(files, workers), number=1)
+        print("%-50s %10.3f ms" % ("%d files, %s" % (len(files), "serial" if workers == 1
+                                                    else "%d workers" % multiprocessing.cpu_count()), t*1000))
+    for name in os.listdir(folder):
+        os.remove(os.path.join(folder, name))
+    os.rmdir(folder)
+
+
+@benchmark
+def startup():
+    # the modules are imported by a new python, blender's own when run inside blender
+    try:
+        import bpy
+        python = bpy.app.binary_path_python
+    except ImportError:
+        python = sys.executable
+    folder = os.path.dirname(os.path.abspath(__file__))
+    convert = os.path.join(folder, "stp_convert.py")
+    cube = os.path.join(test_folder, "cube.stp")
+
+    def run(args):
+        subprocess.check_call([python] + args, cwd=folder, stdout=subprocess.DEVNULL)
+
+    bench("python", lambda: run(["-c", "pass"]), number=5)
+    bench("import stp_utils", lambda: run(["-c", "import stp_utils"]), number=5)
+    bench("stp_convert.py --help", lambda: run([convert, "--help"]), number=5)
+    with tempfile.TemporaryDirectory() as output:
+        bench("stp_convert.py cube.stp", lambda: run([convert, cube, "-o", output]), number=5)
+    loaded = subprocess.check_output([python, "-c", "import sys, stp_utils; print('bpy' in sys.modules)"], cwd=folder)
+    print("%-50s %10s" % ("bpy imported by stp_utils", loaded.decode().strip()))
+
+
+if __name__ == "__main__":
+    argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else sys.argv[1:]
+    for name, func in benchmarks:
+        if not argv or name in argv:
+            print("== " + name)
+            func()
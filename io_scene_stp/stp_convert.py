@@ -0,0 +1,240 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# <pep8 compliant>
+
+"""
+Converts STP files to OBJ, STL, PLY, NPZ or faceted brep STP files, without blender
+
+Run with any python 3 with numpy:
+    python stp_convert.py [-f obj|stl|ply|npz|stp] [-o output folder] [-j jobs] files or folders
+
+The folders are searched for .stp and .step files. The assemblies are flattened on
+obj, stl, ply and stp files, npz files keep each mesh once and the transforms of its occurrences.
+"""
+
+import argparse
+import contextlib
+import io
+import multiprocessing
+import os
+import sys
+import time
+
+import numpy as np
+
+if __package__:
+    from . import stp_utils
+    from . import stp_writer
+    from . import mesh_utils
+else:
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import stp_utils
+    import stp_writer
+    import mesh_utils
+
+formats = ("obj", "stl", "ply", "npz", "stp")
+
+'''
+formats written while the file is read, a mesh at a time
+'''
+streamed_formats = ("obj", "stp")
+
+writers = {
+    "obj": mesh_utils.write_obj,
+    "stl": mesh_utils.write_stl,
+    "ply": mesh_utils.write_ply,
+    "stp": stp_writer.write_stp,
+}
+
+'''
+stp files of the inputs, the folders are searched for .stp and .step files
+'''
+def get_input_files(inputs):
+    filepaths = []
+    for path in inputs:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if os.path.splitext(name)[1].lower() in (".stp", ".step"):
+                    filepaths.append(os.path.join(path, name))
+        else:
+            filepaths.append(path)
+    return filepaths
+
+'''
+meshes of a read_stp result with the assembly transforms applied, as (name, verts, flat faces, face lengths)
+an object without occurrences is kept where it is
+'''
+def get_placed_meshes(result):
+    filepath, name, objects, occurrences = result
+    meshes = []
+    for i, data in enumerate(objects):
+        meshes.extend(place_object(data, occurrences.get(i, [])))
+    return meshes
+
+'''
+meshes of an object placed at each one of its occurrences, or where it is without occurrences
+'''
+def place_object(data, occurrences):
+    ob_name, shape, verts, edges, flat, lengths, materials = data
+    for occurrence_name, transform in occurrences or [(ob_name, None)]:
+        if transform is not None:
+            verts = data[2] @ transform[:3, :3].T + transform[:3, 3]
+        yield occurrence_name or ob_name, verts, flat, lengths
+
+'''
+placed meshes of a file, read one object at a time by stp_utils.iter_stp
+'''
+def stream_placed_meshes(filepath):
+    for index, data, occurrences in stp_utils.iter_stp(filepath):
+        yield from place_object(data, occurrences)
+
+'''
+writes a read_stp result on a npz file, the meshes are concatenated and each one is placed once
+object_* arrays have an item for each mesh, the offsets are its first item on verts, faces and flat
+occurrence_* arrays have an item for each occurrence, its mesh and its 4x4 transform
+face_colours is the index on colours of each face, -1 for the faces without colour
+'''
+def write_npz(filepath, result):
+    name, objects, occurrences = result[1:]
+    colours = {}
+    face_colours = []
+    occurrence_object = []
+    occurrence_names = []
+    transforms = []
+    for i, (ob_name, shape, verts, edges, flat, lengths, materials) in enumerate(objects):
+        if materials is None:
+            face_colours.append(np.full(len(lengths), -1, dtype=np.int32))
+        else:
+            index, keys = materials
+            palette = np.array([-1 if key is None else colours.setdefault(key, len(colours)) for key in keys] + [-1],
+                               dtype=np.int32)
+            face_colours.append(palette[index])
+        for occurrence_name, transform in occurrences.get(i, []):
+            occurrence_object.append(i)
+            occurrence_names.append(occurrence_name or ob_name)
+            transforms.append(transform)
+
+    meshes = [(ob[0], ob[2], ob[4], ob[5]) for ob in objects]
+    verts, flat, lengths = mesh_utils.merge_meshes(meshes)
+    np.savez(filepath,
+             name=np.array(name),
+             object_names=np.array([ob[0] for ob in objects], dtype=str),
+             object_verts=np.cumsum([0] + [len(ob[2]) for ob in objects])[:-1],
+             object_faces=np.cumsum([0] + [len(ob[5]) for ob in objects])[:-1],
+             object_flat=np.cumsum([0] + [len(ob[4]) for ob in objects])[:-1],
+             verts=verts,
+             flat=flat,
+             lengths=lengths,
+             face_colours=np.concatenate(face_colours + [np.zeros(0, dtype=np.int32)]),
+             colours=np.array(sorted(colours, key=colours.get), dtype=np.uint8).reshape(-1, 3),
+             occurrence_object=np.array(occurrence_object, dtype=np.int64),
+             occurrence_names=np.array(occurrence_names, dtype=str),
+             occurrence_transforms=np.array(transforms, dtype=np.float64).reshape(-1, 4, 4))
+
+'''
+reads filepath and writes it on output_folder as file_format
+returns (filepath, output path, number of meshes, number of faces, seconds), the output path is None on a failure
+the output of the reader is hidden unless verbose
+'''
+def convert_file(job):
+    filepath, file_format, output_folder, verbose = job
+    start = time.perf_counter()
+    output = os.path.join(output_folder or os.path.dirname(filepath),
+                          stp_utils.get_file_object_name(filepath) + "." + file_format)
+    if os.path.abspath(output) == os.path.abspath(filepath):
+        output = os.path.splitext(output)[0] + ".faceted." + file_format
+    with contextlib.ExitStack() as stack:
+        if not verbose:
+            stack.enter_context(contextlib.redirect_stdout(io.StringIO()))
+        try:
+            if file_format in streamed_formats:
+                return stream_file(filepath, output, file_format, start)
+            result = stp_utils.read_stp(filepath)
+        except Exception as e:
+            print("Error reading %s: %s" % (filepath, e), file=sys.stderr)
+            result = None
+    if result is None:
+        return filepath, None, 0, 0, time.perf_counter() - start
+
+    if file_format == "npz":
+        write_npz(output, result)
+        meshes = [(ob[0], ob[2], ob[4], ob[5]) for ob in result[2]]
+    else:
+        meshes = get_placed_meshes(result)
+        writers[file_format](output, meshes)
+    faces = sum(len(lengths) for name, verts, flat, lengths in meshes)
+    return filepath, output, len(meshes), faces, time.perf_counter() - start
+
+'''
+convert_file of the streamed formats, each mesh is written as soon as it is tessellated
+'''
+def stream_file(filepath, output, file_format, start):
+    counts = [0, 0]
+
+    def counted(meshes):
+        for mesh in meshes:
+            counts[0] += 1
+            counts[1] += len(mesh[3])
+            yield mesh
+
+    if not stp_utils.is_stp_file(filepath):
+        return filepath, None, 0, 0, time.perf_counter() - start
+    writers[file_format](output, counted(stream_placed_meshes(filepath)))
+    return filepath, output, counts[0], counts[1], time.perf_counter() - start
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Converts STP files to OBJ, STL, PLY, NPZ or faceted brep STP files")
+    parser.add_argument("inputs", nargs="+", help="stp files, or folders with stp files")
+    parser.add_argument("-f", "--format", choices=formats, default="obj", help="output format (default obj)")
+    parser.add_argument("-o", "--output", help="output folder (default the folder of each file)")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="files read at once (0 for all the cpus)")
+    parser.add_argument("-v", "--verbose", action="store_true", help="show the output of the reader")
+    args = parser.parse_args(argv)
+
+    filepaths = get_input_files(args.inputs)
+    if not filepaths:
+        print("No stp files found")
+        return 1
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+
+    jobs = [(filepath, args.format, args.output, args.verbose) for filepath in filepaths]
+    if args.jobs == 1 or len(jobs) == 1:
+        results = map(convert_file, jobs)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(args.jobs or None)
+        results = pool.imap_unordered(convert_file, jobs)
+
+    failed = 0
+    try:
+        for filepath, output, count, faces, seconds in results:
+            if output is None:
+                failed += 1
+                print("Failed %s" % filepath)
+            else:
+                print("%s -> %s (%d meshes, %d faces, %.2fs)" % (filepath, output, count, faces, seconds))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -25,11 +25,16 @@ Author jaume bellet <mauge@bixo.org> at Tmaq <developer@tmaq.es>
 
 """
 
+import os
 import re
-import bpy
 import numpy as np
 import math
-import bmesh
+import multiprocessing
+
+try:
+    from . import mesh_utils
+except ImportError:
+    import mesh_utils
 
 '''
 File structure definition. Array in the following form
@@ -73,7 +78,6 @@ Loaded instances of the file
 each position of the array is an structure containing
  "name" : Instance Name 
  "params" : Instance params or values,  
- "line" : full line of the instance, 
  "data" : data of the instance, filled on instance_load
  "number" : instance number (#X)}
  
@@ -92,10 +96,79 @@ instances = []
 vars for current object loading
 '''
 object_name = ""
+object_shape = None # shape representation number
 object_location = [0,0,0]
-vertexs = [] # Mesh Vertices
-edges = [] # Mesh Edges
-faces = [] # Mesh Faces
+mesh = mesh_utils.MeshBuffer() # Mesh Vertices, Edges and Faces
+
+'''
+tessellation of the edge curves of the current object, edge_curve_cache[edge curve number] = verts
+the faces on both sides of an edge curve get the same verts, from v1 to v2
+'''
+edge_curve_cache = {}
+
+'''
+index on mesh of the verts shared between faces of the current object, vertex_ids[key] = index
+keys are ("v", vertex point number) for the end points and ("e", edge curve number, sample) for the others
+the verts inside a face are keyed by the face and its position, ("f", face number, x, y, z), so the mesh
+is only welded if some verts were not keyed
+'''
+vertex_ids = {}
+
+'''
+number of the face being tessellated, for the keys of the verts inside it
+'''
+face_key = None
+
+'''
+(solid, colour of each face) of the current object, and (object name, solids, shape) of the loaded objects
+waiting to be tessellated, when parallel_solids is set
+with stream_solids the solids are not loaded yet, and its colours are None
+'''
+pending_solids = []
+pending_objects = []
+
+'''
+load the solids of each object when it is requested by iter_stp, instead of when the file is processed
+'''
+stream_solids = 0
+
+'''
+instances loaded while recording_instances is set, reset by release_instances when its object is done
+'''
+recording_instances = 0
+recorded_instances = []
+
+'''
+colours of the styled items of the file, item_colours[item number] = index on colour_palette
+the colours are quantized rgb tuples, see read_colours
+'''
+colour_palette = []
+item_colours = {}
+
+'''
+object of each imported shape, imported_shapes[shape representation number] = index on collected_objects
+'''
+imported_shapes = {}
+
+'''
+(object name, shape representation number, verts, edges, flat faces, face lengths, materials) of the objects
+of the file, materials as returned by get_object_materials
+the blender objects are created from them by blender_utils
+'''
+collected_objects = []
+
+'''
+conversion factor of the plane angle unit of the file to radians
+'''
+plane_angle_factor = 1.0
+
+'''
+distance under which two points are the same, from the UNCERTAINTY_MEASURE_WITH_UNIT of the file
+never less than min_length_tolerance: coordinates and directions are loaded with 0.001 precision,
+and the same edge sampled from two different surfaces can be a bit further apart
+'''
+length_tolerance = 0.01
+min_length_tolerance = 0.01
 
 '''
 defines a verbose to split out redundant data on print_instance
@@ -108,6 +181,85 @@ enable / disable imports, for testing purposes
 torus_from_outbound = 1
 cylindrical_faces_from_outbound = 1
 circular_ring = 1
+planar_triangulation = 1
+
+'''
+planar loops without holes and up to planar_max_ngon verts are kept as a single polygon,
+the others are triangulated
+'''
+planar_max_ngon = 4
+
+'''
+tessellation precision of circular primitives
+circle_precision is the number of samples of a full circle
+if circle_tolerance is set, the number of samples is adapted to the radius,
+keeping the chord deviation under the tolerance, between circle_min_precision and circle_max_precision
+'''
+circle_precision = 32
+circle_tolerance = None
+circle_min_precision = 8
+circle_max_precision = 256
+
+'''
+tessellation precision of b-spline curves, samples for each non empty knot span
+'''
+bspline_span_precision = 8
+
+'''
+tessellation of the faces of a solid in a process pool, disabled by default
+only for solids of at least parallel_min_faces faces, parallel_workers processes (all the cpus if 0)
+'''
+parallel_faces = 0
+parallel_workers = 0
+parallel_min_faces = 32
+
+'''
+tessellation of all the solids of the file in a process pool, after loading the file
+only the tessellations are merged on the main process
+'''
+parallel_solids = 0
+
+'''
+when set, each solid is imported as its bounding box, without loading or tessellating it
+proxy_bounds is "AABB" for axis aligned boxes or "OBB" for oriented boxes, along the principal axes of its points
+the solids of the shapes on full_shapes are tessellated anyway, used to upgrade the proxies
+'''
+proxy_import = 0
+proxy_bounds = "AABB"
+full_shapes = set()
+
+'''
+called as progress_callback(phase, done, total) while reading a file, if set
+phases are "lex" (done and total in bytes of the file), "load", "tessellate" and "mesh" (in solids)
+'''
+progress_callback = None
+
+'''
+called as object_callback(index, object) for each object added to collected_objects, if set
+'''
+object_callback = None
+
+'''
+solids of the current file, and solids already tessellated, for the progress report
+'''
+solid_count = 0
+solids_done = 0
+
+'''
+module vars used by the tessellation, copied to the worker processes
+'''
+tessellation_settings = ["plane_angle_factor", "length_tolerance", "min_length_tolerance",
+                         "torus_from_outbound", "cylindrical_faces_from_outbound", "circular_ring",
+                         "planar_triangulation", "planar_max_ngon", "circle_precision", "circle_tolerance",
+                         "circle_min_precision", "circle_max_precision", "bspline_span_precision",
+                         "proxy_import", "proxy_bounds"]
+
+'''
+Unit circle sample tables, shared by all circular primitives
+unit_circle_tables[prec] = (sin, cos) of the angles (2*pi/prec)*i, i in [0,prec)
+filled on demand by get_unit_circle
+'''
+unit_circle_tables = {}
 
 ### UTILS ####
 
@@ -207,6 +359,76 @@ def rotation_matrix_axis(axis, theta):
                      [2*(bd+ac), 2*(cd-ab), aa+dd-bb-cc]])
                      
 
+'''
+rotates a set of points around an axis, for all the angles at once (Rodrigues formula)
+@param points [n,3]
+@param origin point of the axis
+@param axis direction of the axis
+@param angles [m] angles in radians
+returns [m,n,3] array, the points rotated by each angle
+'''
+def rotate_points_axis (points, origin, axis, angles):
+    return rotate_points_axis_sin_cos(points, origin, axis, np.sin(angles), np.cos(angles))
+
+def rotate_points_axis_sin_cos (points, origin, axis, sin, cos):
+    points = np.asarray(points, dtype=float) - origin
+    k = normalize_v3(np.asarray(axis, dtype=float))
+    cos = np.asarray(cos)[:, None, None]
+    sin = np.asarray(sin)[:, None, None]
+    kxp = np.cross(k, points)
+    kkp = np.outer(np.dot(points, k), k)
+    return origin + points*cos + kxp*sin + kkp*(1-cos)
+
+'''
+quads joining the rows of a [m,n] grid of vertices, stored from index iv
+@param closed_m joins last row with the first one
+@param closed_n joins last column with the first one
+returns [rows*cols,4] array
+'''
+def get_grid_quads (iv, m, n, closed_m=True, closed_n=False):
+    i = np.arange(m if closed_m else m-1)[:, None]
+    j = np.arange(n if closed_n else n-1)[None, :]
+    i2 = (i+1) % m
+    j2 = (j+1) % n
+    quads = np.empty((i.shape[0], j.shape[1], 4), dtype=int)
+    quads[..., 0] = iv + i*n + j
+    quads[..., 1] = iv + i*n + j2
+    quads[..., 2] = iv + i2*n + j2
+    quads[..., 3] = iv + i2*n + j
+    return quads.reshape(-1, 4)
+
+'''
+returns the (sin, cos) arrays of prec samples of the unit circle
+tables are built once and shared, do not modify the returned arrays
+'''
+def get_unit_circle (prec=None):
+    if prec is None:
+        prec = circle_precision
+    table = unit_circle_tables.get(prec)
+    if table is None:
+        a = ((math.pi*2)/prec)*np.arange(prec)
+        table = (np.sin(a), np.cos(a))
+        table[0].flags.writeable = False
+        table[1].flags.writeable = False
+        unit_circle_tables[prec] = table
+    return table
+
+'''
+number of samples for a full circle of radius r
+fixed circle_precision, unless circle_tolerance (or tolerance) is given
+the result is rounded to a multiple of 4, to keep the number of tables low
+'''
+def get_circle_precision (r, tolerance=None):
+    if tolerance is None:
+        tolerance = circle_tolerance
+    if not tolerance or r <= tolerance:
+        return circle_precision
+
+    # chord deviation: r*(1-cos(pi/prec)) <= tolerance
+    prec = math.ceil(math.pi / math.acos(1 - tolerance/r))
+    prec = int(math.ceil(prec/4.0)*4)
+    return min(max(prec, circle_min_precision), circle_max_precision)
+
 def translate_matrix (m, v3):
     ret = []
     for i in range (0,4):
@@ -235,12 +457,12 @@ def get_instance_number(str):
 '''
 adds a new instance to instances[]
 '''
-def add_instance (line, name, params, data, number):
+def add_instance (name, params, data, number):
     global instances;
     id = get_instance_number(number);
     while (len(instances) < id): 
         instances.append({"name" : ""})
-    new_instance = {"name" : name, "params" : params,  "line" : line, "data" : data, "number" : number}
+    new_instance = {"name" : name, "params" : params, "data" : data, "number" : number}
     instances.insert(id,new_instance) 
     return new_instance
 
@@ -346,6 +568,17 @@ def load_instance(instance, parent = None, var_name = None):
             return instance
         
         if not instance["data"]:                    
+            if stream_solids and instance["name"] in solid_instances:
+                # loaded by stream_pending_objects, once for each object
+                if all(solid is not instance for solid, colours in pending_solids):
+                    pending_solids.append((instance, None))
+                return instance
+            if proxy_import and instance["name"] in solid_instances and not object_shape in full_shapes:
+                # bounded from the params of its instances, the solid is never loaded
+                add_proxy_solid(instance)
+                return instance
+            if recording_instances:
+                recorded_instances.append(instance)
             instance["data"] = {}
             
             if parent:
@@ -567,24 +800,26 @@ def parse_stp_instance_multiple(instance, content, number):
         i=i+1 
 
 
+#X = NAME(a,b,...);
+data_line_pattern = re.compile(r'(#[\d]*)\s?=\s?(\w[\w\d_]*)\((.*)\)$')
+
 def parse_stp_data_line(line):
     
-    pattern = r'(#[\d]*)\s?=\s?(\w[\w\d_]*)\((.*)\)$'
-    match = re.match(pattern, line)
-    parsed = list(match.groups()) if match else []
+    match = data_line_pattern.match(line)
+    parsed = match.groups() if match else []
     if (len(parsed)):
         #X = NAME(a,b,...);
         
         n_params = []
         parse_params(parsed[2],n_params)
-        add_instance(line, name= parsed[1], params = n_params,data="", number=parsed[0])
+        add_instance(name= parsed[1], params = n_params,data="", number=parsed[0])
     else:
         pattern = r'(#[\d]*)\s?=\s?\((.*)\)$'
         match = re.match(pattern, line)
         parsed = list(match.groups()) if match else []
         if (len(parsed)):
             #X = ( GEOMETRIC_REPRESENTATION_CONTEXT(2) PARAMETRIC_REPRESENTATION_CONTEXT() REPRESENTATION_CONTEXT('2D SPACE','') );
-            instance = add_instance(line, name= "", params = [], data="", number=parsed[0])
+            instance = add_instance(name= "", params = [], data="", number=parsed[0])
             instance["multiple"] = []
             parse_stp_instance_multiple(instance,parsed[1], number=parsed[0])
         else:
@@ -600,118 +835,172 @@ def read_stp_data_line(f):
 def read_stp_data(f):
     global instances
     line = ""
+    size = os.fstat(f.fileno()).st_size
     while (line != "ENDSEC"):
         line = read_stp_data_line(f)    
+        if len(instances) % 10000 == 0:
+            report_progress("lex", f.tell(), size)
         
     print ("Readed " + str(len(instances)) + " instances")   
 
+'''
+tokens of the params: a string and the text after it, other text, or a separator
+a quote only starts a string at the start of a param, as params always start after a separator
+'''
+param_tokens = re.compile(r"'[^']*'[^,()]*|[^,()]+|[,()]")
+
+'''
+parses the params of an instance to params, lists are nested lists
+the text before a list (as the type of a typed param) is dropped, and parsing stops at an unmatched ')'
+'''
 def parse_params(str, params):
-    v =  ""
-    i  = 0
-    while (i<len(str) and str[i] != ")"):
-        
-        if not v and str[i] == "'":
-            #string
-            while True:
-                v = v + str[i]
-                i=i+1
-                if i >= len(str) or str[i] == "'":
-                    break
-            
-        if str[i] == ",":
+    lists = []
+    v = ""
+    for token in param_tokens.findall(str):
+        if token == "," or token == ")":
             #new param
             if v:
                 params.append(v)
                 v = ""
-        elif str[i] == "(":
-            n = [];
-            i = i + parse_params(str[(i+1):], n)
-            params.append(n);
+            if token == ")":
+                if not lists:
+                    break
+                params = lists.pop()
+        elif token == "(":
+            n = []
+            params.append(n)
+            lists.append(params)
+            params = n
             v = ""
         else:
-            v = v + str[i];
-        
-        i = i+1
-        
-    if (v):
+            v = token
+
+    if v:
         params.append(v)
     
-    return i+1;
-    
 ### INSTANCE UTILS ###
 
+'''
+frame of an AXIS2_PLACEMENT_3D, computed once and cached on instance["matrix"]
+4x4 read only array, rows are axis x ref_direction, ref_direction, axis and location
+the axis is normalized and the ref_direction made orthogonal to it, as the directions
+are loaded with 0.001 precision. Without ref_direction, (1,0,0) or (0,0,1) is projected
+'''
+def get_placement_matrix(instance):
+    matrix = instance.get("matrix")
+    if matrix is not None:
+        return matrix
+
+    dir1 = get_instance_value(instance, "dir1")
+    dir2 = get_instance_value(instance, "dir2")
+    matrix = get_frame_matrix(get_instance_value(instance, ["point","coordinates"]),
+                              get_instance_value(dir1, "values") if isinstance(dir1, dict) else None,
+                              get_instance_value(dir2, "values") if isinstance(dir2, dict) else None)
+    matrix.flags.writeable = False
+    instance["matrix"] = matrix
+    return matrix
+
+'''
+frame of a placement as in get_placement_matrix, from its location, axis and ref_direction (None if not set)
+'''
+def get_frame_matrix(point, axis, ref):
+    return get_frame_matrices([point],
+                              [(0.0, 0.0, 1.0) if axis is None else axis],
+                              [(1.0, 0.0, 0.0) if ref is None else ref])[0]
+
+'''
+frames of several placements at once, as get_frame_matrix with all the directions set
+'''
+def get_frame_matrices(points, axes, refs):
+    axes = np.array(axes, dtype=float)
+    axes = axes/np.linalg.norm(axes, axis=1)[:, None]
+    refs = np.array(refs, dtype=float)
+    parallel = np.linalg.norm(np.cross(axes, refs), axis=1) < 1e-6
+    refs[parallel] = np.where(np.abs(axes[parallel, :1]) > 0.5, [0.0, 0.0, 1.0], [1.0, 0.0, 0.0])
+    refs = refs - (refs*axes).sum(axis=1)[:, None]*axes
+    refs = refs/np.linalg.norm(refs, axis=1)[:, None]
+
+    matrices = np.zeros((len(axes), 4, 4))
+    matrices[:,0,:3] = np.cross(axes, refs)
+    matrices[:,1,:3] = refs
+    matrices[:,2,:3] = axes
+    matrices[:,3,:3] = points
+    matrices[:,3,3] = 1.0
+    return matrices
+
 def get_plane_from_axis2_placement_3d(instance):
-    return np.array(get_instance_value(instance,["dir1","values"]))
+    return get_placement_matrix(instance)[2,:3]
     
 def get_matrix_from_axis2_placement_3d(instance):
-    dir1 = np.array(get_instance_value(instance,["dir1","values"]))
-    dir2 = np.array(get_instance_value(instance,["dir2","values"]))
-    co = np.array(get_instance_value(instance,["point","coordinates"]))
-    
-    dir3 = np.cross(dir1,dir2)
-    
-    return [np.append(dir3,0), np.append(dir2,0), np.append(dir1,0), np.append(co,1.0)]
+    return get_placement_matrix(instance)
 
 def get_matrix3_from_axis2_placement_3d(instance):
-    dir1 = np.array(get_instance_value(instance,["dir1","values"]))
-    dir2 = np.array(get_instance_value(instance,["dir2","values"]))
-    co = np.array(get_instance_value(instance,["point","coordinates"]))
-    
-    dir3 = np.cross(dir1,dir2)
-    
-    return [dir3, dir2, dir1]
+    return get_placement_matrix(instance)[:3,:3]
         
 def generate_torus_faces (instance, face):
     if instance["name"] != "TOROIDAL_SURFACE":
         return
     
-    iv = len(vertexs)
     r1 = get_instance_value(instance,"r1")
     r2 = get_instance_value(instance,"r2")
     pm = get_matrix_from_axis2_placement_3d(get_instance_value(instance,"axis2_placement3d"))
-    prec = 32
-    for i in range(0,prec):
-        a1 = ((math.pi*2)/prec)*i
-        tm = [[1.0, 0.0, 0.0, 0.0],[0.0, 1.0, 0.0, 0.0],[0.0, 0.0, 1.0, 0.0],[r1, 0.0, 0.0, 1.0]]
-        rm = rotation_matrix(a1)
-        rm = np.matmul(rm, pm)
-        tm = np.matmul(tm, rm)
-        for j in range (0,prec):
-            a2 = ((math.pi*2)/prec)*j
-            v4 = [math.cos(a2)*r2,0.0, math.sin(a2)*r2, 1.0]
-            v4 = np.matmul(v4,tm)
-                 
-            vertexs.append(convert_v4_to_v3(v4))
-
-            if j==31:
-                edges.append([iv+i*32+j,iv+i*32+1])
-                if i==31:
-                    faces.append([iv+i*32+j,iv+j,iv,iv+i*32])
-                else:
-                    faces.append([iv+i*32+j,iv+(i+1)*32+j,iv+(i+1)*32,iv+i*32])
-            else:
-                edges.append([iv+i*32+j,iv+i*32+j+1])
-                if i==31:
-                    edges.append([iv+i*32+j,iv+j])
-                    faces.append([iv+i*32+j,iv+j,iv+j+1,iv+i*32+j+1])
-                else:
-                    edges.append([iv+i*32+j,iv+(i+1)*32+j])
-                    faces.append([iv+i*32+j,iv+(i+1)*32+j,iv+(i+1)*32+j+1,iv+i*32+j+1])
-   
-def get_circle_verts(pm, r):
-    
-    verts = []
-    prec = 32
-    for i in range(0,prec):
-        a = ((math.pi*2)/prec)*i
-        v4 = [math.cos(a)*r,math.sin(a)*r, 0.0, 1.0]
-        v4 = np.matmul(v4,pm)
-                 
-        verts.append(convert_v4_to_v3(v4))
-        
-    return verts
+    pm = np.asarray(pm, dtype=float)
+    sin1, cos1 = get_unit_circle(get_circle_precision(r1+r2))
+    sin2, cos2 = get_unit_circle(get_circle_precision(r2))
+
+    # ring of the tube, rotated around the torus axis for all the angles
+    x = r1 + cos2*r2
+    z = sin2*r2
+    verts = (np.outer(cos1, x)[..., None]*pm[0,:3]
+             - np.outer(sin1, x)[..., None]*pm[1,:3]
+             + z[None, :, None]*pm[2,:3]
+             + pm[3,:3])
+
+    ids = get_surface_vert_ids(verts, False)
+    add_surface_faces(get_grid_quads(0, len(cos1), len(cos2), closed_n=True)[:, ::-1], ids)
+
+'''
+generates the faces of a cylinder or a cone closed on the seam edge
+the face between the two closed loops of the face bound fb is joined with the verts of the loops,
+otherwise the seam edge is swept around the surface axis, all the vertices and quads at once,
+and the swept verts on the loop segments are shared with the neighbour faces
+'''
+def generate_seam_faces (instance, edge_curve, fb=None, sense=True):
+    if not instance["name"] in ["CYLINDRICAL_SURFACE", "CONICAL_SURFACE"]:
+        return
+
+    segments = get_face_bound_segments(fb) if fb else []
+    rings = [seg for seg in segments if is_closed_segment(seg)]
+    if len(rings) == 2:
+        generate_surface_between_loops(instance, rings[0], rings[1], sense)
+        return
+
+    pm = get_matrix_from_axis2_placement_3d(get_instance_value(instance, "axis2_placement_3d"))
+    origin, axis = pm[3,:3], pm[2,:3]
+    points = np.array([
+        get_instance_value(edge_curve, ["v1", "cartesian_point", "coordinates"]),
+        get_instance_value(edge_curve, ["v2", "cartesian_point", "coordinates"])
+    ])
+
+    # distance to the axis
+    d = points - origin
+    radi = np.linalg.norm(d - np.outer(np.dot(d, axis), axis), axis=1).max()
+    sin, cos = get_unit_circle(get_circle_precision(radi))
+    prec = len(cos)
+    verts = rotate_points_axis_sin_cos(points, origin, axis, -sin, cos)
+
+    ids = get_surface_vert_ids(verts, True, segments)
+    mesh.add_edges(ids[np.arange(prec)[:, None]*2 + [0, 1]])
+    add_surface_faces(get_grid_quads(0, prec, 2), ids)
+
+def get_circle_verts(pm, r, prec=None):
+    if prec is None:
+        prec = get_circle_precision(r)
+    sin, cos = get_unit_circle(prec)
+    pm = np.asarray(pm, dtype=float)
+    verts = np.outer(cos*r, pm[0,:3]) + np.outer(sin*r, pm[1,:3]) + pm[3,:3]
+    return verts.tolist()
     
- 
     
 def generate_circle_face (instance):
     if instance["name"] != "CIRCLE":
@@ -722,11 +1011,9 @@ def generate_circle_face (instance):
         get_instance_value(instance,"radi")
     )
     
-    iv = len(vertexs)
-    for v in verts:
-        vertexs.append(v3)
+    iv = mesh.add_verts(verts)
     
-    faces.append(range(iv,iv+32))
+    mesh.add_face(range(iv,iv+len(verts)))
     
     
 def get_arc_verts (instance, p1, p2):    
@@ -746,74 +1033,252 @@ def get_arc_verts (instance, p1, p2):
         
     # Plane check?
     
-    pm = get_matrix_from_axis2_placement_3d(get_instance_value(instance,"placement"))
+    pm = np.asarray(get_matrix_from_axis2_placement_3d(get_instance_value(instance,"placement")))
     
-    prec = 32
+    prec = get_circle_precision(r)
 
     l = a_from_b_c_A (r,r,(math.pi*2)/prec)
 
-    sign = -1
-    
+    # circle samples, clockwise
+    sin, cos = get_unit_circle(prec)
+    samples = np.outer(cos*r, pm[0,:3]) - np.outer(sin*r, pm[1,:3]) + pm[3,:3]
+
     #find first point
     s = 0
-    for i in range(0,prec):
-        a = ((math.pi*2)/prec)*i * sign
-        v4 = [math.cos(a)*r,math.sin(a)*r, 0.0, 1.0]
-        v4 = np.matmul(v4,pm)
-            
-        if p3_p3_dist (v4,p1) <= l:
-            s = i+1
-            break
+    near = np.flatnonzero(np.linalg.norm(samples - p1, axis=1) <= l)
+    if len(near):
+        s = near[0]+1
         
     verts.append(p1)
-    
-    match = None
-
-    for i in range(0,prec):
 
-        a = ((math.pi*2)/prec)*(i+s) *sign
-
-        v4 = [math.cos(a)*r,math.sin(a)*r, 0.0, 1.0]
-        v4 = np.matmul(v4,pm)
-        
-        if match is not None:
-            if p3_p3_dist (v4,p2) < l:
-                verts.append(convert_v4_to_v3(match))
-                    
-            verts.append(p2)
-            break;    
-                
-        if p3_p3_dist (v4,p2) < l:    
-            # Precision problems, do not break, test next
-            match = v4 
-            #verts.append(p2)
-            #break
-        else:
-            # Last Point
-            verts.append(convert_v4_to_v3(v4))
+    samples = samples[(np.arange(prec)+s) % prec]
+    near = np.flatnonzero(np.linalg.norm(samples - p2, axis=1) < l)
+    if len(near):
+        # Precision problems, the next sample could also match
+        m = near[0]
+        verts.extend(samples[:m].tolist())
+        if len(near) > 1 and near[1] == m+1:
+            verts.append(samples[m].tolist())
+        verts.append(p2)
+    else:
+        verts.extend(samples.tolist())
             
     return verts
             
 def generate_edges (verts):
-    iv = len(vertexs)
-    i=0
-    l = len(verts)-1
-    for v in verts:
-        vertexs.append(v)
-        if i<l:
-            edges.append([iv+i,iv+i+1])
-            
-        i=i+1     
+    iv = mesh.add_verts(verts)
+    mesh.add_edges(iv + np.arange(len(verts)-1)[:, None] + [0, 1])
 
 def generate_arc (instance, p1, p2):
     verts = get_arc_verts(instance, p1, p2)
     generate_edges(verts)
-    
+
+### ELLIPSES ###
+
+'''
+parameter t of the point p on the ellipse p = c + r1*cos(t)*x + r2*sin(t)*y
+x is the reference direction of the placement (dir2), y is axis x x (row 0 of pm)
+'''
+def get_ellipse_param (pm, r1, r2, p):
+    d = np.asarray(p, dtype=float) - pm[3,:3]
+    return math.atan2(np.dot(d, pm[0,:3])/r2, np.dot(d, pm[1,:3])/r1)
+
+'''
+verts of an ellipse (or elliptical arc) from p1 to p2
+start and end params are derived from p1 and p2, the same point gives the full ellipse
+sense False goes from p1 to p2 with decreasing t
+the number of samples is the circle precision for the major semi axis, on the swept fraction
+'''
+def get_ellipse_verts (instance, p1, p2, sense=True):
+    if instance["name"] != "ELLIPSE":
+        return
+
+    r1 = get_instance_value(instance,"semi_axis1")
+    r2 = get_instance_value(instance,"semi_axis2")
+    pm = np.asarray(get_matrix_from_axis2_placement_3d(get_instance_value(instance,"placement")))
+
+    closed = p1 is None or eq_v3(p1, p2)
+    t1 = 0.0 if p1 is None else get_ellipse_param(pm, r1, r2, p1)
+    if closed:
+        sweep = math.pi*2 if sense else -math.pi*2
+    else:
+        sweep = (get_ellipse_param(pm, r1, r2, p2) - t1) % (math.pi*2)
+        if not sense:
+            sweep = sweep - math.pi*2
+
+    prec = get_circle_precision(max(r1, r2))
+    steps = max(int(math.ceil(prec*abs(sweep)/(math.pi*2) - 1e-9)), 1)
+
+    t = t1 + sweep*np.arange(steps if closed else steps+1)/steps
+    verts = np.outer(np.cos(t)*r1, pm[1,:3]) + np.outer(np.sin(t)*r2, pm[0,:3]) + pm[3,:3]
+    verts = verts.tolist()
+
+    # exact end points, to join with the other segments
+    if p1 is not None:
+        verts[0] = p1
+        if not closed:
+            verts[-1] = p2
+    return verts
+
+### B-SPLINE CURVES ###
+
+'''
+full knot vector, from the knot values and their multiplicities
+'''
+def get_bspline_knot_vector (knots, mults):
+    return np.repeat(np.asarray(knots, dtype=float), np.asarray(mults, dtype=int))
+
+'''
+basis functions of a b-spline for all the params at once (Cox - de Boor recursion)
+@param degree
+@param knot_vector full knot vector, len = n + degree + 1
+@param u [m] params, in the domain [knot_vector[degree], knot_vector[n]]
+returns [m,n] basis matrix, the points of the curve are basis * control_points
+'''
+def get_bspline_basis (degree, knot_vector, u):
+    t = np.asarray(knot_vector, dtype=float)
+    u = np.asarray(u, dtype=float)[:, None]
+    n = len(t) - degree - 1
+
+    N = ((t[:-1] <= u) & (u < t[1:])).astype(float)
+
+    # the end of the domain belongs to the last non empty span
+    end = u[:, 0] >= t[n]
+    if end.any():
+        N[end] = 0.0
+        N[end, np.searchsorted(t, t[n], "left") - 1] = 1.0
+
+    for k in range(1, degree+1):
+        # 1 / (t[i+k] - t[i]), zero for empty spans
+        with np.errstate(divide="ignore"):
+            d = t[k:] - t[:-k]
+            inv = np.where(d > 0, 1.0 / d, 0.0)
+        a = (u - t[:-k-1]) * inv[:-1]
+        b = (t[k+1:] - u) * inv[1:]
+        N = a*N[:, :-1] + b*N[:, 1:]
+
+    return N
+
+'''
+evaluates a b-spline or a nurbs curve (if weights are given) for all the params at once
+returns [m,dim] array of points
+'''
+def eval_bspline_curve (degree, points, knot_vector, u, weights=None):
+    N = get_bspline_basis(degree, knot_vector, u)
+    points = np.asarray(points, dtype=float)
+    if weights is None:
+        return N.dot(points)
+
+    Nw = N * np.asarray(weights, dtype=float)
+    return Nw.dot(points) / Nw.sum(axis=1)[:, None]
+
+'''
+params to tessellate a b-spline, prec samples for each non empty knot span
+'''
+def get_bspline_params (degree, knot_vector, prec=None):
+    if prec is None:
+        prec = bspline_span_precision if degree > 1 else 1
+    t = np.asarray(knot_vector, dtype=float)
+    n = len(t) - degree - 1
+    spans = np.unique(t[degree:n+1])
+    u = spans[:-1, None] + np.outer(np.diff(spans), np.arange(prec) / float(prec))
+    return np.append(u.ravel(), spans[-1])
+
+'''
+returns the sub instance with the given name, of a complex (multiple) instance
+'''
+def get_multiple_instance (instance, name):
+    if instance["name"] == name:
+        return instance
+    for sub_instance in instance.get("multiple", []):
+        if sub_instance["name"] == name:
+            return sub_instance
+    return None
+
+def is_bspline_curve (instance):
+    return get_multiple_instance(instance, "B_SPLINE_CURVE_WITH_KNOTS") is not None
+
+'''
+gets the b-spline definition of a B_SPLINE_CURVE_WITH_KNOTS instance,
+simple or complex (BOUNDED_CURVE() B_SPLINE_CURVE(..) B_SPLINE_CURVE_WITH_KNOTS(..) RATIONAL_B_SPLINE_CURVE(..) ...)
+returns a dict with "degree", "points", "knot_vector" and "weights" (None for non rational curves)
+'''
+def get_bspline_curve_data (instance):
+    knots = get_multiple_instance(instance, "B_SPLINE_CURVE_WITH_KNOTS")
+    curve = get_multiple_instance(instance, "B_SPLINE_CURVE") or knots
+    rational = get_multiple_instance(instance, "RATIONAL_B_SPLINE_CURVE")
+
+    return {
+        "degree" : int(get_instance_value(curve, "degree")),
+        "points" : [get_instance_value(p, "coordinates") for p in get_instance_value(curve, "control_points")],
+        "knot_vector" : get_bspline_knot_vector(
+                            get_instance_value(knots, "knots"),
+                            get_instance_value(knots, "knot_multiplicities")
+                        ),
+        "weights" : get_instance_value(rational, "weights") if rational else None
+    }
+
+'''
+param of the point of a b-spline curve closest to p
+the closest of the params u is found, and refined on finer samples around it
+'''
+def get_bspline_param (bs, u, p):
+    p = np.asarray(p, dtype=float)
+    for i in range(0, 8):
+        verts = eval_bspline_curve(bs["degree"], bs["points"], bs["knot_vector"], u, bs["weights"])
+        k = np.argmin(((verts - p)**2).sum(axis=1))
+        if i == 7:
+            break
+        u = np.linspace(u[max(k-1, 0)], u[min(k+1, len(u)-1)], 17)
+    return u[k]
+
+'''
+params of u from a to b, with a and b as the ends
+'''
+def get_params_between (u, a, b):
+    if b <= a:
+        return np.array([a])
+    return np.concatenate(([a], u[(u > a) & (u < b)], [b]))
+
+'''
+verts of a b-spline curve from p1 to p2, only on the part of the curve between them
+sense False goes from p1 to p2 with decreasing params (EDGE_CURVE same_sense)
+the params of p1 and p2 are searched on the curve, a closed curve is followed across its ends if needed
+and the same point gives the full closed curve
+'''
+def get_bspline_verts (instance, p1, p2, sense=True):
+    bs = get_bspline_curve_data(instance)
+    u = get_bspline_params(bs["degree"], bs["knot_vector"])
+    ends = eval_bspline_curve(bs["degree"], bs["points"], bs["knot_vector"], u[[0, -1]], bs["weights"])
+    closed = p3_p3_dist(ends[0], ends[1]) <= get_tolerance()
+
+    # along the curve, from start to end
+    start, end = (p1, p2) if sense else (p2, p1)
+    t1 = get_bspline_param(bs, u, start)
+    t2 = t1 if eq_v3(p1, p2) else get_bspline_param(bs, u, end)
+    if t1 < t2:
+        params = get_params_between(u, t1, t2)
+    elif closed:
+        params = np.concatenate((get_params_between(u, t1, u[-1]), get_params_between(u, u[0], t2)[1:]))
+    elif eq_v3(p1, p2):
+        params = u
+    else:
+        # the ends do not follow the sense of the curve
+        params = get_params_between(u, t2, t1)[::-1]
+
+    verts = eval_bspline_curve(bs["degree"], bs["points"], bs["knot_vector"], params, bs["weights"]).tolist()
+    if not sense:
+        verts.reverse()
+
+    # exact end points, to join with the other segments
+    verts[0] = p1
+    verts[-1] = p2
+    return verts
+
 def generate_circular_ring (center, plane, r1, r2):
     if not circular_ring:
         return 
     
-    global vertexs
     x = [0,0,1]
     if (np.dot(x,plane) in [1,-1]):
         x = [0,1,0]
@@ -825,55 +1290,198 @@ def generate_circular_ring (center, plane, r1, r2):
     tm.append (convert_v3_to_v4(center,1))
     
     
-    iv = len(vertexs)
-    v1 = get_circle_verts(tm,r1)
-    v2 = get_circle_verts(tm,r2)
+    prec = get_circle_precision(max(r1, r2))
+    v1 = get_circle_verts(tm,r1,prec)
+    v2 = get_circle_verts(tm,r2,prec)
     
-    for i in range (0,32):
-        vertexs.append(v1[i])
-        vertexs.append(v2[i])
-        
-        if (i==31):
-            faces.append([iv+i*2, iv, iv+1, iv+i*2+1])
-        else:
-            faces.append([iv+i*2, iv+i*2+2, iv+i*2+3, iv+i*2+1])
+    iv = mesh.add_verts(np.stack((v1, v2), axis=1))
+    mesh.add_faces(get_grid_quads(iv, prec, 2)[:, ::-1])
         
 
+### SHARED VERTS ###
+
+'''
+tessellation of an edge curve, func is only called the first time for each edge curve
+'''
+def get_edge_curve_verts (edge_curve, func):
+    if not edge_curve:
+        return func()
+    verts = edge_curve_cache.get(edge_curve["number"])
+    if verts is None:
+        verts = func()
+        edge_curve_cache[edge_curve["number"]] = verts
+    return list(verts)
+
+'''
+keys of the verts of an edge curve (see vertex_ids)
+the end points are keyed by its vertex point, verts without edge curve are not shared (None)
+a closed edge curve (a full circle) may pass its vertex point on any sample, keyed by the vertex point too
+'''
+def get_edge_curve_keys (edge_curve, verts):
+    if not edge_curve:
+        return [None]*len(verts)
+    keys = [("e", edge_curve["number"], i) for i in range(0, len(verts))]
+    v1 = get_instance_value(edge_curve, "v1")
+    v2 = get_instance_value(edge_curve, "v2")
+    if eq_v3(verts[0], get_instance_value(v1, ["cartesian_point","coordinates"])):
+        keys[0] = ("v", v1["number"])
+    if eq_v3(verts[-1], get_instance_value(v2, ["cartesian_point","coordinates"])):
+        keys[-1] = ("v", v2["number"])
+    if v1["number"] == v2["number"] and len(verts) > 2:
+        d = np.linalg.norm(np.subtract(verts[1:-1], get_instance_value(v1, ["cartesian_point","coordinates"])), axis=1)
+        for i in np.flatnonzero(d <= get_tolerance()):
+            keys[i+1] = ("v", v1["number"])
+    return keys
+
+'''
+indices of verts on mesh, shared verts are only added the first time its key is found
+'''
+def get_vertex_ids (verts, keys):
+    ids = []
+    for v, key in zip(verts, keys):
+        i = None if key is None else vertex_ids.get(key)
+        if i is None:
+            i = mesh.add_vert(v)
+            if key is not None:
+                vertex_ids[key] = i
+        ids.append(i)
+    return ids
+
+'''
+indices on mesh of the verts of a surface sampled on its own (sweeps, grids of tori and spheres)
+the verts on the verts of the loop segments take its keys, and are shared with the neighbour faces
+the other verts are keyed by the face if they are inside it, or not keyed (welded) if they are on its border
+the verts inside the face on the same position (the poles) get the same index
+'''
+def get_surface_vert_ids (verts, border, segments=()):
+    verts = np.asarray(verts, dtype=float).reshape(-1, 3)
+    border = np.array(np.broadcast_to(border, len(verts)))
+    ids = np.full(len(verts), -1)
+
+    points, keys = [], []
+    for seg in segments:
+        for v, key in zip(seg["verts"], seg["keys"]):
+            if key is not None:
+                points.append(v)
+                keys.append(key)
+    if points:
+        # nearest segment vert of each vert, squared distances
+        points = np.asarray(points, dtype=float)
+        d = (verts**2).sum(axis=1)[:, None] + (points**2).sum(axis=1)[None, :] - 2*np.dot(verts, points.T)
+        nearest = d.argmin(axis=1)
+        for i in np.flatnonzero(d[np.arange(len(verts)), nearest] <= get_tolerance()**2):
+            ids[i] = get_vertex_ids([verts[i]], [keys[nearest[i]]])[0]
+
+    loose = np.flatnonzero((ids < 0) & border)
+    ids[loose] = mesh.add_verts(verts[loose]) + np.arange(len(loose))
+
+    # keyed by the face and the position, added once for each position
+    new = []
+    inner = np.flatnonzero(ids < 0)
+    for i, p in zip(inner, np.round(verts[inner], 9).tolist()):
+        key = ("f", face_key, p[0], p[1], p[2])
+        j = vertex_ids.get(key)
+        if j is None:
+            j = mesh.vert_count + len(new)
+            new.append(i)
+            vertex_ids[key] = j
+        ids[i] = j
+    mesh.add_verts(verts[new])
+    return ids
+
+'''
+adds the faces of a surface given on local indices (an array of quads or triangles), mapped by ids
+the repeated verts (collapsed on a pole or on a shared vert) are removed, and the faces left flat dropped
+'''
+def add_surface_faces (faces, ids):
+    faces = np.asarray(faces, dtype=int)
+    flat, lengths, kept = mesh_utils.remap_faces(faces.reshape(-1), np.full(len(faces), faces.shape[1]), ids)
+    mesh.add_flat_faces(flat, lengths)
+
+### POINT INDEX ###
+
+'''
+quantized key of a point, on cells of twice the tolerance
+points closer than tolerance fall on the same or on neighbour cells
+'''
+def get_point_key (p, tolerance):
+    return (int(math.floor(p[0]/(tolerance*2))), int(math.floor(p[1]/(tolerance*2))), int(math.floor(p[2]/(tolerance*2))))
+
+'''
+adds item to the point index, a dict of cell key -> [(p, item)]
+'''
+def add_to_point_index (index, p, item, tolerance):
+    index.setdefault(get_point_key(p, tolerance), []).append((p, item))
+
+'''
+items of the point index closer than tolerance to p
+'''
+def find_in_point_index (index, p, tolerance):
+    # the tolerance sphere of p only reaches the nearest neighbour cell on each axis
+    cells = []
+    for c in p:
+        k = c/(tolerance*2)
+        f = int(math.floor(k))
+        cells.append((f, f+1 if k-f >= 0.5 else f-1))
+    found = []
+    for kx in cells[0]:
+        for ky in cells[1]:
+            for kz in cells[2]:
+                for q, item in index.get((kx, ky, kz), ()):
+                    if p3_p3_dist(p, q) <= tolerance:
+                        found.append(item)
+    return found
+
+def get_tolerance ():
+    return length_tolerance
+
+'''
+chains the segments on a loop, starting on the first one
+segment ends are found on a point index, within the file tolerance, and snapped
+the segments are reversed if needed
+'''
 def order_segments (segments):
     new_segments = []
+    if not segments:
+        return new_segments
     new_segments.append(segments[0])
     if len(segments)>1 :
-        segments.remove(segments[0])
+        tolerance = get_tolerance()
+        index = {}
+        for i in range(1, len(segments)):
+            add_to_point_index(index, segments[i]["verts"][0], (i, 0), tolerance)
+            add_to_point_index(index, segments[i]["verts"][-1], (i, 1), tolerance)
+
+        used = [False]*len(segments)
         ok = True
-        while len(segments) and ok:
-            ok = False
-            i=0
-            for seg in segments:
-                if (seg["verts"][0] == new_segments[-1]["verts"][-1]):
-                    new_segments.append(seg)
-                    #segments.remove(seg)
-                    del segments[i]
-                    ok = True
-                    break
-                if (seg["verts"][-1] == new_segments[-1]["verts"][-1]):
+        while len(new_segments) < len(segments) and ok:
+            p = new_segments[-1]["verts"][-1]
+            found = [item for item in find_in_point_index(index, p, tolerance) if not used[item[0]]]
+            ok = len(found) > 0
+            if ok:
+                i, end = min(found)
+                used[i] = True
+                seg = segments[i]
+                if end == 1:
                     seg["verts"] = list(reversed(seg["verts"]))
+                    seg["keys"] = list(reversed(seg["keys"]))
                     seg["sign"] = seg["sign"] * -1
-                    new_segments.append(seg)
-                    #segments.remove(seg)
-                    del segments[i]
-                    ok = True
-                    break
-                i=i+1
+                seg["verts"] = [p] + seg["verts"][1:]
+                new_segments.append(seg)
                 
         if (not ok):
             print ("Incorrect loop")
-        elif (new_segments[0]["verts"][0] != new_segments[-1]["verts"][-1]):
+        elif p3_p3_dist(new_segments[0]["verts"][0], new_segments[-1]["verts"][-1]) > tolerance:
             print ("Not closed loop")
+        else:
+            new_segments[-1]["verts"] = new_segments[-1]["verts"][:-1] + [new_segments[0]["verts"][0]]
         
     return new_segments
 
 def get_segments(data, gen_edges = False):
     segments = []
+    if not data:
+        return segments
     
     #first node
     append_to_segment (segments, data[0]["surf"],  data[0]["edge_curve"] )
@@ -895,82 +1503,595 @@ def get_segments(data, gen_edges = False):
 
 def generate_surface_from_segments (segments):
     segments = order_segments(segments)
-    iv = len(vertexs)
-    last = None
-    for i in range (0, len(segments)):
-        for v in segments[i]["verts"]:
-            if not (last and eq_v3(v,last)):
-                last = v
-                vertexs.append (v)
-                
-    faces.append(range (iv, len(vertexs)))            
+    verts, keys = get_loop_verts(segments)
+    mesh.add_face(get_vertex_ids(verts, keys))
 
-def generate_planar_faces_from_outbound (instance, data, segment):
-    segments = get_segments (data)
-    if segment is not None and segment["name"] == "CIRCLE":
-        if len(segments) == 1 and segments[0]["name"] == "CIRCLE":
-            ca, cb = segment, segments[0]
-            r1, r2 = ca["radi"], cb["radi"]
-            if eq_v3(ca["center"], cb["center"]) and np.dot(ca["plane"], cb["plane"]) in [1,-1]:
-                generate_circular_ring (ca["center"], ca["plane"], r1, r2)
-            else: 
-                print ("Not in concentric or in same plane")
-        else:
-            print ("Not perfomed")
-    elif segment is not None:
-        print ("Unknown planar surface to apply face bound")
-    else: 
-        print ("Missing segment to apply outbound")
-    
-def generate_cylindrical_faces_from_outbound (instance, data):
-    if not cylindrical_faces_from_outbound:
-        return
-    
-    global faces, edges, vertexs
-    
-    segments = get_segments(data)
-    
-    
-    if len(segments) != 4:
-        print ("Expected 4 segments")
+'''
+face of a faceted brep, a polygon of the points of its poly loop
+the points are shared with the other faces by its cartesian point, holes are not supported
+'''
+def generate_poly_loop_face (face):
+    bounds = get_instance_value(face, "data")
+    if len(bounds) > 1:
+        print ("Holes on faceted faces not supported")
+        bounds = [fb for fb in bounds if fb["name"] == "FACE_OUTER_BOUND"] or bounds
+    fb = bounds[0]
+    points = get_instance_value(fb, ["loop", "points"])
+    if points is None:
+        print ("Unknown loop for face " + get_instance_value(fb, "loop")["name"])
         return
-    
-    if segments[0]["name"] != "ARC":
-        #start on a circle
+    if get_instance_value(fb, "unknown2") == ".F.":
+        points = points[::-1]
+    verts = [p["data"]["coordinates"] for p in points]
+    keys = [("p", p["number"]) for p in points]
+    mesh.add_face(get_vertex_ids(verts, keys))
+
+### PLANAR FACES ###
+
+'''
+signed area of a 2d loop, positive if counter-clockwise
+'''
+def get_loop_area_2d (loop):
+    x = loop[:,0]
+    y = loop[:,1]
+    return 0.5*(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1)))
+
+'''
+triangulates a polygon with holes, given as a list of 2d loops [n,2] (outer loop first)
+the polygon is split in y-monotone pieces with a sweep line, and each piece is
+triangulated with a stack (de Berg et al., Computational Geometry, ch. 3)
+the sweep status is a sorted list searched by bisection, O(log n) comparisons for each vertex,
+but its inserts and removes move O(n) items, O(n^2) in the worst case. The moves are memmoves,
+cheaper than a balanced tree in python up to far larger faces than the ones of the files
+returns [t,3] array of counter-clockwise triangles, indices on the concatenated loops
+'''
+def triangulate_polygon_2d (loops):
+    pts = np.concatenate(loops).astype(float)
+    n = len(pts)
+    nxt = np.empty(n, dtype=int)
+    prv = np.empty(n, dtype=int)
+
+    # outer loop counter-clockwise, holes clockwise: interior always on the left
+    start = 0
+    for i in range(0, len(loops)):
+        idx = np.arange(start, start+len(loops[i]))
+        area = get_loop_area_2d(pts[idx])
+        if (i == 0) != (area > 0):
+            idx = idx[::-1]
+        nxt[idx] = np.roll(idx, -1)
+        prv[idx] = np.roll(idx, 1)
+        start = start + len(loops[i])
+
+    # sweep order, top to bottom and left to right on the same height
+    order = np.lexsort((pts[:,0], -pts[:,1]))
+    rank = np.empty(n, dtype=int)
+    rank[order] = np.arange(n)
+
+    e1 = pts - pts[prv]
+    e2 = pts[nxt] - pts
+    convex = e1[:,0]*e2[:,1] - e1[:,1]*e2[:,0] > 0
+    prv_above = rank[prv] < rank
+    nxt_above = rank[nxt] < rank
+    merge = prv_above & nxt_above & ~convex
+
+    xs = pts[:,0].tolist()
+    ys = pts[:,1].tolist()
+    nxt_l = nxt.tolist()
+
+    # x of the edge e (from e to nxt[e]) on the sweep line y
+    def edge_x (e, y):
+        a = e
+        b = nxt_l[e]
+        if ys[a] == ys[b]:
+            return min(xs[a], xs[b])
+        return xs[a] + (y - ys[a])*(xs[b] - xs[a])/(ys[b] - ys[a])
+
+    # position of v on the status, number of edges at its left
+    def search (status, v):
+        x = xs[v]
+        y = ys[v]
+        lo = 0
+        hi = len(status)
+        while lo < hi:
+            mid = (lo+hi)//2
+            if edge_x(status[mid], y) <= x:
+                lo = mid+1
+            else:
+                hi = mid
+        return lo
+
+    status = []
+    helper = {}
+    diagonals = []
+
+    def fix_up (e, v):
+        if merge[helper[e]]:
+            diagonals.append((v, helper[e]))
+
+    for v in order.tolist():
+        e_prv = int(prv[v])
+        if not prv_above[v] and not nxt_above[v]:
+            if convex[v]:
+                # start vertex
+                status.insert(search(status, v), v)
+                helper[v] = v
+            else:
+                # split vertex
+                i = search(status, v)
+                e = status[i-1]
+                diagonals.append((v, helper[e]))
+                helper[e] = v
+                status.insert(i, v)
+                helper[v] = v
+        elif prv_above[v] and nxt_above[v]:
+            # end and merge vertex
+            fix_up(e_prv, v)
+            status.remove(e_prv)
+            if not convex[v]:
+                e = status[search(status, v)-1]
+                fix_up(e, v)
+                helper[e] = v
+        elif prv_above[v]:
+            # regular vertex on a left chain
+            fix_up(e_prv, v)
+            status.remove(e_prv)
+            status.insert(search(status, v), v)
+            helper[v] = v
+        else:
+            # regular vertex on a right chain
+            e = status[search(status, v)-1]
+            fix_up(e, v)
+            helper[e] = v
+
+    # split in monotone pieces, walking the edges and the diagonals (both ways)
+    out = {}
+    for a, b in set(diagonals):
+        out.setdefault(a, []).append(b)
+        out.setdefault(b, []).append(a)
+
+    def next_vertex (u, v):
+        if v not in out:
+            return nxt_l[v]
+        back = math.atan2(ys[u] - ys[v], xs[u] - xs[v])
+        best = None
+        for w in [nxt_l[v]] + out[v]:
+            an = (back - math.atan2(ys[w] - ys[v], xs[w] - xs[v])) % (math.pi*2)
+            if an == 0:
+                an = math.pi*2
+            if best is None or an < best[0]:
+                best = (an, w)
+        return best[1]
+
+    half_edges = [(v, nxt_l[v]) for v in range(0, n)]
+    for a in out:
+        half_edges.extend((a, b) for b in out[a])
+
+    rank_l = rank.tolist()
+    tris = []
+    used = set()
+    for he in half_edges:
+        if he in used:
+            continue
+        piece = []
+        u, v = he
+        while (u, v) not in used:
+            used.add((u, v))
+            piece.append(u)
+            u, v = v, next_vertex(u, v)
+        if len(piece) >= 3:
+            triangulate_monotone_2d(piece, xs, ys, rank_l, tris)
+
+    return np.array(tris, dtype=int).reshape(-1, 3)
+
+'''
+triangulates a y-monotone counter-clockwise loop (list of vertex ids), appending to tris
+'''
+def triangulate_monotone_2d (piece, xs, ys, rank, tris):
+    if len(piece) == 3:
+        tris.append(piece)
+        return
+
+    top = min(range(0, len(piece)), key=lambda i: rank[piece[i]])
+    bottom = max(range(0, len(piece)), key=lambda i: rank[piece[i]])
+
+    # counter-clockwise from the top goes down the left chain
+    left = set()
+    i = top
+    while i != bottom:
+        left.add(piece[i])
+        i = (i+1) % len(piece)
+    left.add(piece[bottom])
+
+    def cross (a, b, c):
+        return (xs[b]-xs[a])*(ys[c]-ys[b]) - (ys[b]-ys[a])*(xs[c]-xs[b])
+
+    def add (a, b, c):
+        d = cross(a, b, c)
+        if d > 0:
+            tris.append([a, b, c])
+        elif d < 0:
+            tris.append([a, c, b])
+
+    u = sorted(piece, key=lambda v: rank[v])
+    stack = [u[0], u[1]]
+    for j in range(2, len(u)-1):
+        v = u[j]
+        if (v in left) != (stack[-1] in left):
+            while len(stack) > 1:
+                add(v, stack.pop(), stack[-1])
+            stack = [u[j-1], v]
+        else:
+            last = stack.pop()
+            sign = 1 if v in left else -1
+            while stack and cross(stack[-1], last, v)*sign > 0:
+                add(v, last, stack[-1])
+                last = stack.pop()
+            stack.append(last)
+            stack.append(v)
+
+    v = u[-1]
+    while len(stack) > 1:
+        add(v, stack.pop(), stack[-1])
+
+'''
+verts (and keys) of a loop of ordered segments, without the repeated end points
+'''
+def get_loop_verts (segments):
+    verts = []
+    keys = []
+    for seg in segments:
+        for v, key in zip(seg["verts"], seg["keys"]):
+            if not (len(verts) and eq_v3(v, verts[-1])):
+                verts.append(v)
+                keys.append(key)
+    if len(verts) > 1 and eq_v3(verts[0], verts[-1]):
+        verts.pop()
+        keys.pop()
+    return verts, keys
+
+'''
+edge data (surf, edge_curve) of the loop of a face bound
+surface and seam curves are replaced by their geometry
+'''
+def get_face_bound_data (fb):
+    data = []
+    if get_instance_value(fb, "loop")["name"] != "EDGE_LOOP":
+        return data
+    for oe in get_instance_value(fb,["loop","oriented_edges"]):
+        edge_curve = get_instance_value(oe, "edge_curve")
+        surf = get_instance_value(edge_curve,"object")
+        if surf["name"] == "SURFACE_CURVE":
+            surf = get_instance_value(surf,"object")
+        elif surf["name"] == "SEAM_CURVE":
+            surf = get_instance_value(surf,"geom")
+        if surf:
+            data.append({"surf" : surf, "edge_curve" : edge_curve})
+    return data
+
+'''
+segments of the edges of a face bound, with the verts and keys shared with the neighbour faces
+'''
+def get_face_bound_segments (fb):
+    segments = []
+    for d in get_face_bound_data(fb):
+        append_to_segment(segments, d["surf"], d["edge_curve"])
+    return segments
+
+'''
+generates a planar face, from the outer loop and the loops of the holes (3d verts)
+keys of the loop verts are optional, to share them with the neighbour faces
+triangles are counter-clockwise around the plane normal, or clockwise if sense is False
+'''
+def generate_planar_faces (instance, loops, sense=True, keys=None):
+    pm = np.asarray(get_matrix_from_axis2_placement_3d(get_instance_value(instance,"axis2_placement_3d")))
+    loops3d = [np.asarray(loop, dtype=float) for loop in loops]
+    loops2d = [np.column_stack((np.dot(l - pm[3,:3], pm[1,:3]), np.dot(l - pm[3,:3], pm[0,:3]))) for l in loops3d]
+
+    if keys is None:
+        keys = [[None]*len(l) for l in loops]
+    ids = []
+    for i in range(0, len(loops)):
+        ids.extend(get_vertex_ids(loops3d[i].tolist(), keys[i]))
+    ids = np.array(ids)
+
+    if len(loops) == 1 and len(loops[0]) <= planar_max_ngon:
+        face = ids.tolist()
+        if (get_loop_area_2d(loops2d[0]) > 0) != sense:
+            face.reverse()
+        mesh.add_face(face)
+        return
+
+    tris = ids[triangulate_polygon_2d(loops2d)]
+    if not sense:
+        tris = tris[:, ::-1]
+    mesh.add_faces(tris)
+
+'''
+generates a planar advanced face, with all its bounds
+the outer loop is the face outer bound, or the widest loop if the face only has face bounds
+two concentric circles make a circular ring
+'''
+def generate_planar_face (face, obj):
+    loops = []
+    outer = None
+    for fb in get_instance_value(face,["data"]):
+        segments = get_segments(get_face_bound_data(fb))
+        verts, keys = get_loop_verts(segments)
+        if len(verts) < 3:
+            continue
+        if fb["name"] == "FACE_OUTER_BOUND":
+            outer = len(loops)
+        loops.append((segments, verts, keys))
+
+    if not loops:
+        print ("Planar face without loops")
+        return
+
+    if len(loops) == 2 and circular_ring:
+        ca, cb = loops[0][0], loops[1][0]
+        if len(ca) == 1 and len(cb) == 1 and ca[0]["name"] == "CIRCLE" and cb[0]["name"] == "CIRCLE":
+            ca, cb = ca[0], cb[0]
+            if eq_v3(ca["center"], cb["center"]) and np.dot(ca["plane"], cb["plane"]) in [1,-1]:
+                generate_circular_ring (ca["center"], ca["plane"], ca["radi"], cb["radi"])
+                return
+
+    pm = np.asarray(get_matrix_from_axis2_placement_3d(get_instance_value(obj,"axis2_placement_3d")))
+    if outer is None:
+        # widest loop, on the plane frame
+        areas = []
+        for segments, verts, keys in loops:
+            d = np.asarray(verts, dtype=float) - pm[3,:3]
+            areas.append(abs(get_loop_area_2d(np.column_stack((np.dot(d, pm[1,:3]), np.dot(d, pm[0,:3]))))))
+        outer = int(np.argmax(areas))
+
+    order = [outer] + [i for i in range(0, len(loops)) if i != outer]
+    generate_planar_faces (obj, [loops[i][1] for i in order], get_instance_value(face, "unknown2") != ".F.", [loops[i][2] for i in order])
+
+def generate_planar_faces_from_outbound (instance, data, segment):
+    segments = get_segments (data)
+    if segment is not None and segment["name"] == "CIRCLE":
+        if len(segments) == 1 and segments[0]["name"] == "CIRCLE":
+            ca, cb = segment, segments[0]
+            r1, r2 = ca["radi"], cb["radi"]
+            if eq_v3(ca["center"], cb["center"]) and np.dot(ca["plane"], cb["plane"]) in [1,-1]:
+                generate_circular_ring (ca["center"], ca["plane"], r1, r2)
+            else: 
+                print ("Not in concentric or in same plane")
+        else:
+            print ("Not perfomed")
+    elif segment is not None:
+        print ("Unknown planar surface to apply face bound")
+    else: 
+        print ("Missing segment to apply outbound")
+    
+'''
+true for the segments that close a loop by themselves
+'''
+def is_closed_segment (segment):
+    if segment["name"] in ["CIRCLE", "ELLIPSE"]:
+        return True
+    return segment["name"] == "BSPLINE" and eq_v3(segment["verts"][0], segment["verts"][-1])
+
+'''
+(ids, angles around the axis, mean height) of the verts of a ring segment, around the axis of a placement matrix
+the verts are shared with the neighbour faces, a closing vert repeating the first one is skipped
+'''
+def get_axis_loop (segment, pm):
+    verts, keys = segment["verts"], segment["keys"]
+    if len(verts) > 1 and eq_v3(verts[0], verts[-1]):
+        verts, keys = verts[:-1], keys[:-1]
+    d = np.asarray(verts, dtype=float) - pm[3,:3]
+    return get_vertex_ids(verts, keys), np.arctan2(np.dot(d, pm[0,:3]), np.dot(d, pm[1,:3])), np.dot(d, pm[2,:3]).mean()
+
+'''
+generates the face of a cylinder or a cone between two closed loops around its axis
+(circles, or the ellipses and b-splines where other surfaces cut it), joined by get_strip_between_loops
+the triangles face away from the axis, or towards it if sense is False
+'''
+def generate_surface_between_loops (instance, segment1, segment2, sense=True):
+    pm = np.asarray(get_matrix_from_axis2_placement_3d(get_instance_value(instance,"axis2_placement_3d")))
+    loops = sorted([get_axis_loop(segment1, pm), get_axis_loop(segment2, pm)], key=lambda loop: loop[2])
+    tris = get_strip_between_loops(loops[0][0], loops[0][1], loops[1][0], loops[1][1], True)
+    if not sense:
+        tris = tris[:, ::-1]
+    mesh.add_faces(tris)
+
+'''
+splits the triangles of a 2d triangulation until no edge is wider than step on x
+the edges are split on its midpoint, shared by the triangles of the edge, without t-junctions
+returns the points (the new ones appended) and the triangles, with the same orientation
+'''
+def split_wide_triangles (pts, tris, step):
+    pts = pts.tolist()
+    tris = tris.tolist()
+    while True:
+        mids = {}
+        for t in tris:
+            for a, b in ((t[0], t[1]), (t[1], t[2]), (t[2], t[0])):
+                if abs(pts[a][0] - pts[b][0]) > step and (b, a) not in mids and (a, b) not in mids:
+                    mids[(a, b)] = len(pts)
+                    pts.append([(pts[a][0] + pts[b][0])/2, (pts[a][1] + pts[b][1])/2])
+        if not mids:
+            return np.array(pts), np.array(tris, dtype=int).reshape(-1, 3)
+        split = []
+        for t in tris:
+            m = [mids.get((a, b), mids.get((b, a))) for a, b in ((t[0], t[1]), (t[1], t[2]), (t[2], t[0]))]
+            n = 3 - m.count(None)
+            if n == 0:
+                split.append(t)
+                continue
+            # rotate the triangle so the split edges come first
+            r = [i for i in range(0, 3) if (m[i] is not None) and (n == 3 or m[i-1] is None)][0]
+            t = t[r:] + t[:r]
+            m = m[r:] + m[:r]
+            if n == 1:
+                split.extend([[t[0], m[0], t[2]], [m[0], t[1], t[2]]])
+            elif n == 2:
+                split.extend([[m[0], t[1], m[1]], [t[0], m[0], m[1]], [t[0], m[1], t[2]]])
+            else:
+                split.extend([[t[0], m[0], m[2]], [m[0], t[1], m[1]], [m[2], m[1], t[2]], [m[0], m[1], m[2]]])
+        tris = split
+
+'''
+generates a cylinder face bounded by a loop of any segments that does not go around the axis
+the loop is unrolled on the (arc length, height) plane of the cylinder, where the distances are kept
+and the points closer than the tolerance are the same point, triangulated there sweeping around the axis
+the triangles are split to the circle precision and wrapped back on the cylinder
+they are counter-clockwise seen from outside of the cylinder, or from inside if sense is False
+'''
+def generate_cylinder_patch (instance, segments, sense=True):
+    verts, keys = get_loop_verts(segments)
+    if len(verts) < 3:
+        return
+    pm = np.asarray(get_matrix_from_axis2_placement_3d(get_instance_value(instance,"axis2_placement_3d")))
+    r = get_instance_value(instance,"radi")
+
+    d = np.asarray(verts, dtype=float) - pm[3,:3]
+    a = np.unwrap(np.arctan2(np.dot(d, pm[0,:3]), np.dot(d, pm[1,:3])))
+    closing = (a[0] - a[-1] + math.pi) % (math.pi*2) - math.pi
+    if abs(a[-1] - a[0] + closing) > math.pi:
+        print ("Cylinder loop around the axis not supported")
+        return
+
+    ids = np.array(get_vertex_ids(verts, keys))
+    loop2d = np.column_stack((a*r, np.dot(d, pm[2,:3])))
+    keep = np.linalg.norm(loop2d - np.roll(loop2d, 1, axis=0), axis=1) >= get_tolerance()
+    if np.count_nonzero(keep) < 3:
+        return
+    ids = ids[keep]
+    loop2d = loop2d[keep]
+    # swept around the axis (the height as x) for strips between the curves, which mirrors the triangles
+    tris = triangulate_polygon_2d([loop2d[:, ::-1]])[:, ::-1]
+    pts, tris = split_wide_triangles(loop2d, tris, math.pi*2*r/get_circle_precision(r))
+
+    if len(pts) > len(ids):
+        an = pts[len(ids):,0]/r
+        new_verts = (np.outer(np.cos(an)*r, pm[1,:3]) + np.outer(np.sin(an)*r, pm[0,:3]) +
+                     np.outer(pts[len(ids):,1], pm[2,:3]) + pm[3,:3])
+        ids = np.concatenate((ids, get_surface_vert_ids(new_verts, False)))
+    tris = ids[tris]
+    if not sense:
+        tris = tris[:, ::-1]
+    mesh.add_faces(tris)
+
+def generate_cylindrical_faces_from_outbound (instance, data, segment, sense=True):
+    if not cylindrical_faces_from_outbound:
+        return
+    
+    segments = get_segments(data)
+    
+    if segment is not None and len(segments) == 1 and is_closed_segment(segment) and is_closed_segment(segments[0]):
+        # cylinder cut by other surfaces, on both ends
+        generate_surface_between_loops(instance, segments[0], segment, sense)
+        return
+    
+    if len(segments) == 4 and segments[0]["name"] != "ARC":
+        #start on a circle
         seg = segments[0]
         segments.remove(seg)
         segments.append(seg)
         
-    if segments[0]["name"] == "ARC" and segments[1]["name"] == "LINE":
+    if len(segments) == 4 and segments[0]["name"] == "ARC" and segments[1]["name"] == "LINE":
         # Get rotation matrix and calc vertices!
-        i=0
-        iv = len(vertexs)
         h = sub_v3_v3 (segments[1]["verts"][1],segments[1]["verts"][0])
         im=len(segments[0]["verts"])
-        for i in range(0,im):
-            a = segments[0]["verts"][i]
-            b = add_v3_v3 (a, h)
-            
-            vertexs.append(a)
-            vertexs.append(b)
-        
-            if i==im-1:
-                None
-            else:
-                faces.append ([iv+i*2, iv+i*2+1, iv+i*2+3,iv+i*2+2]) 
+        a = get_vertex_ids(segments[0]["verts"], segments[0]["keys"])
+
+        # the opposite arc shares its verts, if sampled the same way
+        top = [add_v3_v3 (v, h) for v in segments[0]["verts"]]
+        keys = list(reversed(segments[2]["keys"]))
+        if segments[2]["name"] != "ARC" or len(keys) != im or not all(eq_v3(v, w) for v, w in zip(top, reversed(segments[2]["verts"]))):
+            keys = [None]*im
+        b = get_vertex_ids(top, keys)
+
+        for i in range(0,im-1):
+            mesh.add_face ([a[i], b[i], b[i+1], a[i+1]])
         
     else:
-        print ("expected circle and line")
+        # ellipses, b-splines, arcs split in several segments
+        generate_cylinder_patch(instance, segments, sense)
     
     
     
+'''
+triangles of the strip between two loops of shared vert ids, given its angles around an axis
+the loops are walked in increasing angle, advancing on the loop with the closest next vert,
+so loops with different number of verts are joined without gaps
+a loop of a single vert (the apex of a cone) makes a fan
+triangles are counter-clockwise around the axis seen from the outside, if loop1 is the lower one
+'''
+def get_strip_between_loops (ids1, a1, ids2, a2, closed):
+    loops = []
+    for ids, a in ((ids1, a1), (ids2, a2)):
+        ids = list(ids)
+        a = np.unwrap(np.asarray(a, dtype=float))
+        if len(a) > 1 and a[-1] < a[0]:
+            ids.reverse()
+            a = a[::-1]
+        if closed and len(ids) > 1:
+            # start on the lowest angle, and close the loop with its first vert
+            a = a % (math.pi*2)
+            i = int(np.argmin(a))
+            ids = ids[i:] + ids[:i] + [ids[i]]
+            a = np.concatenate((a[i:], a[:i] + math.pi*2, [a[i] + math.pi*2]))
+            a = np.unwrap(a)
+        loops.append((ids, a.tolist()))
+
+    (l1, b1), (l2, b2) = loops
+    tris = []
+    i = j = 0
+    while i < len(l1)-1 or j < len(l2)-1:
+        if j == len(l2)-1 or (i < len(l1)-1 and b1[i+1] <= b2[j+1]):
+            tris.append([l1[i], l1[i+1], l2[j]])
+            i = i+1
+        else:
+            tris.append([l1[i], l2[j+1], l2[j]])
+            j = j+1
+    return np.array(tris, dtype=int).reshape(-1, 3)
+
+'''
+generates a cone face, bounded by the circles (or arcs) of the outer loop and the face bound
+the verts of the bounding segments are shared with the neighbour faces, see vertex_ids
+with a single bounding circle, the cone is closed on its apex
+the triangles face away from the axis, or towards it if sense is False
+'''
+def generate_conical_faces_from_outbound (instance, data, segment, sense=True):
+    segments = get_segments(data)
+    if segment is not None:
+        segments.append(segment)
+
+    rings = [s for s in segments if s["name"] in ["CIRCLE", "ARC"]]
+    if not len(rings) in [1, 2]:
+        print ("Cone outbound: Expected 1 or 2 circles")
+        return
+
+    placement = get_instance_value(instance, "axis2_placement_3d")
+    pm = np.asarray(get_matrix_from_axis2_placement_3d(placement), dtype=float)
+    origin, axis = pm[3,:3], pm[2,:3]
+
+    loops = [get_axis_loop(ring, pm) for ring in rings]
+    closed = all(ring["name"] == "CIRCLE" for ring in rings)
+
+    if len(loops) == 1:
+        # closed on the apex, under the ring
+        r = get_instance_value(instance, "radi")
+        tan = math.tan(get_instance_value(instance, "semi_angle") * plane_angle_factor)
+        loops.insert(0, (get_surface_vert_ids(origin - (r/tan)*axis, False), [0.0], -r/tan))
+    loops.sort(key=lambda loop: loop[2])
+
+    tris = get_strip_between_loops(loops[0][0], loops[0][1], loops[1][0], loops[1][1], closed)
+    if not sense:
+        tris = tris[:, ::-1]
+    mesh.add_faces(tris)
+
 '''
 adds a segment
 
 A segment could be consided a drawing element. A single segment or a set of segments could define a surface or an outbound
 the segments contains 
-    "name": tpye of segments, could be "ARC", "CIRCLE", "LINE"
+    "name": tpye of segments, could be "ARC", "CIRCLE", "LINE", "BSPLINE"
     "verts" : verts of the segment
+    "keys" : keys of the verts shared with other faces, see vertex_ids
     "sign" : sign of the segments, because some segments could be inverted when joined with others, and must be know for directions
     
 Note that arc is not present in the structure, and is defined as circle and 2 points.
@@ -980,6 +2101,7 @@ Note that arc is not present in the structure, and is defined as circle and 2 po
 @edge_curve, optional, especifies start and end points
 ''' 
 def append_to_segment(segments, surf, edge_curve):
+    n = len(segments)
     if surf["name"] == "CIRCLE":
         if edge_curve:
             if get_instance_value(edge_curve,"v1")["number"] == get_instance_value(edge_curve,"v2")["number"]:
@@ -999,17 +2121,17 @@ def append_to_segment(segments, surf, edge_curve):
                         })
         
         if arc:
-            segments[-1]["verts"] =  get_arc_verts(
+            segments[-1]["verts"] =  get_edge_curve_verts(edge_curve, lambda: get_arc_verts(
                                 surf,
                                 get_instance_value(edge_curve, ["v1","cartesian_point","coordinates"]),
                                 get_instance_value(edge_curve, ["v2","cartesian_point","coordinates"])
-                            )
+                            ))
             segments[-1]["name"] = "ARC"
         else:
-            segments[-1]["verts"] = get_circle_verts (
+            segments[-1]["verts"] = get_edge_curve_verts(edge_curve, lambda: get_circle_verts (
                 get_matrix_from_axis2_placement_3d(get_instance_value(surf,"placement")),
                 get_instance_value(surf,"radi")
-            )
+            ))
             segments[-1]["name"] = "CIRCLE"
 
     elif surf["name"] == "LINE":
@@ -1021,8 +2143,39 @@ def append_to_segment(segments, surf, edge_curve):
                             ],
                             "sign" : 1
                         })
+    elif surf["name"] == "ELLIPSE":
+        if edge_curve:
+            p1 = get_instance_value(edge_curve, ["v1","cartesian_point","coordinates"])
+            p2 = get_instance_value(edge_curve, ["v2","cartesian_point","coordinates"])
+            sense = get_instance_value(edge_curve, "unknown5") != ".F."
+        else:
+            p1 = p2 = None
+            sense = True
+
+        segments.append ({
+                            "name" : "ELLIPSE" if p1 is None or eq_v3(p1, p2) else "ELLIPTICAL_ARC",
+                            "verts" : get_edge_curve_verts(edge_curve, lambda: get_ellipse_verts(surf, p1, p2, sense)),
+                            "semi_axis" : [get_instance_value(surf, "semi_axis1"), get_instance_value(surf, "semi_axis2")],
+                            "center" : get_instance_value(surf, ["placement", "point","coordinates"]),
+                            "plane" : list(get_plane_from_axis2_placement_3d(get_instance_value(surf,"placement"))),
+                            "sign" : 1
+                        })
+    elif is_bspline_curve(surf):
+        segments.append ({
+                            "name" : "BSPLINE",
+                            "verts" : get_edge_curve_verts(edge_curve, lambda: get_bspline_verts(
+                                surf,
+                                get_instance_value(edge_curve, ["v1","cartesian_point","coordinates"]),
+                                get_instance_value(edge_curve, ["v2","cartesian_point","coordinates"]),
+                                get_instance_value(edge_curve, "unknown5") != ".F."
+                            )),
+                            "sign" : 1
+                        })
     else:
         print ("unexpected for segment", surf["name"])
+
+    if len(segments) > n:
+        segments[-1]["keys"] = get_edge_curve_keys(edge_curve, segments[-1]["verts"])
                     
 
 def continue_segment (segments, surf, edge_curve):
@@ -1030,20 +2183,24 @@ def continue_segment (segments, surf, edge_curve):
     if surf["name"] == "CIRCLE" and prv["name"] == "ARC":
         if prv["radi"] == get_instance_value(surf, "radi") and prv["center"] == get_instance_value(surf, ["placement", "point","coordinates"]):
             #continue
-            v = get_arc_verts(
+            v = get_edge_curve_verts(edge_curve, lambda: get_arc_verts(
                 surf,
                 get_instance_value(edge_curve, ["v1","cartesian_point","coordinates"]),
                 get_instance_value(edge_curve, ["v2","cartesian_point","coordinates"])
-            )
+            ))
+            k = get_edge_curve_keys(edge_curve, v)
             
             #print (prv["verts"][0],prv["verts"][-1], v[0], v[-1])
             if eq_v3 (prv["verts"][-1], v[0]):
                 prv["verts"] = prv["verts"] + v[1:]
+                prv["keys"] = prv["keys"] + k[1:]
             elif eq_v3 (prv["verts"][0], v[-1]):
                 prv["verts"] =  list(reversed(prv["verts"])) + list(reversed(v))[1:] 
+                prv["keys"] =  list(reversed(prv["keys"])) + list(reversed(k))[1:] 
                 prv["sign"] = prv["sign"] * -1
             elif eq_v3 (prv["verts"][0], v[0]):
                 prv["verts"] =  list(reversed(prv["verts"])) + v[1:]
+                prv["keys"] =  list(reversed(prv["keys"])) + k[1:]
                 prv["sign"] = prv["sign"] * -1
             else:
                 print ("Error") 
@@ -1057,37 +2214,65 @@ def continue_segment (segments, surf, edge_curve):
     else:
         return False
 
-def segments_compare (seg1, seg2):
-    ret = True
-    ret = ret and seg1["name"] == seg2["name"]
-    if ret and seg1["name"] == "CIRCLE":
-        ret = ret and seg1["radi"] == seg2["radi"]
-        ret = ret and len(seg1["verts"]) == len(seg2["verts"])
-        ret = ret and eq_v3(seg1["center"], seg2["center"])
-        ret = ret and np.dot(seg1["plane"], seg2["plane"]) in [1,-1]
-    elif ret:
-        print ("not compared")
-                
-    return ret
-        
+'''
+values rounded to multiples of tolerance, to be used on hash keys
+'''
+def quantize (values, tolerance):
+    return tuple(int(round(v/tolerance)) for v in values)
+
+'''
+quantized normal of a plane, with the sign fixed (both faces of the plane get the same key)
+directions are loaded with 0.001 precision
+'''
+def get_plane_key (plane):
+    l = v3_len(plane)
+    n = quantize([c/l for c in plane], 0.001)
+    for c in n:
+        if c != 0:
+            return n if c > 0 else tuple(-x for x in n)
+    return n
 
+'''
+canonical key of a segment, equal segments (within tolerance) get the same key
+the direction of the segment is not taken into account
+'''
+def get_segment_key (seg, tolerance):
+    name = seg["name"]
+    if name == "CIRCLE":
+        return (name, quantize(seg["center"], tolerance), quantize([seg["radi"]], tolerance), get_plane_key(seg["plane"]), len(seg["verts"]))
+    elif name == "ELLIPSE":
+        return (name, quantize(seg["center"], tolerance), quantize(seg["semi_axis"], tolerance), get_plane_key(seg["plane"]), len(seg["verts"]))
+
+    ends = tuple(sorted([quantize(seg["verts"][0], tolerance), quantize(seg["verts"][-1], tolerance)]))
+    if name == "ARC":
+        return (name, ends, quantize(seg["center"], tolerance), quantize([seg["radi"]], tolerance), len(seg["verts"]))
+    elif name == "ELLIPTICAL_ARC":
+        return (name, ends, quantize(seg["center"], tolerance), quantize(seg["semi_axis"], tolerance), len(seg["verts"]))
+    elif name == "LINE":
+        return (name, ends)
+    else:
+        # b-splines and others, by all its verts
+        return (name, tuple(sorted(quantize(v, tolerance) for v in seg["verts"])))
+
+'''
+removes the repeated segments, keeping the first one
+'''
 def remove_duplicate_segments (segments):
-    i = 0
-    while i < len(segments):
-        j=i+1
-        while j < len (segments):
-            if segments_compare(segments[i],segments[j]):
-                del segments[j]
-            else:
-                j = j+1
-        i = i +1
+    tolerance = get_tolerance()
+    found = set()
+    unique = []
+    for seg in segments:
+        key = get_segment_key(seg, tolerance)
+        if key not in found:
+            found.add(key)
+            unique.append(seg)
+    segments[:] = unique
     
 #asumes 4 closed edges            
 def generate_torus_from_outbound (instance, data):
     if not torus_from_outbound:
         return
     
-    global faces, edges, vertexs
     
     r1 = get_instance_value(instance,"r1")
     r2 = get_instance_value(instance,"r2")
@@ -1124,56 +2309,165 @@ def generate_torus_from_outbound (instance, data):
         
         sign = segments[1]["sign"]
         
-        iv = len(vertexs)
         for i in range (0,im):
             # continue  
             a = sub_v3_v3(segments[1]["verts"][0],segments[1]["center"])
             b = sub_v3_v3(segments[1]["verts"][i],segments[1]["center"])      
             an = angle_v3_v3(np.array(a),np.array(b))*sign
             rm = rotation_matrix_axis (segments[1]["plane"],an)
-            vv = []
             for j in range(0,jm):
-                vertexs.append (np.dot(rm,segments[0]["verts"][j]))  
-                if (j==jm-1):
-                    None
-                    if (i==im-1):
-                        None
-                    else:
-                        edges.append([iv+i*jm+j,iv+i*jm+j+jm])
-                else:
-                    edges.append([iv+i*jm+j,iv+i*jm+j+1])
-                    if (i==im-1):
-                        None
-                    else:
-                        edges.append([iv+i*jm+j,iv+i*jm+j+jm])
-                        faces.append([iv+i*jm+j,iv+i*jm+j+1,iv+i*jm+j+jm+1,iv+i*jm+j+jm])
+                verts.append(np.dot(rm,segments[0]["verts"][j]))
+
+        # the first and last rows and columns lie on the arcs of the outbound
+        border = np.zeros((im, jm), dtype=bool)
+        border[[0, -1], :] = True
+        border[:, [0, -1]] = True
+        ids = get_surface_vert_ids(verts, border.reshape(-1), segments)
+
+        grid = np.arange(im*jm).reshape(im, jm)
+        mesh.add_edges(ids[np.stack((grid[:, :-1], grid[:, 1:]), axis=-1).reshape(-1, 2)])
+        mesh.add_edges(ids[np.stack((grid[:-1, :], grid[1:, :]), axis=-1).reshape(-1, 2)])
+        add_surface_faces(get_grid_quads(0, im, jm, closed_m=False, closed_n=False), ids)
     else:
         print ("expected r2 segment") 
          
     #the other 2 segments are ignored   
     
-def generate_spherical_surface (pm, r):
-    global vertexs,faces
-    prec = 32
-    h = [0,0,0]
-    pm3 = convert_m4_to_m3(pm)
-    iv = len(vertexs)
-    for i in range(0,17):
-        a = ((math.pi*2)/prec)*i
-        x,y = math.sin(a)*r, math.cos(a)*r    
-        h[0], h[1], h[2] = 0, 0, y  
-        h = np.dot(h,pm3)
-        tm = translate_matrix(pm,h)
-        verts = get_circle_verts(tm,x)    
-        for j in range (0,prec):
-            vertexs.append(verts[j])
-            if i == 16:
-                None
-            else:
-                if j==prec-1:
-                    faces.append ([iv+i*prec+j,iv+i*prec,iv+(i+1)*prec,iv+(i+1)*prec+j])
-                else:
-                    faces.append ([iv+i*prec+j,iv+i*prec+j+1,iv+(i+1)*prec+j+1,iv+(i+1)*prec+j]) 
+'''
+samples a profile curve (circle, line or b-spline) once, to be swept
+@param points points of the face, used to trim the infinite lines
+returns [n,3] array of verts and if the profile is closed
+'''
+def get_profile_verts (curve, points):
+    if curve["name"] == "CIRCLE":
+        verts = get_circle_verts(
+            get_matrix_from_axis2_placement_3d(get_instance_value(curve,"placement")),
+            get_instance_value(curve,"radi")
+        )
+        return np.array(verts), True
+    elif curve["name"] == "LINE":
+        co = np.array(get_instance_value(curve, ["cartesian_point","coordinates"]))
+        d = normalize_v3(np.array(get_instance_value(curve, ["vector","direction","values"])))
+        t = np.dot(np.subtract(points, co), d)
+        return co + np.outer([t.min(), t.max()], d), False
+    elif is_bspline_curve(curve):
+        bs = get_bspline_curve_data(curve)
+        u = get_bspline_params(bs["degree"], bs["knot_vector"])
+        return eval_bspline_curve(bs["degree"], bs["points"], bs["knot_vector"], u, bs["weights"]), False
+
+    print ("Unexpected profile curve " + curve["name"])
+    return None, False
+
+'''
+signed angle from a to b, around the axis, in [0, 2*pi)
+'''
+def angle_axis_v3_v3 (a, b, axis):
+    an = math.atan2(np.dot(axis, np.cross(a, b)), np.dot(a, b))
+    if an < 0:
+        an = an + math.pi*2
+    return an
+
+'''
+generates a surface of revolution, sweeping the profile curve around the axis
+the angle of the sweep is taken from the seam edge:
+    if the seam is a circle around the axis, the sweep goes from v1 to v2 of the edge
+    otherwise the seam is the profile, and the sweep is a full turn
+the angular step is given by the circle precision (or tolerance) for the max radius of the profile
+the quads face along the surface normal (the sweep direction cross the profile direction),
+or against it if sense is False
+'''
+def generate_revolution_faces (instance, edge_curve, fb, sense=True):
+    if instance["name"] != "SURFACE_OF_REVOLUTION":
+        return
+
+    origin = np.array(get_instance_value(instance, ["axis", "point", "coordinates"]))
+    axis = normalize_v3(np.array(get_instance_value(instance, ["axis", "dir", "values"])))
+
+    points = []
+    loop = get_instance_value(fb, "loop")
+    for oe in get_instance_value(loop, "oriented_edges"):
+        points.append(get_instance_value(oe, ["edge_curve", "v1", "cartesian_point", "coordinates"]))
+        points.append(get_instance_value(oe, ["edge_curve", "v2", "cartesian_point", "coordinates"]))
+
+    profile, closed = get_profile_verts(get_instance_value(instance, "profile"), points)
+    if profile is None:
+        return
+
+    # radial vectors of the profile
+    d = profile - origin
+    radial = d - np.outer(np.dot(d, axis), axis)
+    ri = np.argmax(np.linalg.norm(radial, axis=1))
+    prec = get_circle_precision(np.linalg.norm(radial[ri]))
+
+    # grid quads face against the sweep cross the profile, circle profiles are sampled against its parameter
+    flip = sense == (get_instance_value(instance, "profile")["name"] != "CIRCLE")
+
+    start = 0.0
+    sweep = math.pi*2
+    path = get_instance_value(edge_curve, ["object", "geom"])
+    if path and path["name"] == "CIRCLE":
+        pm = get_matrix_from_axis2_placement_3d(get_instance_value(path, "placement"))
+        c, n = pm[3,:3], pm[2,:3]
+        if abs(abs(np.dot(n, axis)) - 1) < 1e-6 and v3_len(np.cross(c - origin, axis)) < 0.001:
+            v1 = np.array(get_instance_value(edge_curve, ["v1","cartesian_point","coordinates"]))
+            v2 = np.array(get_instance_value(edge_curve, ["v2","cartesian_point","coordinates"]))
+            if get_instance_value(edge_curve, "unknown5") == ".F.":
+                v1, v2 = v2, v1
+            if np.dot(n, axis) < 0:
+                axis = -axis
+                flip = not flip
+            r1 = (v1 - c) - np.dot(v1 - c, axis)*axis
+            r2 = (v2 - c) - np.dot(v2 - c, axis)*axis
+            # the profile is moved to v1, and swept to v2
+            start = angle_axis_v3_v3(radial[ri], r1, axis)
+            if not eq_v3(v1, v2):
+                sweep = angle_axis_v3_v3(r1, r2, axis) or math.pi*2
+
+    full = sweep >= math.pi*2
+    if full:
+        m = prec
+        sin, cos = get_unit_circle(prec)
+        verts = rotate_points_axis_sin_cos(profile, origin, axis, sin, cos)
+        if start:
+            verts = rotate_points_axis(verts.reshape(-1, 3), origin, axis, [start])
+    else:
+        m = max(1, int(math.ceil(prec*sweep/(math.pi*2)))) + 1
+        angles = start + sweep*np.arange(m)/(m-1)
+        verts = rotate_points_axis(profile, origin, axis, angles)
+
+    # the open ends of the sweep lie on the edges of the face bound
+    n = len(profile)
+    border = np.zeros((m, n), dtype=bool)
+    if not full:
+        border[[0, -1], :] = True
+    if not closed:
+        border[:, [0, -1]] = True
+    ids = get_surface_vert_ids(verts, border.reshape(-1), get_face_bound_segments(fb))
+
+    quads = get_grid_quads(0, m, n, closed_m=full, closed_n=closed)
+    if flip:
+        quads = quads[:, ::-1]
+    add_surface_faces(quads, ids)
+
+'''
+generates a sphere, parallels from pole to pole
+the verts on the segments of the outbound are shared with the neighbour faces, the verts at each pole merged
+the sphere is not trimmed by the outbound, so the other verts are left to the weld
+'''
+def generate_spherical_surface (pm, r, segments=()):
+    prec = get_circle_precision(r)
+    sin, cos = get_unit_circle(prec)
+    pm = np.asarray(pm, dtype=float)
+
+    # parallels from pole to pole, half circle of the same table
+    n = prec//2 + 1
+    x, y = sin[:n]*r, cos[:n]*r
+    centers = pm[3,:3] + np.outer(y, pm[2,:3])
+    circle = np.outer(cos, pm[0,:3]) + np.outer(sin, pm[1,:3])
+    verts = centers[:, None, :] + x[:, None, None]*circle[None, :, :]
+
+    ids = get_surface_vert_ids(verts, bool(segments), segments)
+    add_surface_faces(get_grid_quads(0, n, prec, closed_m=False, closed_n=True), ids)
     
 def generate_spherical_surface_from_outbound (instance, data):
     segments = get_segments(data)
@@ -1183,7 +2477,8 @@ def generate_spherical_surface_from_outbound (instance, data):
         # Check the radi ??
         generate_spherical_surface (
             get_matrix_from_axis2_placement_3d(get_instance_value(instance,"placement")),
-            get_instance_value(instance,"radi")
+            get_instance_value(instance,"radi"),
+            segments
         )
     else:
         print ("Outbound not applied")
@@ -1198,10 +2493,16 @@ structure["PLANE"] = "unknown", "AXIS2_PLACEMENT_3D|axis2_placement_3d"
 structure["ADVANCED_FACE"] = "unknown","FACE_BOUND|FACE_OUTER_BOUND|data","PLANE|CYLINDRICAL_SURFACE|TOROIDAL_SURFACE|CONICAL_SURFACE|SPHERICAL_SURFACE|SURFACE_OF_REVOLUTION|def", "unknown2"
     
 #X = FACE_BOUND('',#19,.F.);
-structure["FACE_BOUND"] = "unknown1", "EDGE_LOOP|VERTEX_LOOP|loop", "unknown2"
+structure["FACE_BOUND"] = "unknown1", "EDGE_LOOP|VERTEX_LOOP|POLY_LOOP|loop", "unknown2"
 
 #X = FACE_OUTER_BOUND('',#1091,.T.);
-structure["FACE_OUTER_BOUND"] = "unknown1", "EDGE_LOOP|loop", "unknown2"
+structure["FACE_OUTER_BOUND"] = "unknown1", "EDGE_LOOP|POLY_LOOP|loop", "unknown2"
+
+#X = FACE('',(#19));
+structure["FACE"] = "unknown", "FACE_BOUND|FACE_OUTER_BOUND|data"
+
+#X = POLY_LOOP('',(#20,#21,#22));
+structure["POLY_LOOP"] = "unknown1", "CARTESIAN_POINT|points"
     
 #X = EDGE_LOOP('',(#20,#55,#83,#111));
 structure["EDGE_LOOP"] = "unknown1", "ORIENTED_EDGE|oriented_edges"
@@ -1213,7 +2514,7 @@ structure["VERTEX_LOOP"] = "unknown1", "VERTEX_POINT|vertex"
 structure["ORIENTED_EDGE"] = "unknown1", "unknown2", "unknown3", "EDGE_CURVE|edge_curve", "unknown5"
 
 #X = CONICAL_SURFACE('',#512,6.052999999999996,45.000000000000142);
-structure["CONICAL_SURFACE"] = "unknown1", "AXIS2_PLACEMENT_3D|axis2_placement3d", "unknown2", "uknown3"
+structure["CONICAL_SURFACE"] = "unknown1", "AXIS2_PLACEMENT_3D|axis2_placement_3d", "float|radi", "float|semi_angle"
 
 #X = EDGE_CURVE('',#22,#24,#26,.T.);
 structure["EDGE_CURVE"] = "unknown1", "VERTEX_POINT|v1", "VERTEX_POINT|v2", "SURFACE_CURVE|CIRCLE|LINE|B_SPLINE_CURVE_WITH_KNOTS|ELLIPSE|SEAM_CURVE|object", "unknown5"
@@ -1222,14 +2523,14 @@ structure["EDGE_CURVE"] = "unknown1", "VERTEX_POINT|v1", "VERTEX_POINT|v2", "SUR
 structure["CIRCLE"] = "unknown1", "AXIS2_PLACEMENT_3D|AXIS2_PLACEMENT_2D|placement", "float|radi"
 
 #X= ELLIPSE('',#539,7.296415549894075,5.053)
-structure["ELLIPSE"] = "unknown1", "AXIS2_PLACEMENT_3D|axis2_placement3d", "r1", "r2"
+structure["ELLIPSE"] = "unknown1", "AXIS2_PLACEMENT_3D|placement", "float|semi_axis1", "float|semi_axis2"
 
 #X = SURFACE_CURVE('',#27,(#31,#43),.PCURVE_S1.)
 def surface_curve_load(instance):
     None
     #print (get_instance_path(instance))
 
-structure["SURFACE_CURVE"] = "unknown", "LINE|CIRCLE|object", "PCURVE|data", "unknown2"
+structure["SURFACE_CURVE"] = "unknown", "LINE|CIRCLE|ELLIPSE|B_SPLINE_CURVE_WITH_KNOTS|object", "PCURVE|data", "unknown2"
 structure_func["SURFACE_CURVE"] = { "load" : surface_curve_load }
 
 #X = SPHERICAL_SURFACE('',#387,4.25);
@@ -1238,16 +2539,13 @@ structure["SPHERICAL_SURFACE"] = "unknown", "AXIS2_PLACEMENT_3D|placement", "flo
 #X = TOROIDAL_SURFACE('',#3175,1.399999999999998,0.300000000000002);
 structure["TOROIDAL_SURFACE"] = "unknown", "AXIS2_PLACEMENT_3D|axis2_placement3d", "float|r1", "float|r2"
 
-#X = SURFACE_OF_REVOLUTION('',#34,#39);
-structure["SURFACE_OF_REVOLUTION"] = "unknown", "CIRCLE|circle", "AXIS1_PLACEMENT_3D|axis"
-
 
 #X = B_SPLINE_CURVE_WITH_KNOTS('',3,(#),.UNSPECIFIED.,.T.,.U.,(4),(0.0),.UNSPECIFIED.);
 # ( B_SPLINE_CURVE_WITH_KNOTS((1),(0.0),.UNSPECIFIED.))
 structure ["B_SPLINE_CURVE_WITH_KNOTS"] = []
-t = "int_data_unknown", "float_data_unknown", "unknown6"
+t = "int|knot_multiplicities", "float|knots", "knot_spec"
 structure ["B_SPLINE_CURVE_WITH_KNOTS"].append(t)
-t= "unknown", "unknown2", "CARTESIAN_POINT|data", "unknown3", "unknown4", "unkown5", "int_data_unknown", "float_data_unknown", "unknown6"
+t= "unknown", "int|degree", "CARTESIAN_POINT|control_points", "curve_form", "closed_curve", "self_intersect", "int|knot_multiplicities", "float|knots", "knot_spec"
 structure ["B_SPLINE_CURVE_WITH_KNOTS"].append(t)
 
 #X = PCURVE('',#32,#37);
@@ -1264,7 +2562,7 @@ structure["SEAM_CURVE"] = "unknown", "CIRCLE|LINE|geom", "PCURVE|pcurves", "unkn
 structure_func["SEAM_CURVE"] = {"first_load" : seam_curve_load }
 
 #X = SURFACE_OF_REVOLUTION('',#34,#39);
-structure["SURFACE_OF_REVOLUTION"] = "unknown", "CIRCLE|circle", "AXIS1_PLACEMENT|axis"
+structure["SURFACE_OF_REVOLUTION"] = "unknown", "CIRCLE|LINE|B_SPLINE_CURVE_WITH_KNOTS|profile", "AXIS1_PLACEMENT|axis"
 
 #X = DEFINITIONAL_REPRESENTATION('',(#38),#42);
 structure["DEFINITIONAL_REPRESENTATION"] = "unkown", "LINE|multiple|data", None
@@ -1276,18 +2574,11 @@ structure["LINE"] = "unknown1", "CARTESIAN_POINT|cartesian_point", "VECTOR|vecto
 structure["VECTOR"] = "unknown1", "DIRECTION|direction", "value"
 
 #X = VERTEX_POINT('',#23);
-def set_vertex_index (instance):
-    global vertexs
-    co = get_instance_value(instance, ["cartesian_point","coordinates"])
-    vertexs.append ([co[0], co[1], co[2]])
-    instance["data"]["vertex_id"] = len(vertexs)-1
-
 structure["VERTEX_POINT"] = "unknown1","CARTESIAN_POINT|cartesian_point"
-structure_func["VERTEX_POINT"] = {"first_load" : set_vertex_index}
 structure_params["VERTEX_POINT"] = {"print_verbose" : 1}
 
 #X = CLOSED_SHELL('',(#17,#137,#237,#284,#331,#338));
-structure["CLOSED_SHELL"] = "unknown", "ADVANCED_FACE|data"
+structure["CLOSED_SHELL"] = "unknown", "ADVANCED_FACE|FACE|data"
 
 #X = MANIFOLD_SOLID_BREP('',#16);
 a = 0
@@ -1297,11 +2588,15 @@ def process_face_bound(fb, face, obj):
     loop = get_instance_value(fb,"loop")
     segments = []
     surface_segments = []
+    swept = False
     if loop["name"] == "EDGE_LOOP":
         for oe in get_instance_value(fb,["loop","oriented_edges"]):  
             edge_curve = get_instance_value(oe, "edge_curve")
             surf = get_instance_value(edge_curve,"object")
-            if (surf["name"] == "SURFACE_CURVE"):
+            if (surf["name"] == "SEAM_CURVE" and swept):
+                # the seam is used twice in the loop, the surface is already generated
+                None
+            elif (surf["name"] == "SURFACE_CURVE"):
                 object = get_instance_value(surf,"object")
                 if object:
                     append_to_segment (surface_segments, object, edge_curve)
@@ -1309,33 +2604,24 @@ def process_face_bound(fb, face, obj):
                     print ("No object")
                     
             elif (surf["name"] == "SEAM_CURVE"):
-                if (obj["name"] == "CYLINDRICAL_SURFACE"):
-                    v1 = get_instance_value(edge_curve, "v1")
-                    v2 = get_instance_value(edge_curve, "v2")
-                    iv = len(vertexs)
-                    prec= 32
-                    for i in range (0,prec):
-                        a1 = ((math.pi*2)/prec)*i
-                        rm = rotation_matrix(a1,3)
-                        co_v1 = np.matmul (get_instance_value(v1, ["cartesian_point","coordinates"]),rm)
-                        co_v2 = np.matmul (get_instance_value(v2, ["cartesian_point","coordinates"]),rm)
-                        vertexs.append(co_v1)   
-                        vertexs.append(co_v2)
-                        edges.append([iv+i*2,iv+i*2+1])
-                        if (i==31):
-                            faces.append([iv+i*2,iv+i*2+1,iv+1,iv])
-                        else:
-                            faces.append([iv+i*2,iv+i*2+1,iv+(i+1)*2+1,iv+(i+1)*2])
+                if obj["name"] in ["CYLINDRICAL_SURFACE", "CONICAL_SURFACE"]:
+                    generate_seam_faces(obj, edge_curve, fb, get_instance_value(face, "unknown2") != ".F.")
+                    swept = True
                 elif obj["name"] == "SURFACE_OF_REVOLUTION":
-                    print ("TODO: generate surface of revolution")
+                    generate_revolution_faces(obj, edge_curve, fb, get_instance_value(face, "unknown2") != ".F.")
+                    swept = True
                 else:
                     print ("Unexpected object on seam curve: " + obj["name"])
             elif (surf["name"] == "CIRCLE"):
-                append_to_segment (segments, surf, None)
+                # full circles keep its edge curve, to share its verts with the neighbour faces
+                closed = get_instance_value(edge_curve,"v1")["number"] == get_instance_value(edge_curve,"v2")["number"]
+                append_to_segment (segments, surf, edge_curve if closed else None)
+            elif surf["name"] == "ELLIPSE" or is_bspline_curve(surf):
+                append_to_segment (segments, surf, edge_curve)
             else:
                 print ("Unknown for face bound edge loop " + surf["name"])
         
-        if len(surface_segments) > 0:
+        if len(surface_segments) > 0 and not swept:
             generate_surface_from_segments(surface_segments)    
         
         if len(segments) > 0:
@@ -1357,6 +2643,7 @@ def process_face_outer_bound(fb, face, obj, bound):
     #surf is a definet face_bound
     loop = get_instance_value(fb,"loop")
     global b
+    data = []
     if loop["name"] == "EDGE_LOOP":
         for oe in get_instance_value(fb,["loop","oriented_edges"]):
             
@@ -1370,59 +2657,615 @@ def process_face_outer_bound(fb, face, obj, bound):
     elif obj["name"] == "PLANE":
         generate_planar_faces_from_outbound(obj,data, bound)
     elif obj["name"] == "CYLINDRICAL_SURFACE":
-        generate_cylindrical_faces_from_outbound(obj,data)
+        generate_cylindrical_faces_from_outbound(obj,data, bound, get_instance_value(face, "unknown2") != ".F.")
     elif obj["name"] == "SPHERICAL_SURFACE":
         generate_spherical_surface_from_outbound(obj, data)
+    elif obj["name"] == "CONICAL_SURFACE":
+        generate_conical_faces_from_outbound(obj, data, bound, get_instance_value(face, "unknown2") != ".F.")
     else:
         print ("Unknown object to apply outer bound ",obj["name"])
 
+def tessellate_face (face):
+    global a, b, face_key
+    face_key = face["number"]
+    if (face["name"] == "ADVANCED_FACE"):
+        surf = None
+        segment = None
+        obj = get_instance_value(face,"def")
+        if not obj["name"] in  ["PLANE",
+                                "TOROIDAL_SURFACE", 
+                                "CYLINDRICAL_SURFACE", 
+                                "CONICAL_SURFACE",
+                                "SURFACE_OF_REVOLUTION",
+                                "SPHERICAL_SURFACE"]:
+                                    
+            print ("Unknown definition for advanced face " + obj["name"])
+
+        if obj["name"] == "PLANE" and planar_triangulation:
+            generate_planar_face(face, obj)
+            return
+
+        for fb in get_instance_value(face,["data"]):
+            if fb["name"] == "FACE_BOUND":
+                if surf != None:
+                    print ("More than one face bound?")
+                segment = process_face_bound (fb, face, obj)
+            elif fb["name"] == "FACE_OUTER_BOUND":
+                #Process alwas face bound first, outer in next loop
+                None
+            else:
+                print ("Unknown instance "  + fb["name"])
+                
+        for fb in get_instance_value(face,["data"]):
+            if fb["name"] == "FACE_OUTER_BOUND":
+                process_face_outer_bound(fb, face, obj, segment)
+           
+        
+        if obj["name"] == "PLANE":
+            None
+        elif obj["name"] == "TOROIDAL_SURFACE":
+            a = a +1
+        elif obj["name"] == "CYLINDRICAL_SURFACE":
+            b = b +1
+        elif obj["name"] == "SURFACE_OF_REVOLUTION":
+            None
+
+    elif face["name"] == "FACE":
+        generate_poly_loop_face(face)
+    else:
+        print ("Unknown instance")
+
 def set_faces (instance):
-    global a, b
     print ("Solid data")
-    segment = None
-    for face in get_instance_value(instance, ["closed_shell", "data"]):
-        if (face["name"] == "ADVANCED_FACE"):
-            surf = None
-            obj = get_instance_value(face,"def")
-            if not obj["name"] in  ["PLANE",
-                                    "TOROIDAL_SURFACE", 
-                                    "CYLINDRICAL_SURFACE", 
-                                    "SURFACE_OF_REVOLUTION",
-                                    "SPHERICAL_SURFACE"]:
-                                        
-                print ("Unknown definition for advanced face " + obj["name"])
-                
-            for fb in get_instance_value(face,["data"]):
-                if fb["name"] == "FACE_BOUND":
-                    if surf != None:
-                        print ("More than one face bound?")
-                    segment = process_face_bound (fb, face, obj)
-                elif fb["name"] == "FACE_OUTER_BOUND":
-                    #Process alwas face bound first, outer in next loop
-                    None
-                else:
-                    print ("Unknown instance "  + fb["name"])
-                    
-            for fb in get_instance_value(face,["data"]):
-                if fb["name"] == "FACE_OUTER_BOUND":
-                    process_face_outer_bound(fb, face, obj, segment)
-               
-            
-            if obj["name"] == "PLANE":
-                None
-            elif obj["name"] == "TOROIDAL_SURFACE":
-                a = a +1
-            elif obj["name"] == "CYLINDRICAL_SURFACE":
-                b = b +1
-            elif obj["name"] == "SURFACE_OF_REVOLUTION":
-                None
+    colour = get_solid_colour(instance)
+    faces = get_instance_value(instance, ["closed_shell", "data"])
+    colours = [item_colours.get(face["number"], colour) for face in faces]
+    if parallel_solids and is_parallel_available():
+        # tessellated after loading the file, see import_pending_objects
+        pending_solids.append((instance, colours))
+        return
+
+    if parallel_faces and len(faces) >= parallel_min_faces and is_parallel_available():
+        tessellate_faces_parallel(faces, colours)
+    else:
+        for face, colour in zip(faces, colours):
+            mesh.colour = colour
+            tessellate_face(face)
+    solid_tessellated()
 
-        else:
-            print ("Unknown instance")
-        
 structure["MANIFOLD_SOLID_BREP"] = "unknown", "CLOSED_SHELL|closed_shell"
 structure_func["MANIFOLD_SOLID_BREP"] = {"first_load" : set_faces}
 
+#X = FACETED_BREP('',#16);
+structure["FACETED_BREP"] = structure["MANIFOLD_SOLID_BREP"]
+structure_func["FACETED_BREP"] = structure_func["MANIFOLD_SOLID_BREP"]
+
+'''
+instances of the solids, tessellated by set_faces
+'''
+solid_instances = ("MANIFOLD_SOLID_BREP", "FACETED_BREP")
+
+### COLOURS ###
+
+'''
+colours of DRAUGHTING_PRE_DEFINED_COLOUR
+'''
+predefined_colours = {"red" : (255, 0, 0), "green" : (0, 255, 0), "blue" : (0, 0, 255),
+                      "yellow" : (255, 255, 0), "magenta" : (255, 0, 255), "cyan" : (0, 255, 255),
+                      "black" : (0, 0, 0), "white" : (255, 255, 255)}
+
+'''
+styles of wires and text, its colours are not applied to the faces
+'''
+wire_styles = ["CURVE_STYLE", "POINT_STYLE", "TEXT_STYLE", "FILL_AREA_STYLE_HATCHING"]
+
+def get_colour_key (rgb):
+    return tuple(int(round(min(max(c, 0.0), 1.0)*255)) for c in rgb)
+
+def get_param_references (params):
+    if isinstance(params, list):
+        for param in params:
+            for ref in get_param_references(param):
+                yield ref
+    elif params.startswith("#"):
+        yield params
+
+'''
+colour of a style, the first surface colour found following its references
+styles are shared between styled items, memo[number] = colour
+'''
+def get_style_colour (number, memo):
+    if number in memo:
+        return memo[number]
+    memo[number] = None
+
+    instance = get_instance(number)
+    name = instance["name"]
+    colour = None
+    if name == "COLOUR_RGB":
+        try:
+            colour = get_colour_key([float(c) for c in instance["params"][1:4]])
+        except ValueError:
+            print ("Unknown colour " + instance["number"], instance["params"])
+    elif name == "DRAUGHTING_PRE_DEFINED_COLOUR":
+        colour = predefined_colours.get(instance["params"][0].strip("'").lower())
+    elif name and not name in wire_styles:
+        for ref in get_param_references(instance["params"]):
+            colour = get_style_colour(ref, memo)
+            if colour is not None:
+                break
+
+    memo[number] = colour
+    return colour
+
+'''
+reads the colours of the styled items of the file, to item_colours and colour_palette
+over-riding styled items are applied after the styled items
+'''
+def read_colours ():
+    del colour_palette[:]
+    item_colours.clear()
+    memo = {}
+    palette = {}
+    over_riding = []
+    for instance in instances:
+        if instance["name"] == "OVER_RIDING_STYLED_ITEM":
+            over_riding.append(instance)
+        elif instance["name"] == "STYLED_ITEM":
+            set_styled_item_colour(instance, memo, palette)
+    for instance in over_riding:
+        set_styled_item_colour(instance, memo, palette)
+
+def set_styled_item_colour (instance, memo, palette):
+    colour = None
+    for ref in get_param_references(instance["params"][1]):
+        colour = get_style_colour(ref, memo)
+        if colour is not None:
+            break
+    if colour is None:
+        return
+    if not colour in palette:
+        palette[colour] = len(colour_palette)
+        colour_palette.append(colour)
+    item_colours[instance["params"][2]] = palette[colour]
+
+'''
+colour of the faces of a solid without its own colour: the colour of the solid, its shell, or its shape
+'''
+def get_solid_colour (solid):
+    colour = item_colours.get(object_shape, -1)
+    # the solid and its shell, read from the params as the solid of a proxy is not loaded
+    for number in (solid["number"], solid["params"][1]):
+        colour = item_colours.get(number, colour)
+    return colour
+
+'''
+(material index of each face, colour of each material) of the faces of the mesh,
+the faces without colour get an empty material, None if no face has colour
+'''
+def get_object_materials ():
+    colours = mesh.get_face_colours()
+    if not len(colours) or colours.max() < 0:
+        return None
+    used, index = np.unique(colours, return_inverse=True)
+    return index.astype(np.int32), [colour_palette[c] if c >= 0 else None for c in used]
+
+### PROXIES ###
+
+'''
+instances not followed looking for the points of a solid
+surfaces and lines are unbounded, their placement points can be far from the solid
+the b-spline surfaces are followed, their control points bound them
+'''
+proxy_skipped_instances = ["PLANE", "LINE", "PCURVE", "AXIS2_PLACEMENT_3D", "AXIS2_PLACEMENT_2D",
+                           "AXIS1_PLACEMENT", "DIRECTION", "VECTOR"]
+
+def is_proxy_skipped (name):
+    return name in proxy_skipped_instances or (name.endswith("_SURFACE") and not name.startswith("B_SPLINE"))
+
+'''
+bounded surfaces, a tube of a radius around a ring of a radius around the axis of its placement (its second param)
+proxy_spheres[name] = (param of the ring radius or None, param of the tube radius)
+'''
+proxy_spheres = {"SPHERICAL_SURFACE" : (None, 2),
+                 "TOROIDAL_SURFACE" : (2, 3)}
+
+'''
+curves bounded by its arcs, see get_conic_arc_points
+'''
+proxy_conics = ["CIRCLE", "ELLIPSE"]
+
+'''
+coordinates of a CARTESIAN_POINT or DIRECTION (or a reference to it), None if it is not a 3d one
+'''
+def get_raw_coordinates (instance):
+    if isinstance(instance, str):
+        if not instance.startswith("#"):
+            return None
+        instance = get_instance(instance)
+    try:
+        co = [float(c) for c in instance["params"][1]]
+    except (ValueError, TypeError, IndexError):
+        return None
+    return co if len(co) == 3 else None
+
+'''
+(location, axis, ref_direction, r1, r2) of a CIRCLE or ELLIPSE, the frame as in get_frame_matrix
+its points are p = c + r1*cos(t)*x + r2*sin(t)*y as in get_ellipse_param, None if it is not placed in 3d
+'''
+def get_raw_conic (instance):
+    params = instance["params"]
+    placement = get_instance(params[1])
+    if placement["name"] != "AXIS2_PLACEMENT_3D":
+        return None
+    point, axis, ref = [get_raw_coordinates(p) for p in placement["params"][1:4]]
+    if point is None:
+        return None
+    r1 = float(params[2])
+    r2 = float(params[3]) if instance["name"] == "ELLIPSE" else r1
+    return (point, (0.0, 0.0, 1.0) if axis is None else axis, (1.0, 0.0, 0.0) if ref is None else ref, r1, r2)
+
+'''
+(conic, start, end) of an EDGE_CURVE on a circle or an ellipse, the conic as in get_raw_conic
+the arc goes from start to end along the curve, v1 to v2 or v2 to v1 if same_sense is .F.
+start and end are the same point for a closed curve, None for the other curves
+'''
+def get_raw_edge_arc (edge_curve):
+    params = edge_curve["params"]
+    curve = get_instance(params[3])
+    if curve["name"] in ["SURFACE_CURVE", "SEAM_CURVE"]:
+        curve = get_instance(curve["params"][1])
+    if not curve["name"] in proxy_conics:
+        return None
+
+    conic = get_raw_conic(curve)
+    p1, p2 = [get_raw_coordinates(get_instance(v)["params"][1]) for v in params[1:3]]
+    if conic is None or p1 is None or p2 is None:
+        return None
+    if params[1] == params[2]:
+        p2 = p1
+    if params[4] == ".F.":
+        p1, p2 = p2, p1
+    return conic, p1, p2
+
+'''
+points bounding arcs of conics, (conic, start, end) as in get_raw_edge_arc, computed at once:
+the ends of each arc, its extrema along the world axes and the ends of the axes of its conic on the arc
+'''
+def get_conic_arc_points (arcs):
+    conics, starts, ends = zip(*arcs)
+    points, axes, refs, r1, r2 = [np.array(v, dtype=float) for v in zip(*conics)]
+    pm = get_frame_matrices(points, axes, refs)
+    x, y, c = pm[:,1,:3], pm[:,0,:3], pm[:,3,:3]
+    starts = np.array(starts, dtype=float)
+    ends = np.array(ends, dtype=float)
+
+    t1 = np.arctan2(((starts - c)*y).sum(axis=1)/r2, ((starts - c)*x).sum(axis=1)/r1)
+    t2 = np.arctan2(((ends - c)*y).sum(axis=1)/r2, ((ends - c)*x).sum(axis=1)/r1)
+    sweep = (t2 - t1) % (math.pi*2)
+    sweep[np.all(starts == ends, axis=1)] = math.pi*2
+
+    extrema = np.arctan2(r2[:, None]*y, r1[:, None]*x)
+    t = np.hstack((extrema, extrema + math.pi, np.tile(np.arange(4)*math.pi/2, (len(arcs), 1))))
+    on_arc = (t - t1[:, None]) % (math.pi*2) <= sweep[:, None]
+    arc = (c[:, None] + (np.cos(t)*r1[:, None])[..., None]*x[:, None]
+           + (np.sin(t)*r2[:, None])[..., None]*y[:, None])
+    return np.vstack((starts, ends, arc[on_arc]))
+
+'''
+points bounding a solid: the vertex points, the control points of the b-splines,
+the bounds of the arcs of circles and ellipses, and the corners of the boxes of the spheres
+the references are followed on the params of the instances, nothing is loaded
+'''
+def get_solid_points (solid):
+    points = []
+    arcs = []
+    visited = set()
+    pending = [solid["params"][1]]
+    while pending:
+        value = pending.pop()
+        if isinstance(value, str):
+            if value in visited:
+                continue
+            visited.add(value)
+            value = get_instance(value)
+
+        name = value["name"]
+        if name == "CARTESIAN_POINT":
+            co = get_raw_coordinates(value)
+            if co is not None:
+                points.append(co)
+            continue
+        if name == "EDGE_CURVE":
+            arc = get_raw_edge_arc(value)
+            if arc is not None:
+                arcs.append(arc)
+                continue
+        elif name in proxy_conics:
+            # not trimmed by an edge, the whole curve, from its center that is inside its box
+            conic = get_raw_conic(value)
+            if conic is not None:
+                arcs.append((conic, conic[0], conic[0]))
+            continue
+        elif name in proxy_spheres:
+            ring, tube = proxy_spheres[name]
+            placement = get_instance(value["params"][1])
+            center, axis = [get_raw_coordinates(p) for p in placement["params"][1:3]]
+            if center is not None:
+                # the ring is a circle around the axis, its extent along each world axis
+                center = np.array(center)
+                axis = np.array([0.0, 0.0, 1.0]) if axis is None else normalize_v3(np.array(axis))
+                r = float(value["params"][tube])
+                if ring is not None:
+                    r = r + float(value["params"][ring])*np.sqrt(np.maximum(1 - axis*axis, 0))
+                points.append(center - r)
+                points.append(center + r)
+            continue
+        if is_proxy_skipped(name):
+            continue
+
+        if "multiple" in value:
+            pending.extend(value["multiple"])
+        else:
+            pending.extend(get_param_references(value["params"]))
+
+    if arcs:
+        points.extend(get_conic_arc_points(arcs))
+    return np.array(points, dtype=float).reshape(-1, 3)
+
+'''
+(center, axes, half sizes) of the bounding box of the points, axes as rows
+the axes are the world axes, or the principal axes of the points for proxy_bounds "OBB"
+'''
+def get_bounding_box (points):
+    if proxy_bounds == "OBB" and len(points) > 3:
+        mean = points.mean(axis=0)
+        axes = np.linalg.eigh(np.cov((points - mean).T))[1].T
+        if np.linalg.det(axes) < 0:
+            axes[2] = -axes[2]
+    else:
+        axes = np.identity(3)
+    local = np.dot(points, axes.T)
+    lo = local.min(axis=0)
+    hi = local.max(axis=0)
+    return np.dot((lo + hi)/2, axes), axes, (hi - lo)/2
+
+proxy_box_corners = np.array([[-1,-1,-1], [1,-1,-1], [1,1,-1], [-1,1,-1],
+                              [-1,-1,1], [1,-1,1], [1,1,1], [-1,1,1]], dtype=float)
+proxy_box_quads = np.array([[0,3,2,1], [4,5,6,7], [0,1,5,4], [1,2,6,5], [2,3,7,6], [3,0,4,7]])
+
+'''
+adds the bounding box of a solid to the mesh
+'''
+def add_proxy_box (solid):
+    points = get_solid_points(solid)
+    if not len(points):
+        print ("No points found for the proxy of solid " + solid["number"])
+        return
+    center, axes, size = get_bounding_box(points)
+    first = mesh.add_verts(center + np.dot(proxy_box_corners*size, axes))
+    mesh.add_faces(proxy_box_quads + first)
+
+'''
+imports a solid as its bounding box, instead of loading it, see load_instance
+'''
+def add_proxy_solid (solid):
+    print ("Solid proxy")
+    mesh.colour = get_solid_colour(solid)
+    add_proxy_box(solid)
+    solid_tessellated()
+
+### PARALLEL TESSELLATION ###
+
+'''
+process pool of the current file, created on the first parallel tessellation
+'''
+process_pool = None
+
+'''
+workers are forked, so they get the loaded module without importing blender again
+'''
+def is_parallel_available ():
+    if not "fork" in multiprocessing.get_all_start_methods():
+        print ("Parallel tessellation needs fork processes, not available")
+        return False
+    return True
+
+def get_tessellation_settings ():
+    return dict((name, globals()[name]) for name in tessellation_settings)
+
+def init_tessellation_worker (settings):
+    globals().update(settings)
+
+def get_process_pool ():
+    global process_pool
+    if process_pool is None:
+        context = multiprocessing.get_context("fork")
+        process_pool = context.Pool(parallel_workers or None, init_tessellation_worker,
+                                    (get_tessellation_settings(),))
+    return process_pool
+
+def close_process_pool ():
+    global process_pool
+    if process_pool is not None:
+        process_pool.close()
+        process_pool.join()
+        process_pool = None
+
+'''
+copy of an instance and all the instances it references, without parent links and params
+the copy is self-contained and can be pickled, shared instances are copied once (memo)
+'''
+def detach_instance (instance, memo=None):
+    if memo is None:
+        memo = {}
+    if id(instance) in memo:
+        return memo[id(instance)]
+
+    copy = {"name" : instance["name"]}
+    memo[id(instance)] = copy
+    if "number" in instance:
+        copy["number"] = instance["number"]
+    if "matrix" in instance:
+        copy["matrix"] = instance["matrix"]
+    if "multiple" in instance:
+        copy["multiple"] = [detach_instance(i, memo) for i in instance["multiple"]]
+
+    data = instance.get("data")
+    if isinstance(data, dict):
+        data = dict((name, detach_value(value, memo)) for name, value in data.items())
+    copy["data"] = data
+    return copy
+
+def detach_value (value, memo):
+    if isinstance(value, list):
+        return [detach_value(v, memo) for v in value]
+    if isinstance(value, dict):
+        return detach_instance(value, memo)
+    return value
+
+'''
+tessellates a detached face on an empty mesh, runs on the worker processes
+job is (face, colour)
+'''
+def tessellate_face_job (job):
+    face, colour = job
+    init_mesh()
+    mesh.colour = colour
+    tessellate_face(face)
+    return get_tessellation_result()
+
+'''
+tessellates all the faces of a detached solid on an empty mesh, runs on the worker processes
+job is (solid, colour of each face)
+'''
+def tessellate_solid_job (job):
+    solid, colours = job
+    init_mesh()
+    for face, colour in zip(get_instance_value(solid, ["closed_shell", "data"]), colours):
+        mesh.colour = colour
+        tessellate_face(face)
+    return get_tessellation_result()
+
+'''
+(verts, edges, flat faces, face lengths, key of each vert, face colours) of the mesh, see vertex_ids
+'''
+def get_tessellation_result ():
+    keys = [None]*mesh.vert_count
+    for key, i in vertex_ids.items():
+        keys[i] = key
+    flat, lengths = mesh.get_flat_faces()
+    return mesh.verts.array, mesh.edges.array, flat, lengths, keys, mesh.get_face_colours()
+
+'''
+adds the tessellation of a face or a solid to the mesh
+verts with a key already on vertex_ids are shared, as in the serial tessellation
+'''
+def merge_tessellation (result):
+    verts, edges, flat, lengths, keys, colours = result
+    remap = np.empty(len(verts), dtype=int)
+    new = []
+    for i, key in enumerate(keys):
+        j = None if key is None else vertex_ids.get(key)
+        if j is None:
+            j = mesh.vert_count + len(new)
+            new.append(i)
+            if key is not None:
+                vertex_ids[key] = j
+        remap[i] = j
+
+    mesh.add_verts(verts[new])
+    mesh.add_edges(remap[edges])
+    mesh.add_flat_faces(remap[flat], lengths, colours)
+
+'''
+tessellates a chunk of detached faces, each one as tessellate_face_job, runs on the worker processes
+'''
+def tessellate_faces_job (jobs):
+    return [tessellate_face_job(job) for job in jobs]
+
+'''
+chunks of (face, colour) jobs, the faces of a chunk are detached together (sharing its memo)
+so the edges and points shared by its faces are copied and sent once
+'''
+def get_face_chunks (faces, colours, chunksize):
+    for i in range(0, len(faces), chunksize):
+        memo = {}
+        yield [(detach_instance(face, memo), colour) for face, colour in zip(faces[i:i+chunksize], colours[i:i+chunksize])]
+
+'''
+tessellates the faces in the process pool, merged in the order of the faces
+'''
+def tessellate_faces_parallel (faces, colours):
+    pool = get_process_pool()
+    chunksize = max(1, len(faces) // (4*(parallel_workers or multiprocessing.cpu_count())))
+    for results in pool.imap(tessellate_faces_job, get_face_chunks(faces, colours, chunksize)):
+        for result in results:
+            merge_tessellation(result)
+
+'''
+tessellates the solids of the loaded objects in the process pool, and imports the objects
+the solids are detached while the pool is already working on the first ones
+'''
+def import_pending_objects ():
+    global object_name
+    if not pending_objects:
+        return
+
+    solids = [solid for name, object_solids, shape in pending_objects for solid in object_solids]
+    results = get_process_pool().imap(tessellate_solid_job,
+                                      ((detach_instance(solid), colours) for solid, colours in solids))
+    count = 0
+    for name, object_solids, shape in pending_objects:
+        object_name = name
+        init_mesh()
+        for solid in object_solids:
+            merge_tessellation(next(results))
+            count = count + 1
+            print ("Tessellated solid %d/%d" % (count, len(solids)))
+            solid_tessellated()
+        print ("Importing: " + object_name)
+        imported_shapes[shape["number"]] = collect_object()
+
+    del pending_objects[:]
+
+'''
+tessellates the objects left on pending_objects by stream_solids, one at a time, yields (index, object)
+the instances loaded for an object are released before the next one, and the object is not kept
+'''
+def stream_pending_objects ():
+    global object_name, object_shape, recording_instances
+    for i in range(0, len(pending_objects)):
+        object_name, solids, shape = pending_objects[i]
+        pending_objects[i] = None
+        object_shape = shape["number"]
+        init_mesh()
+        recording_instances = 1
+        try:
+            for solid, colours in solids:
+                load_instance(solid)
+        finally:
+            recording_instances = 0
+            release_instances()
+
+        print ("Importing: " + object_name)
+        index = collect_object()
+        data = collected_objects[index]
+        collected_objects[index] = None
+        yield index, data
+
+    del pending_objects[:]
+
+'''
+returns the instances recorded while loading an object to its unloaded state, they are loaded again if needed
+'''
+def release_instances ():
+    for instance in recorded_instances:
+        instance["data"] = ""
+        instance.pop("parent", None)
+        instance.pop("matrix", None)
+    del recorded_instances[:]
+
 #X = DIRECTION('',(1.,0.,-0.));
 structure["DIRECTION"] = "unknown", "float|values"
 structure_params["DIRECTION"] = {"print_verbose" : 2}
@@ -1487,37 +3330,80 @@ structure["PRODUCT_DEFINITION"] = "type", "unknown1", "PRODUCT_DEFINITION_FORMAT
 structure["PRODUCT_DEFINITION_SHAPE"] = "name", "desc", "PRODUCT_DEFINITION|NEXT_ASSEMBLY_USAGE_OCCURRENCE|product_definition"
 
 #X = NEXT_ASSEMBLY_USAGE_OCCURRENCE('SIEM-PM-L00135:1','SIEM-PM-L00135:1','SIEM-PM-L00135:1',#12,#126,'SIEM-PM-L00135:1');
-structure["NEXT_ASSEMBLY_USAGE_OCCURRENCE"] = ["name","desc","unknown_str1","PRODUCT_DEFINITION|product_definition_1", "PRODUCT_DEFINITION|product_definition_2", "unknown_str2"]
+structure["NEXT_ASSEMBLY_USAGE_OCCURRENCE"] = "str|name","desc","unknown_str1","PRODUCT_DEFINITION|product_definition_1", "PRODUCT_DEFINITION|product_definition_2", "unknown_str2"
+
+#X = CONTEXT_DEPENDENT_SHAPE_REPRESENTATION(#987,#982);
+structure["CONTEXT_DEPENDENT_SHAPE_REPRESENTATION"] = "REPRESENTATION_RELATIONSHIP|representation_relation", "PRODUCT_DEFINITION_SHAPE|product_definition_shape"
+
+#X = (REPRESENTATION_RELATIONSHIP('SIEM-PM-L00135:1','SIEM-PM-L00135:1',#155,#41)REPRESENTATION_RELATIONSHIP_WITH_TRANSFORMATION(#983)SHAPE_REPRESENTATION_RELATIONSHIP());
+structure["REPRESENTATION_RELATIONSHIP"] = "str|name", "str|desc", "SHAPE_REPRESENTATION|ADVANCED_BREP_SHAPE_REPRESENTATION|FACETED_BREP_SHAPE_REPRESENTATION|rep_1", "SHAPE_REPRESENTATION|ADVANCED_BREP_SHAPE_REPRESENTATION|FACETED_BREP_SHAPE_REPRESENTATION|rep_2"
+structure["REPRESENTATION_RELATIONSHIP_WITH_TRANSFORMATION"] = "ITEM_DEFINED_TRANSFORMATION|transformation",
+
+#X = ITEM_DEFINED_TRANSFORMATION('SIEM-PM-L00135:1','SIEM-PM-L00135:1',#151,#977);
+structure["ITEM_DEFINED_TRANSFORMATION"] = "str|name", "str|desc", "AXIS2_PLACEMENT_3D|item_1", "AXIS2_PLACEMENT_3D|item_2"
 
 #X = ADVANCED_BREP_SHAPE_REPRESENTATION('',(#11,#15),#345);
+def init_mesh():
+    global mesh
+    mesh = mesh_utils.MeshBuffer()
+    edge_curve_cache.clear()
+    vertex_ids.clear()
+
+'''
+name of the product of a shape, SHAPE_DEFINITION_REPRESENTATION -> PRODUCT_DEFINITION_SHAPE -> PRODUCT_DEFINITION -> PRODUCT
+from the instance loading the shape: its shape definition representation, or the
+SHAPE_REPRESENTATION_RELATIONSHIP to the shape representation of its shape definition representation
+returns None if the shape is not found on a product
+'''
+def get_shape_product_name(instance):
+    parent = instance["parent"]["instance"] if instance.get("parent") else None
+    if not parent:
+        return None
+    definition = None
+    if parent["name"] == "SHAPE_DEFINITION_REPRESENTATION":
+        definition = parent
+    elif parent["name"] == "SHAPE_REPRESENTATION_RELATIONSHIP" and len(parent["params"]) == 4:
+        representation = get_instance(parent["params"][3])
+        if representation["data"]:
+            definition = representation["data"].get("shape_definition_representation")
+    if not definition:
+        return None
+    return get_instance_value(definition, ["product_definition_shape", "product_definition", "formation", "product", "name"])
+
 def init_object(instance):
-    global object_name
+    global object_name, object_shape
+    # the last product loaded is only kept for the shapes out of the product tree
+    object_name = get_shape_product_name(instance) or object_name
     print ("Loading Object " + object_name)
-    global vertexs, edges, faces
-    vertexs = []
-    edges = []
-    faces = []
+    object_shape = instance["number"]
+    init_mesh()
+    del pending_solids[:]
     
     for i in range(0,3):
         object_location[i] = 0
     
 def import_shape(instance):
     global object_name
+    if stream_solids:
+        # the index its object will have, for get_assembly_occurrences
+        imported_shapes[instance["number"]] = len(pending_objects)
+        pending_objects.append((object_name, list(pending_solids), instance))
+        return
+    if parallel_solids and not proxy_import and is_parallel_available():
+        pending_objects.append((object_name, list(pending_solids), instance))
+        return
     print ("Importing: " + object_name)
-    import_data_to_blender()
+    imported_shapes[instance["number"]] = collect_object()
 
 structure["ADVANCED_BREP_SHAPE_REPRESENTATION"] = "unknown1", "AXIS2_PLACEMENT_3D|MANIFOLD_SOLID_BREP|data", "multiple|unknown2"
 structure_func["ADVANCED_BREP_SHAPE_REPRESENTATION"] = {"init" : init_object, "first_load" : import_shape }
 
-#X = SHAPE_REPRESENTATION('',(#37,#977,#1751,#3984),#36);
-def set_shape_name(instance):
-    definition = get_instance_value(instance, "shape_definition_representation")
-    if definition:
-        set_product_name(get_instance_value(definition,["product_definition_shape", "product_definition", "formation", "product"]))
-                    
+#X = FACETED_BREP_SHAPE_REPRESENTATION('',(#11,#15),#345);
+structure["FACETED_BREP_SHAPE_REPRESENTATION"] = "unknown1", "AXIS2_PLACEMENT_3D|FACETED_BREP|data", "multiple|unknown2"
+structure_func["FACETED_BREP_SHAPE_REPRESENTATION"] = structure_func["ADVANCED_BREP_SHAPE_REPRESENTATION"]
 
+#X = SHAPE_REPRESENTATION('',(#37,#977,#1751,#3984),#36);
 structure["SHAPE_REPRESENTATION"] = "unknown1", "AXIS2_PLACEMENT_3D|data", "multiple|unknown2"
-structure_func["SHAPE_REPRESENTATION"] = {"load" : set_shape_name }
 
 #X = SHAPE_DEFINITION_REPRESENTATION(#4,#10);
 def set_shape_representation_parent(instance):
@@ -1526,7 +3412,7 @@ def set_shape_representation_parent(instance):
     if shape["name"] == "SHAPE_REPRESENTATION":
         shape["data"]["shape_definition_representation"] = instance
 
-structure["SHAPE_DEFINITION_REPRESENTATION"] = "PRODUCT_DEFINITION_SHAPE|product_definition_shape", "SHAPE_REPRESENTATION|ADVANCED_BREP_SHAPE_REPRESENTATION|representation"
+structure["SHAPE_DEFINITION_REPRESENTATION"] = "PRODUCT_DEFINITION_SHAPE|product_definition_shape", "SHAPE_REPRESENTATION|ADVANCED_BREP_SHAPE_REPRESENTATION|FACETED_BREP_SHAPE_REPRESENTATION|representation"
 structure_func["SHAPE_DEFINITION_REPRESENTATION"] = {"first_load" : set_shape_representation_parent}
 
 #X = MECHANICAL_DESIGN_GEOMETRIC_PRESENTATION_REPRESENTATION('',(#78,#887,#1748,#2092,#2394,#2684,#2685,#3225,#3226,#3227,#3228,#3969),#67);
@@ -1558,7 +3444,7 @@ structure["COLOUR_RGB"] = "unknown", "red", "green", "blue"
 structure["CURVE_STYLE"] = "unknown","DRAUGHTING_PRE_DEFINED_CURVE_FONT|curve_font", "unknown_func", "COLOUR_RGB|color"
 
 #X = STYLED_ITEM('',(#77),#73);
-structure["STYLED_ITEM"] = "unknown1", "PRESENTATION_STYLE_ASSIGNMENT|data", "TRIMMED_CURVE|MANIFOLD_SOLID_BREP|ADVANCED_FACE|object"
+structure["STYLED_ITEM"] = "unknown1", "PRESENTATION_STYLE_ASSIGNMENT|data", "TRIMMED_CURVE|MANIFOLD_SOLID_BREP|FACETED_BREP|ADVANCED_FACE|FACE|object"
 
 #X = DRAUGHTING_PRE_DEFINED_CURVE_FONT('continuous');
 structure["DRAUGHTING_PRE_DEFINED_CURVE_FONT"] = "unkown",
@@ -1570,7 +3456,8 @@ structure["TRIMMED_CURVE"] = "unknown1", "LINE|line", "func|CARTESIAN_POINT|p1_d
 structure["CYLINDRICAL_SURFACE"] = "unknown1", "AXIS2_PLACEMENT_3D|axis2_placement_3d", "float|radi"
   
 #X = SHAPE_REPRESENTATION_RELATIONSHIP('SRR','None',#2093,#1838);
-structure["SHAPE_REPRESENTATION_RELATIONSHIP"] = "unknown1", "unknown2", "ADVANCED_BREP_SHAPE_REPRESENTATION|GEOMETRICALLY_BOUNDED_SURFACE_SHAPE_REPRESENTATION|shape","SHAPE_REPRESENTATION|shape_representation"
+#X = (... SHAPE_REPRESENTATION_RELATIONSHIP() ), as part of a complex instance
+structure["SHAPE_REPRESENTATION_RELATIONSHIP"] = [(), ("unknown1", "unknown2", "ADVANCED_BREP_SHAPE_REPRESENTATION|FACETED_BREP_SHAPE_REPRESENTATION|GEOMETRICALLY_BOUNDED_SURFACE_SHAPE_REPRESENTATION|shape","SHAPE_REPRESENTATION|shape_representation")]
 
 #X = GEOMETRICALLY_BOUNDED_SURFACE_SHAPE_REPRESENTATION('GBSSR',(#80),#36);
 structure["GEOMETRICALLY_BOUNDED_SURFACE_SHAPE_REPRESENTATION"] = "unknown", "GEOMETRIC_SET|geomteric_set", "multiple|unknown2"
@@ -1619,7 +3506,7 @@ structure["SI_UNIT"] = "scale", "unit"
 structure["BOUNDED_CURVE"] = None
 
 #(B_SPLINE_CURVE(2,(#78,#79,#80,#81,#82,#83,#84),.UNSPECIFIED.,.F.,.F.))
-structure["B_SPLINE_CURVE"] = "unknown", "CARTESIAN_POINT|data", "unknown2", "unknow3", "unknown4"
+structure["B_SPLINE_CURVE"] = "int|degree", "CARTESIAN_POINT|control_points", "curve_form", "closed_curve", "self_intersect"
 
 #(CURVE())
 structure["CURVE"] = None
@@ -1628,7 +3515,7 @@ structure["CURVE"] = None
 structure["GEOMETRIC_REPRESENTATION_ITEM"] = None
 
 #RATIONAL_B_SPLINE_CURVE((1.,0.5,1.,0.5,1.,0.5,1.))
-structure["RATIONAL_B_SPLINE_CURVE"] = "float|data",
+structure["RATIONAL_B_SPLINE_CURVE"] = "float|weights",
 
 #(REPRESENTATION_ITEM(''))
 structure["REPRESENTATION_ITEM"] = "str|unknown",
@@ -1636,12 +3523,108 @@ structure["REPRESENTATION_ITEM"] = "str|unknown",
 #( REPRESENTATION_CONTEXT('Context #1','3D Context with UNIT and UNCERTAINTY') )
 structure["REPRESENTATION_CONTEXT"] = "str|name", "str|desc"
 
+### ASSEMBLIES ###
+
+'''
+4x4 transform (column vectors) from the local frame of an AXIS2_PLACEMENT_3D to its parent frame
+'''
+def get_placement_transform(instance):
+    pm = get_placement_matrix(instance)
+    m = np.identity(4)
+    m[:3,0] = pm[1,:3]
+    m[:3,1] = pm[0,:3]
+    m[:3,2] = pm[2,:3]
+    m[:3,3] = pm[3,:3]
+    return m
+
+'''
+transform from a component shape representation to its assembly, of a
+(REPRESENTATION_RELATIONSHIP REPRESENTATION_RELATIONSHIP_WITH_TRANSFORMATION ...) complex instance
+the item_1 placement of the component is moved to the item_2 placement of the assembly
+'''
+def get_relationship_transform(relation):
+    sub = get_multiple_instance(relation, "REPRESENTATION_RELATIONSHIP_WITH_TRANSFORMATION")
+    transformation = get_instance_value(sub, "transformation") if sub else None
+    if not transformation or transformation["name"] != "ITEM_DEFINED_TRANSFORMATION":
+        return np.identity(4)
+    return np.dot(get_placement_transform(get_instance_value(transformation, "item_2")),
+                  np.linalg.inv(get_placement_transform(get_instance_value(transformation, "item_1"))))
+
+'''
+occurrences of the imported shapes on the product tree
+the tree is built from the CONTEXT_DEPENDENT_SHAPE_REPRESENTATION (component shape representation
+on an assembly one, with its transform) and the SHAPE_REPRESENTATION_RELATIONSHIP (shape of a
+shape representation), and walked from the shape representations that are not components
+returns occurrences[shape number] = [(name, 4x4 transform), ...]
+'''
+def get_assembly_occurrences():
+    components = {}
+    is_component = set()
+    shapes = {}
+    for instance in instances:
+        if instance.get("name") == "CONTEXT_DEPENDENT_SHAPE_REPRESENTATION" and instance["data"]:
+            relation = get_instance_value(instance, "representation_relation")
+            sub = get_multiple_instance(relation, "REPRESENTATION_RELATIONSHIP")
+            if not sub or not sub["data"]:
+                continue
+            component = get_instance_value(sub, "rep_1")
+            assembly = get_instance_value(sub, "rep_2")
+            name = get_instance_value(instance, ["product_definition_shape", "product_definition", "name"])
+            components.setdefault(assembly["number"], []).append(
+                (component["number"], name, get_relationship_transform(relation)))
+            is_component.add(component["number"])
+        elif instance.get("name") == "SHAPE_REPRESENTATION_RELATIONSHIP" and instance["data"]:
+            shape = get_instance_value(instance, "shape")
+            representation = get_instance_value(instance, "shape_representation")
+            if shape and representation and shape["number"] in imported_shapes:
+                shapes.setdefault(representation["number"], []).append(shape["number"])
+
+    occurrences = {}
+
+    def add_occurrences(representation, name, transform, path):
+        if representation in path:
+            print ("Recursive assembly on " + representation)
+            return
+        if representation in imported_shapes:
+            occurrences.setdefault(representation, []).append((name, transform))
+        for shape in shapes.get(representation, []):
+            occurrences.setdefault(shape, []).append((name, transform))
+        for component, component_name, t in components.get(representation, []):
+            add_occurrences(component, component_name or name, np.dot(transform, t), path + [representation])
+
+    # shapes without shape representation are also roots
+    for representation in shapes.values():
+        is_component.update(representation)
+
+    for representation in sorted(set(components) | set(shapes) | set(imported_shapes)):
+        if not representation in is_component:
+            add_occurrences(representation, None, np.identity(4), [])
+    return occurrences
+
+### PROGRESS ###
+
+'''
+reports the progress to progress_callback, in solids if done and total are not given
+'''
+def report_progress(phase, done=None, total=None):
+    if progress_callback:
+        if done is None:
+            done, total = solids_done, solid_count
+        progress_callback(phase, done, total)
+
+def solid_tessellated():
+    global solids_done
+    solids_done = solids_done + 1
+    report_progress("tessellate")
+
 ### DATA PROCESSING ###
 
-def import_data_to_blender():
+'''
+adds the mesh of the current object to collected_objects, returns its index
+'''
+def collect_object():
     
     global object_name, object_location
-    global vertexs, edges, faces    
                 
     if not object_name:
         object_name = "Unknown Object"
@@ -1650,51 +3633,74 @@ def import_data_to_blender():
     print ("Importing " + object_name)
     #print (object_location)
             
-    me = bpy.data.meshes.new(object_name)    
-    ob = bpy.data.objects.new(object_name, me)
-    scn = bpy.context.scene
-    scn.objects.link(ob)
-    scn.objects.active = ob
-    ob.select = True 
-
-    #print (vertexs)
-    #print (edges)
-    #print (faces)
-    me.from_pydata(vertexs, edges, faces)
-    
-    me.validate()    
-    me.update()
-
-    
-    #remove doubles    
-    bm = bmesh.new()   # create an empty BMesh
-    bm.from_mesh(me)   # fill it in from a Mesh
-    
-    bmesh.ops.remove_doubles(bm, verts=bm.verts, dist=0.1)
-    
-    # Finish up, write the bmesh back to the mesh
-    bm.to_mesh(me)
-    bm.free()  # free and prevent further access
-    
-    me.validate()    
-    me.update()
-    
-    
-
+    if len(vertex_ids) < mesh.vert_count and not (proxy_import and object_shape not in full_shapes):
+        # not all the verts are shared between faces, weld them
+        mesh.weld(get_tolerance())
+    report_progress("mesh")
+    materials = get_object_materials()
+
+    collected_objects.append((object_name, object_shape, mesh.verts.array, mesh.edges.array) +
+                             mesh.get_flat_faces() + (materials,))
+    if object_callback:
+        object_callback(len(collected_objects) - 1, collected_objects[-1])
+    return len(collected_objects) - 1
 
+'''
+reads the plane angle unit of the file, angles are in radians unless
+a CONVERSION_BASED_UNIT('DEGREE') PLANE_ANGLE_UNIT is found
+'''
+def set_plane_angle_unit():
+    global plane_angle_factor
+    plane_angle_factor = 1.0
+    for instance in instances:
+        if "multiple" in instance and get_multiple_instance(instance, "PLANE_ANGLE_UNIT"):
+            unit = get_multiple_instance(instance, "CONVERSION_BASED_UNIT")
+            if unit and unit["params"][0].strip("'").upper() in ["DEGREE", "DEGREES"]:
+                plane_angle_factor = math.pi/180
+                
+'''
+reads the length tolerance of the file, the widest UNCERTAINTY_MEASURE_WITH_UNIT found
+'''
+def set_length_tolerance():
+    global length_tolerance
+    length_tolerance = min_length_tolerance
+    for instance in instances:
+        if instance["name"] == "UNCERTAINTY_MEASURE_WITH_UNIT":
+            try:
+                length_tolerance = max(length_tolerance, float(instance["params"][0][0]))
+            except (ValueError, IndexError):
+                print ("Unknown uncertainty measure", instance["params"][0])
 
-          
 def process_stp_data():
+    global solid_count, solids_done
+    imported_shapes.clear()
+    read_colours()
+    solid_count = sum(1 for instance in instances if instance["name"] in solid_instances)
+    solids_done = 0
+    report_progress("load")
+
     #found as parent nodes
+    set_plane_angle_unit()
+    set_length_tolerance()
         
-    for instance in instances:            
-        if instance["name"] == "SHAPE_DEFINITION_REPRESENTATION":
-            load_instance(instance)
-            
-    for instance in instances:
-        if instance["name"] == "SHAPE_REPRESENTATION_RELATIONSHIP":
-            load_instance(instance)
-            
+    try:
+        for instance in instances:            
+            if instance["name"] == "SHAPE_DEFINITION_REPRESENTATION":
+                load_instance(instance)
+                
+        for instance in instances:
+            if instance["name"] == "SHAPE_REPRESENTATION_RELATIONSHIP":
+                load_instance(instance)
+
+        for instance in instances:
+            if instance["name"] == "CONTEXT_DEPENDENT_SHAPE_REPRESENTATION":
+                load_instance(instance)
+
+        if not stream_solids:
+            import_pending_objects()
+    finally:
+        # the workers are not left running on an error
+        close_process_pool()
     return
                
             
@@ -1707,37 +3713,133 @@ def process_stp_data():
 
 ### MAIN FUNC ####
 
+'''
+reads and tessellates a file, without blender
+returns (path, name, objects, occurrences), the objects as in collected_objects
+and occurrences[object index] = [(name, 4x4 transform), ...], or None if the file is not read
+'''
 def read_stp(filepath): 
+    if not read_stp_instances(filepath):
+        return
     
+    process_stp_data()
+
+    occurrences = get_object_occurrences()
+    print ("Done!")
+    return filepath, get_file_object_name(filepath), list(collected_objects), occurrences
+
+'''
+reads the instances of a file to instances, without loading them
+returns False if the file is not ISO-10303-21
+'''
+def read_stp_instances(filepath):
+    global instances
     instances=[]
-   
-    f = open(filepath, 'rb')
-    line = read_stp_line(f)
-    if (line == "ISO-10303-21"):
-        print ("Reading ISO-10303-21 file")
-    else:
-        print ("Not recognized " + line + "- abort")
+    del collected_objects[:]
+
+    with open(filepath, 'rb') as f:
+        line = read_stp_line(f)
+        if (line == "ISO-10303-21"):
+            print ("Reading ISO-10303-21 file")
+        else:
+            print ("Not recognized " + line + "- abort")
+            return False
+
+        line = read_stp_line(f)
+        if (line == "HEADER"):
+            read_stp_header(f)
+        else:
+            print ("Error: Expected header")
+
+        line = read_stp_line(f)
+        if (line == "DATA"):
+            read_stp_data(f)
+        else:
+            print ("Error Expected data")
+    return True
+
+'''
+True if the file starts as an ISO-10303-21 file
+'''
+def is_stp_file(filepath):
+    with open(filepath, 'rb') as f:
+        return f.read(64).lstrip().startswith(b"ISO-10303-21")
+
+'''
+occurrences of the imported shapes by its object index, see get_assembly_occurrences
+'''
+def get_object_occurrences():
+    occurrences = {}
+    for shape, shape_occurrences in get_assembly_occurrences().items():
+        occurrences[imported_shapes[shape]] = shape_occurrences
+    return occurrences
+
+'''
+reads a file as read_stp, yielding its objects one at a time as (index, object, occurrences)
+the object is as in collected_objects, occurrences = [(name, 4x4 transform), ...], empty if no assembly places it
+the products and assemblies are loaded first, the solids of each object are loaded and tessellated when
+the object is requested and released after it, so only one object is held besides the instances of the file
+the objects are not kept on collected_objects, and only one file can be read at a time
+'''
+def iter_stp(filepath):
+    global instances, stream_solids, parallel_solids
+    if not read_stp_instances(filepath):
         return
 
-    line = read_stp_line(f)
-    if (line == "HEADER"):
-        read_stp_header(f)
-    else:
-        print ("Error: Expected header")
+    saved = parallel_solids
+    try:
+        stream_solids, parallel_solids = 1, 0
+        process_stp_data()
+        stream_solids = 0
+        occurrences = get_object_occurrences()
+        for index, data in stream_pending_objects():
+            yield index, data, occurrences.get(index, [])
+        print ("Done!")
+    finally:
+        stream_solids, parallel_solids = 0, saved
+        # created by parallel_faces while streaming
+        close_process_pool()
+        del pending_objects[:]
+        del pending_solids[:]
+        release_instances()
+        instances = []
+
+def get_file_object_name(filepath):
+    return os.path.splitext(os.path.basename(filepath))[0]
 
-    line = read_stp_line(f)
-    if (line == "DATA"):
-        read_stp_data(f)
-    else:
-        print ("Error Expected data")
-    
-    process_stp_data()
-    
-    print ("Done!")
+'''
+reads a file on a worker process, as read_stp without a process pool of its own
+'''
+def read_stp_job(filepath):
+    global parallel_faces, parallel_solids
+    parallel_faces = 0
+    parallel_solids = 0
+    return read_stp(filepath)
+
+### BACKGROUND READING ###
+
+'''
+reads a file as read_stp_job, sending the progress and the objects to the messages queue
+("progress", phase, done, total), ("object", index, object) as soon as each object is tessellated,
+and ("done", occurrences) or ("error", message) at the end
+'''
+def read_stp_background_job(filepath, messages):
+    global progress_callback, object_callback
+    progress_callback = lambda phase, done, total: messages.put(("progress", phase, done, total))
+    object_callback = lambda index, data: messages.put(("object", index, data))
+    try:
+        result = read_stp_job(filepath)
+        if result is None:
+            messages.put(("error", "Not a ISO-10303-21 file"))
+        else:
+            messages.put(("done", result[3]))
+    except Exception as e:
+        messages.put(("error", "%s: %s" % (type(e).__name__, e)))
 
 if __name__ == '__main__':
     import sys
     import bpy
+    import blender_utils
     
     print ()
     print ()
@@ -1754,14 +3856,14 @@ if __name__ == '__main__':
     #filepaths = sys.argv[sys.argv.index('--') + 1:]
     
     #for filepath in filepaths:
-    #    read_stp(filepath)
+    #    blender_utils.import_stp_file(filepath)
     
     test_folder = "/home/jaume/src/mechanical-blender-addons/io_scene_stp/test_files/"
         
-    #read_stp(test_folder + "cube.stp") #OK
-    #read_stp(test_folder + "torus.stp") #OK
-    #read_stp(test_folder + "revolve.stp") #UNFINISHED
-    read_stp(test_folder + "cylinder.stp")  #OK
-    #read_stp(test_folder + "SIEM-CONJ-L00025.stp")  "NOK"
-    #read_stp(test_folder + "inafag_6010_brbohxyclh6y8oik8swwpry0n.stp")
+    #blender_utils.import_stp_file(test_folder + "cube.stp") #OK
+    #blender_utils.import_stp_file(test_folder + "torus.stp") #OK
+    #blender_utils.import_stp_file(test_folder + "revolve.stp") #OK
+    blender_utils.import_stp_file(test_folder + "cylinder.stp")  #OK
+    #blender_utils.import_stp_file(test_folder + "SIEM-CONJ-L00025.stp")  "NOK"
+    #blender_utils.import_stp_file(test_folder + "inafag_6010_brbohxyclh6y8oik8swwpry0n.stp")
     
\ No newline at end of file
@@ -0,0 +1,225 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# <pep8 compliant>
+
+"""
+Writes meshes as faceted brep STP files
+
+A mesh is a (name, verts, flat faces, face lengths) tuple of numpy buffers, as the ones
+read by stp_utils or taken from blender objects by blender_utils. Each mesh is written as
+a product with a FACETED_BREP, its faces are POLY_LOOPs of shared CARTESIAN_POINTs.
+A mesh with boundary edges does not bound a solid, it is written as an OPEN_SHELL of a
+SHELL_BASED_SURFACE_MODEL instead.
+"""
+
+import multiprocessing
+import os
+import time
+
+import numpy as np
+
+try:
+    from . import stp_utils
+except ImportError:
+    import stp_utils
+
+### SETTINGS ###
+
+'''
+decimals of the coordinates, points equal with this precision are written once
+'''
+precision = 6
+
+'''
+bytes buffered by the file writer
+'''
+buffer_size = 1 << 20
+
+'''
+records formatted at once by the line generator
+'''
+chunk_size = 10000
+
+'''
+files of write_stp_files, read by the worker processes (inherited when forked)
+'''
+pending_files = []
+
+### RECORDS ###
+
+'''
+stp string of a name
+'''
+def get_stp_string(name):
+    name = name.replace("\\", "\\\\").replace("'", "''")
+    return "'" + "".join(c if ord(c) < 128 else ("\\X2\\%04X\\X0\\" if ord(c) < 0x10000 else "\\X4\\%08X\\X0\\") % ord(c)
+                         for c in name) + "'"
+
+'''
+lines of the records of the rows, formatted at once by chunks
+'''
+def format_records(fmt, rows):
+    for i in range(0, len(rows), chunk_size):
+        yield "".join(map(fmt.__mod__, map(tuple, rows[i:i + chunk_size].tolist())))
+
+'''
+points of the verts written once, returns (unique verts, index of each vert on the unique verts)
+'''
+def get_unique_points(verts):
+    rounded = np.round(np.asarray(verts, dtype=float), precision) + 0.0
+    points, index = np.unique(rounded.reshape(-1, 3), axis=0, return_inverse=True)
+    return points, index.reshape(-1)
+
+'''
+True if the faces bound a solid: no boundary edges, each edge between two points is used by
+an even number of faces (two on a manifold mesh)
+'''
+def is_closed_mesh(index, flat, lengths):
+    ends = np.cumsum(lengths)
+    following = np.arange(1, len(flat) + 1)
+    following[ends - 1] = ends - lengths
+    points = index[flat]
+    a = np.minimum(points, points[following])
+    b = np.maximum(points, points[following])
+    edges = (a*(index.max() + 1) + b)[a != b]
+    counts = np.unique(edges, return_counts=True)[1]
+    return bool(np.all(counts % 2 == 0))
+
+def generate_header(name):
+    yield "ISO-10303-21;\nHEADER;\n"
+    yield "FILE_DESCRIPTION(('faceted brep'),'2;1');\n"
+    yield "FILE_NAME(%s,'%s',(''),(''),'io_scene_stp','io_scene_stp','');\n" % (
+        get_stp_string(name), time.strftime("%Y-%m-%dT%H:%M:%S"))
+    yield "FILE_SCHEMA(('AUTOMOTIVE_DESIGN { 1 0 10303 214 1 1 1 1 }'));\nENDSEC;\nDATA;\n"
+
+'''
+records of the representation context, on numbers #1 to #8
+'''
+def generate_context():
+    yield ("#1=APPLICATION_CONTEXT('core data for automotive mechanical design processes');\n"
+           "#2=APPLICATION_PROTOCOL_DEFINITION('international standard','automotive_design',2000,#1);\n"
+           "#3=MECHANICAL_CONTEXT('',#1,'mechanical');\n"
+           "#4=PRODUCT_DEFINITION_CONTEXT('part definition',#1,'design');\n"
+           "#5=(LENGTH_UNIT()NAMED_UNIT(*)SI_UNIT(.MILLI.,.METRE.));\n"
+           "#6=(NAMED_UNIT(*)PLANE_ANGLE_UNIT()SI_UNIT($,.RADIAN.));\n"
+           "#7=UNCERTAINTY_MEASURE_WITH_UNIT(LENGTH_MEASURE(%s),#5,'distance_accuracy_value','');\n"
+           "#8=(GEOMETRIC_REPRESENTATION_CONTEXT(3)GLOBAL_UNCERTAINTY_ASSIGNED_CONTEXT((#7))"
+           "GLOBAL_UNIT_ASSIGNED_CONTEXT((#5,#6))REPRESENTATION_CONTEXT('',''));\n") % ("1.E-%02d" % precision)
+
+'''
+records of a mesh, numbered from first, yields lines and returns the next free number
+points: one for each unique vert
+faces: POLY_LOOP, FACE_OUTER_BOUND and FACE for each face, grouped by its number of verts
+product: placement, FACETED_BREP, CLOSED_SHELL, representation and product definition, or
+SHELL_BASED_SURFACE_MODEL, OPEN_SHELL and its representation if the mesh is not closed
+'''
+def generate_mesh(mesh, first):
+    name, verts, flat, lengths = mesh
+    flat = np.asarray(flat, dtype=np.int64)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    points, index = get_unique_points(verts)
+    point_ids = np.arange(first, first + len(points))
+    yield from format_records("#%d=CARTESIAN_POINT('',(%." + str(precision) + "f,%." + str(precision) + "f,%." +
+                              str(precision) + "f));\n", np.column_stack((point_ids, points)))
+    n = first + len(points)
+
+    face_ids = []
+    starts = np.cumsum(lengths) - lengths
+    for length in np.unique(lengths):
+        s = starts[lengths == length]
+        loops = point_ids[index[flat[s[:, None] + np.arange(length)]]]
+        loop_ids = n + 3*np.arange(len(s))
+        rows = np.column_stack((loop_ids, loops, loop_ids + 1, loop_ids, loop_ids + 2, loop_ids + 1))
+        fmt = ("#%d=POLY_LOOP('',(" + ",".join(["#%d"]*length) + "));\n"
+               "#%d=FACE_OUTER_BOUND('',#%d,.T.);\n#%d=FACE('',(#%d));\n")
+        yield from format_records(fmt, rows)
+        face_ids.append(loop_ids + 2)
+        n += 3*len(s)
+
+    face_ids = np.concatenate(face_ids + [np.zeros(0, dtype=np.int64)])
+    closed = is_closed_mesh(index, flat, lengths)
+    if not closed:
+        print ("Mesh " + name + " is not closed, written as a surface model")
+    yield "#%d=%s('',(" % (n, "CLOSED_SHELL" if closed else "OPEN_SHELL")
+    yield from format_records("#%d,", face_ids[:-1, None])
+    yield "#%d));\n" % face_ids[-1]
+    name = get_stp_string(name)
+    if closed:
+        yield "#{1}=FACETED_BREP({name},#{0});\n".format(n, n + 1, name=name)
+    else:
+        yield "#{1}=SHELL_BASED_SURFACE_MODEL({name},(#{0}));\n".format(n, n + 1, name=name)
+    yield ("#{2}=CARTESIAN_POINT('',(0.,0.,0.));\n"
+           "#{3}=DIRECTION('',(0.,0.,1.));\n"
+           "#{4}=DIRECTION('',(1.,0.,0.));\n"
+           "#{5}=AXIS2_PLACEMENT_3D('',#{2},#{3},#{4});\n"
+           "#{6}={representation}({name},(#{5},#{1}),#8);\n"
+           "#{7}=PRODUCT({name},{name},'',(#3));\n"
+           "#{8}=PRODUCT_DEFINITION_FORMATION('','',#{7});\n"
+           "#{9}=PRODUCT_DEFINITION('design','',#{8},#4);\n"
+           "#{10}=PRODUCT_DEFINITION_SHAPE('','',#{9});\n"
+           "#{11}=SHAPE_DEFINITION_REPRESENTATION(#{10},#{6});\n"
+           "#{12}=PRODUCT_RELATED_PRODUCT_CATEGORY('part',$,(#{7}));\n").format(
+               *range(n, n + 13), name=name,
+               representation="FACETED_BREP_SHAPE_REPRESENTATION" if closed else "MANIFOLD_SURFACE_SHAPE_REPRESENTATION")
+    return n + 13
+
+'''
+generator of the lines of a stp file with the meshes, each mesh is formatted when its lines are needed
+'''
+def generate_stp_lines(meshes, name=""):
+    yield from generate_header(name)
+    yield from generate_context()
+    n = 9
+    for mesh in meshes:
+        if len(mesh[3]) == 0:
+            continue
+        n = yield from generate_mesh(mesh, n)
+    yield "ENDSEC;\nEND-ISO-10303-21;\n"
+
+'''
+writes the meshes on a faceted brep stp file, meshes can be any iterable (a generator is consumed once)
+'''
+def write_stp(filepath, meshes):
+    name = os.path.splitext(os.path.basename(filepath))[0]
+    with open(filepath, "w", encoding="ascii", buffering=buffer_size) as f:
+        f.writelines(generate_stp_lines(meshes, name))
+
+def write_pending_file(i):
+    filepath, meshes = pending_files[i]
+    write_stp(filepath, meshes)
+    return filepath
+
+'''
+writes several files, a list of (filepath, meshes), on workers processes (all the cpus if 0, serial if 1)
+the meshes are not copied to the workers, they are inherited by the forked processes
+'''
+def write_stp_files(files, workers=0):
+    if len(files) < 2 or workers == 1 or not stp_utils.is_parallel_available():
+        for filepath, meshes in files:
+            write_stp(filepath, meshes)
+        return
+
+    pending_files[:] = files
+    try:
+        context = multiprocessing.get_context("fork")
+        with context.Pool(workers or None) as pool:
+            for filepath in pool.imap_unordered(write_pending_file, range(0, len(files))):
+                print ("Written " + filepath)
+    finally:
+        del pending_files[:]